@@ -32,3 +32,52 @@ PROCESS_TASK_URL = f"http://{URL}"
 
 assert API_DOMAIN, "API_DOMAIN is not defined."
 assert PROCESS_TASK_API_PATH, "PROCESS_TASK_API_PATH is not defined."
+
+# Documents allowed to wait for a pipeline stage. The limit moves between
+# the bounds from the process_task response times and errors, the upper
+# bound is the former static MAX_UPLOADED_DOCS.
+ADMISSION_MAX_LIMIT = float(os.getenv("MAX_UPLOADED_DOCS", "100"))
+ADMISSION_MIN_LIMIT = float(
+    os.getenv("ADMISSION_MIN_LIMIT", str(min(10, ADMISSION_MAX_LIMIT))))
+ADMISSION_INITIAL_LIMIT = float(
+    os.getenv("ADMISSION_INITIAL_LIMIT", str(ADMISSION_MAX_LIMIT / 2)))
+# Added to the limit over a limit's worth of fast successful calls, and
+# factor applied to it on a slow or failed call
+ADMISSION_INCREASE = float(os.getenv("ADMISSION_INCREASE", "1"))
+ADMISSION_DECREASE_FACTOR = float(
+    os.getenv("ADMISSION_DECREASE_FACTOR", "0.7"))
+# process_task only queues the pipeline, a slower answer means the
+# upload service is saturated
+ADMISSION_LATENCY_TARGET_SECONDS = float(
+    os.getenv("ADMISSION_LATENCY_TARGET_SECONDS", "5"))
+ADMISSION_COOLDOWN_SECONDS = float(
+    os.getenv("ADMISSION_COOLDOWN_SECONDS", "10"))
+# Bounds of the Retry-After of the rejected messages
+ADMISSION_MIN_RETRY_SECONDS = float(
+    os.getenv("ADMISSION_MIN_RETRY_SECONDS", "10"))
+ADMISSION_MAX_RETRY_SECONDS = float(
+    os.getenv("ADMISSION_MAX_RETRY_SECONDS", "600"))
+# Share of the limit bulk uploads may fill, the rest is kept for the
+# normal uploads arriving during a mass ingestion
+ADMISSION_BULK_SHARE = float(os.getenv("ADMISSION_BULK_SHARE", "0.5"))
+
+# "push" forwards the messages posted to /queue/publish by the push
+# subscription, "pull" pulls them from QUEUE_SUBSCRIPTION_ID in batches
+QUEUE_MODE = os.getenv("QUEUE_MODE", "push")
+QUEUE_SUBSCRIPTION_ID = os.getenv("QUEUE_SUBSCRIPTION_ID", "queue-topic-pull")
+# Documents merged into one process_task call, and the longest a batch
+# waits to fill up
+QUEUE_PULL_BATCH_SIZE = int(os.getenv("QUEUE_PULL_BATCH_SIZE", "20"))
+QUEUE_PULL_MAX_WAIT_SECONDS = float(
+    os.getenv("QUEUE_PULL_MAX_WAIT_SECONDS", "2"))
+# Messages pulled and not yet acknowledged, the prefetch depth
+QUEUE_PULL_MAX_MESSAGES = int(os.getenv("QUEUE_PULL_MAX_MESSAGES", "100"))
+# A batch not accepted within the lease is handed back to Pub/Sub
+QUEUE_PULL_MAX_LEASE_SECONDS = int(
+    os.getenv("QUEUE_PULL_MAX_LEASE_SECONDS", "3600"))
+QUEUE_PULL_RETRY_SECONDS = float(os.getenv("QUEUE_PULL_RETRY_SECONDS", "30"))
+
+# process_task only persists and queues the pipeline, a forward taking
+# longer fails and the message is delivered again
+PROCESS_TASK_TIMEOUT_SECONDS = float(
+    os.getenv("PROCESS_TASK_TIMEOUT_SECONDS", "30"))
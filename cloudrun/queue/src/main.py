@@ -22,19 +22,38 @@ import asyncio
 import time
 import config
 from common.utils.logging_handler import Logger
+from common.utils.metrics import metrics_response
 from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Request, status
 from routes import queue
+from utils.pull_consumer import get_batch_consumer
 
 # app = FastAPI(docs_url="/docs", redoc_url="/redoc", openapi_url="/openapi.json")
 app = FastAPI(title="Queue Task Dispatcher")
 
 
+@app.on_event("startup")
+async def start_pull_consumer():
+  if config.QUEUE_MODE == "pull":
+    get_batch_consumer().start(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+def stop_pull_consumer():
+  if config.QUEUE_MODE == "pull":
+    get_batch_consumer().stop()
+
+
 @app.get("/ping")
 def health_check():
   return True
 
 
+@app.get("/metrics")
+def metrics():
+  return metrics_response()
+
+
 @app.post("/")
 def health_check_post():
   return True
@@ -16,23 +16,16 @@ limitations under the License.
 
 from fastapi import APIRouter, Request
 import base64
-import firebase_admin
-import os
-from firebase_admin import credentials, firestore, initialize_app
-import requests
 import json
+import math
 from fastapi import status, Response
+from fastapi.concurrency import run_in_threadpool
 from config import PROCESS_TASK_URL, API_DOMAIN
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
+from common.config import INFLIGHT_DOCUMENTS_COUNTER
+from common.models import CounterShard
 from common.utils.logging_handler import Logger
-
-PROJECT_ID = os.environ.get("PROJECT_ID")
-
-# Initializing Firebase client.
-firebase_admin.initialize_app(credentials.ApplicationDefault(), {
-    "projectId": PROJECT_ID,
-})
-db = firestore.client()
+from utils.dispatcher import dispatch, read_message, count_queued
 
 router = APIRouter(prefix="/queue", tags=["Queue"])
 
@@ -40,20 +33,16 @@ router = APIRouter(prefix="/queue", tags=["Queue"])
 @router.post("/publish")
 async def publish_msg(request: Request, response: Response):
   Logger.info(f"PROCESS_TASK_URL = {PROCESS_TASK_URL}")
-  print("PROCESS_TASK_URL = {PROCESS_TASK_URL}")
 
   body = await request.body()
   if not body or body == "":
     response.status_code = status.HTTP_400_BAD_REQUEST
     response.body = "Request has no body"
-    print(response.body)
+    Logger.error(f"error: {response.body}")
     return response
 
   try:
     envelope = await request.json()
-    print("Pub/Sub envelope:")
-    print(envelope)
-
   except json.JSONDecodeError:
     response.status_code = status.HTTP_400_BAD_REQUEST
     response.body = f"Unable to parse to JSON: {body}"
@@ -62,77 +51,54 @@ async def publish_msg(request: Request, response: Response):
   if not envelope:
     response.status_code = status.HTTP_400_BAD_REQUEST
     response.body = "No Pub/Sub message received"
-    print(f"error: {response.body}")
+    Logger.error(f"error: {response.body}")
     return response
 
   if not isinstance(envelope, dict) or "message" not in envelope:
     response.status_code = status.HTTP_400_BAD_REQUEST
     response.body = "invalid Pub/Sub message format"
-    print(f"error: {response.body}")
+    Logger.error(f"error: {response.body}")
     return response
 
-  doc_count = get_count()
-  print(f"doc_count = {doc_count}")
-
   pubsub_message = envelope["message"]
+  if not isinstance(pubsub_message, dict) or "data" not in pubsub_message:
+    # No Content
+    return ("", status.HTTP_204_NO_CONTENT)
 
-  if doc_count < int(os.environ["MAX_UPLOADED_DOCS"]):
-    print("Pub/Sub message:")
-    print(pubsub_message)
-
-    if isinstance(pubsub_message, dict) and "data" in pubsub_message:
-      msg_data = base64.b64decode(
-          pubsub_message["data"]).decode("utf-8").strip()
-      name = json.loads(msg_data)
-      payload = name.get("message_list")
-      request_body = {"configs": payload}
-
-      # Sample request body
-      # {
-      #   "configs": [
-      #     {
-      #       "case_id": "6075e034-2763-11ed-8345-aa81c3a89f04",
-      #       "uid": "jcdQmUqUKrcs8GGsmojp",
-      #       "gcs_url": "gs://sample-project-dev-document-upload/6075e034-2763-11ed-8345-aa81c3a89f04/jcdQmUqUKrcs8GGsmojp/arizona-application-form.pdf",
-      #       "context": "arizona"
-      #     }
-      #   ]
-      # }
-      print(f"Sending data to {PROCESS_TASK_URL}:")
-      print(request_body)
-
-      process_task_response = requests.post(PROCESS_TASK_URL, json=request_body)
-      print(f"Response from {PROCESS_TASK_URL}")
-      print(process_task_response.json())
-
-      response.status_code = process_task_response.status_code
-      return response
-
-  if doc_count > int(os.environ["MAX_UPLOADED_DOCS"]):
-    print(f"unacknowledge: {response.body}")
-    response.body = "Message not acknowledged"
-    response.status_code = status.HTTP_400_BAD_REQUEST
-    return response
-
-  # No Content
-  return ("", status.HTTP_204_NO_CONTENT)
-
-
-def get_count():
-  ct = 0
-  docs = db.collection(u"document").stream()
-  for doc in docs:
-    a = doc.to_dict()
-    #print(a)
-    #print("loop")
-    b = a["system_status"]
-    if type(b) == list:
-      #print("in loop")
-      for i in b:
-        l = len(b)
-        if l == 1:
-          #print("loop")
-          if i["stage"] == "uploaded" and i["status"] == STATUS_SUCCESS:
-            ct = ct + 1
-
-  return ct
+  try:
+    configs, priority = read_message(
+        base64.b64decode(pubsub_message["data"]))
+  except ValueError as e:
+    # Acknowledged like the pull consumer does, a message that cannot be
+    # read would be delivered again forever
+    Logger.error(f"Dropping message "
+                 f"{pubsub_message.get('messageId')}: {e}")
+    return Response("Message dropped", status_code=status.HTTP_200_OK)
+
+  status_code, retry_after = await dispatch(configs, priority)
+  if retry_after is not None:
+    # Not acknowledged, Pub/Sub delivers the message again
+    return Response(
+        "Message not acknowledged",
+        status_code=status_code,
+        headers={"Retry-After": str(math.ceil(retry_after))})
+  response.status_code = status_code
+  return response
+
+
+@router.post("/recount")
+async def recount():
+  """Scans the document collection and resets the in flight counter to
+  the documents dispatched and not yet picked up by a stage. Meant to
+  repair a counter that drifted, the scan reads every document.
+
+  Uploaded documents still waiting in Pub/Sub, those uploaded before the
+  counter existed included, are not counted here: the queue counts them
+  when it dispatches them. Documents dispatched before the counter existed
+  carry no mark and are not counted either, run it once after deploying to
+  drop what the former upload time increments left in the counter."""
+  count = await run_in_threadpool(count_queued)
+  await run_in_threadpool(CounterShard.reset, INFLIGHT_DOCUMENTS_COUNTER,
+                          count)
+  Logger.info(f"In flight counter reset to {count}")
+  return {"status": STATUS_SUCCESS, "count": count}
@@ -0,0 +1,75 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the queue endpoints
+"""
+import base64
+import json
+from unittest import mock
+from fastapi.testclient import TestClient
+from common.config import PRIORITY_BULK
+from main import app
+
+client = TestClient(app)
+
+CONFIGS = [{"case_id": "case", "uid": "uid"}]
+
+
+def envelope(message):
+  data = base64.b64encode(json.dumps(message).encode("utf-8")).decode()
+  return {"message": {"data": data}}
+
+
+def publish(message, result):
+
+  async def dispatch(configs, priority):
+    dispatch.calls.append((configs, priority))
+    return result
+
+  dispatch.calls = []
+  with mock.patch("routes.queue.dispatch", dispatch), \
+    mock.patch("routes.queue.Logger"):
+    response = client.post("/queue/publish", json=envelope(message))
+  return response, dispatch.calls
+
+
+def test_publish_forwards_the_documents():
+  response, calls = publish({
+      "message_list": CONFIGS,
+      "priority": PRIORITY_BULK
+  }, (200, None))
+  assert response.status_code == 200
+  assert calls == [(CONFIGS, PRIORITY_BULK)]
+
+
+def test_publish_not_admitted():
+  response, _ = publish({"message_list": CONFIGS}, (429, 12.2))
+  assert response.status_code == 429
+  assert response.headers["Retry-After"] == "13"
+
+
+def test_publish_undecodable_message_acknowledged():
+  data = base64.b64encode(b"not json").decode()
+  with mock.patch("routes.queue.dispatch") as dispatch, \
+    mock.patch("routes.queue.Logger"):
+    response = client.post(
+        "/queue/publish", json={"message": {
+            "data": data,
+            "messageId": "1"
+        }})
+  assert response.status_code == 200
+  dispatch.assert_not_called()
@@ -0,0 +1,149 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Adaptive admission of the queued documents into the pipeline"""
+
+import math
+import threading
+import time
+from typing import Optional
+from prometheus_client import Gauge
+from config import ADMISSION_MIN_LIMIT, ADMISSION_MAX_LIMIT, \
+  ADMISSION_INITIAL_LIMIT, ADMISSION_INCREASE, ADMISSION_DECREASE_FACTOR, \
+  ADMISSION_LATENCY_TARGET_SECONDS, ADMISSION_COOLDOWN_SECONDS, \
+  ADMISSION_MIN_RETRY_SECONDS, ADMISSION_MAX_RETRY_SECONDS
+
+ADMISSION_LIMIT = Gauge("queue_admission_limit",
+                        "Documents admitted to wait for a pipeline stage")
+COMPLETION_RATE = Gauge(
+    "queue_completion_rate",
+    "Documents per second picked up by the pipeline, moving average")
+
+# Weight of the last measure in the moving average of the completion rate
+COMPLETION_RATE_WEIGHT = 0.3
+
+
+class AdmissionController:
+  """Additive increase, multiplicative decrease of the number of documents
+  allowed to wait for the pipeline.
+
+  Every process_task call is reported with its duration and its status: a
+  fast successful call adds to the limit, a slow or failed one (5xx, 429)
+  cuts it, at most once per cooldown so a burst of failures of the same
+  saturation is not counted many times. The rate at which the waiting
+  documents are picked up gives the retry hint of the rejected messages.
+  """
+
+  def __init__(self,
+               min_limit: float = ADMISSION_MIN_LIMIT,
+               max_limit: float = ADMISSION_MAX_LIMIT,
+               initial_limit: float = ADMISSION_INITIAL_LIMIT,
+               increase: float = ADMISSION_INCREASE,
+               decrease_factor: float = ADMISSION_DECREASE_FACTOR,
+               latency_target: float = ADMISSION_LATENCY_TARGET_SECONDS,
+               cooldown: float = ADMISSION_COOLDOWN_SECONDS,
+               clock=time.monotonic):
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+    self.increase = increase
+    self.decrease_factor = decrease_factor
+    self.latency_target = latency_target
+    self.cooldown = cooldown
+    self.clock = clock
+    self.limit = min(max(initial_limit, min_limit), max_limit)
+    self.completion_rate = None
+    self._last_decrease = None
+    self._last_count = None
+    self._last_count_time = None
+    self._lock = threading.Lock()
+    ADMISSION_LIMIT.set(self.limit)
+
+  def admit(self, waiting: int, share: float = 1.0) -> Optional[float]:
+    """Decides if the documents of a message may join the waiting ones.
+    They are admitted while the waiting documents are under the limit
+    whatever their number, so a message larger than the limit gets in
+    once nothing is in flight.
+
+    Args:
+      waiting: documents dispatched and not yet picked up, the documents
+        of the message are not counted yet
+      share: part of the limit the documents of the message may fill
+    Returns:
+      None when admitted, otherwise the seconds to wait before retrying
+    """
+    with self._lock:
+      self._observe(waiting)
+      limit = self.limit * share
+      if waiting <= 0 or waiting < limit:
+        return None
+      return self._retry_after(waiting, limit)
+
+  def record(self, latency: float, status_code: int):
+    """Adjusts the limit from a process_task call"""
+    with self._lock:
+      saturated = status_code == 429 or status_code >= 500 or \
+        latency > self.latency_target
+      if not saturated:
+        # Additive increase spread over the documents of the limit
+        self.limit = min(self.max_limit,
+                         self.limit + self.increase / max(self.limit, 1))
+      else:
+        now = self.clock()
+        if self._last_decrease is None or \
+            now - self._last_decrease >= self.cooldown:
+          self._last_decrease = now
+          self.limit = max(self.min_limit,
+                           self.limit * self.decrease_factor)
+      ADMISSION_LIMIT.set(self.limit)
+
+  def _observe(self, waiting: int):
+    """Updates the completion rate from the decrease of the count since
+    the last one. Documents dispatched meanwhile hide part of the
+    decrease, the rate is a lower bound and the retry hints err on the
+    long side."""
+    now = self.clock()
+    if self._last_count is not None:
+      elapsed = now - self._last_count_time
+      if elapsed > 0:
+        picked_up = max(0, self._last_count - waiting)
+        rate = picked_up / elapsed
+        if self.completion_rate is None:
+          self.completion_rate = rate
+        else:
+          self.completion_rate += COMPLETION_RATE_WEIGHT * (
+              rate - self.completion_rate)
+        COMPLETION_RATE.set(self.completion_rate)
+    self._last_count = waiting
+    self._last_count_time = now
+
+  def _retry_after(self, waiting: int, limit: float) -> float:
+    """Time for the documents over the limit to be picked up"""
+    excess = waiting - math.floor(limit) + 1
+    if not self.completion_rate:
+      return ADMISSION_MAX_RETRY_SECONDS
+    return min(ADMISSION_MAX_RETRY_SECONDS,
+               max(ADMISSION_MIN_RETRY_SECONDS,
+                   excess / self.completion_rate))
+
+
+_controller = None
+
+
+def get_admission_controller():
+  global _controller
+  if _controller is None:
+    _controller = AdmissionController()
+  return _controller
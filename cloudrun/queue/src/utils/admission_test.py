@@ -0,0 +1,110 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the adaptive admission
+"""
+from unittest import mock
+from utils.admission import AdmissionController
+
+
+class FakeClock:
+
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+def make_controller(clock, **kwargs):
+  settings = {
+      "min_limit": 10,
+      "max_limit": 100,
+      "initial_limit": 40,
+      "increase": 1,
+      "decrease_factor": 0.5,
+      "latency_target": 5,
+      "cooldown": 10
+  }
+  settings.update(kwargs)
+  return AdmissionController(clock=clock, **settings)
+
+
+def test_fast_calls_increase_the_limit():
+  controller = make_controller(FakeClock())
+  for _ in range(40):
+    controller.record(0.1, 200)
+  assert 40.9 < controller.limit < 41
+  controller = make_controller(FakeClock(), initial_limit=100)
+  controller.record(0.1, 200)
+  assert controller.limit == 100
+
+
+def test_decrease_once_per_cooldown():
+  clock = FakeClock()
+  controller = make_controller(clock)
+  controller.record(0.1, 503)
+  assert controller.limit == 20
+  # The same saturation reported again within the cooldown
+  controller.record(6, 200)
+  controller.record(0.1, 429)
+  assert controller.limit == 20
+  clock.now = 10
+  controller.record(0.1, 500)
+  assert controller.limit == 10
+  clock.now = 20
+  controller.record(0.1, 500)
+  assert controller.limit == 10
+
+
+def test_admits_under_the_limit():
+  controller = make_controller(FakeClock())
+  assert controller.admit(39) is None
+  assert controller.admit(40) is not None
+
+
+def test_bulk_share():
+  controller = make_controller(FakeClock(), initial_limit=10)
+  assert controller.admit(4, share=0.5) is None
+  assert controller.admit(5, share=0.5) is not None
+  assert controller.admit(5) is None
+
+
+def test_admits_with_nothing_in_flight():
+  # A bulk upload larger than its share of the limit still gets in once
+  # the documents dispatched before it are picked up
+  controller = make_controller(
+      FakeClock(), min_limit=1, initial_limit=1, max_limit=10)
+  assert controller.admit(0, share=0.5) is None
+  assert controller.admit(1, share=0.5) is not None
+
+
+def test_retry_after_from_the_completion_rate():
+  clock = FakeClock()
+  controller = make_controller(clock, initial_limit=10)
+  with mock.patch("utils.admission.ADMISSION_MAX_RETRY_SECONDS", 600), \
+    mock.patch("utils.admission.ADMISSION_MIN_RETRY_SECONDS", 1):
+    # No rate measured yet
+    assert controller.admit(30) == 600
+    clock.now = 10
+    # 10 documents picked up in 10s, 11 documents over the limit
+    assert controller.admit(20) == 11
+    assert controller.completion_rate == 1
+    clock.now = 20
+    # Documents dispatched meanwhile are not counted as picked up
+    controller.admit(25)
+    assert controller.completion_rate < 1
@@ -0,0 +1,192 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Admission and forwarding of the uploaded documents to process_task,
+shared by the push endpoint and the pull consumer. process_task is called
+with the async client, the Firestore calls run in the threadpool so a slow
+call does not hold the event loop."""
+
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+import fireo
+from fastapi import status
+from fastapi.concurrency import run_in_threadpool
+from google.cloud import firestore
+from config import PROCESS_TASK_URL, PROCESS_TASK_TIMEOUT_SECONDS, \
+  ADMISSION_BULK_SHARE
+from common.config import INFLIGHT_DOCUMENTS_COUNTER, PRIORITY_NORMAL, \
+  PRIORITY_BULK, PRIORITIES, FIRESTORE_BATCH_LIMIT
+from common.models import CounterShard, Document
+from common.utils.logging_handler import Logger
+from common.utils.service_client import get_async_service_client
+from utils.admission import get_admission_controller
+
+_firestore_client = None
+
+
+def get_firestore_client():
+  """Returns the Firestore client of the process. The
+  google-cloud-firestore version fireo requires has no async client, its
+  blocking calls are run in the threadpool."""
+  global _firestore_client
+  if _firestore_client is None:
+    _firestore_client = firestore.Client()
+  return _firestore_client
+
+
+def read_count() -> int:
+  """Returns the number of documents dispatched to process_task and not
+  yet picked up by a pipeline stage, read from the shards of the in flight
+  counter"""
+  shards = get_firestore_client().collection(
+      CounterShard.collection_name).where("counter", "==",
+                                          INFLIGHT_DOCUMENTS_COUNTER)
+  return sum(shard.get("count") or 0 for shard in shards.stream())
+
+
+async def get_count() -> int:
+  return await run_in_threadpool(read_count)
+
+
+def count_queued() -> int:
+  """Returns the number of documents dispatched and not yet picked up by a
+  stage, scanning the document collection"""
+  docs = get_firestore_client().collection(
+      Document.collection_name).select(["system_status"])
+  return sum(1 for doc in docs.stream()
+             if Document.is_queued(doc.to_dict().get("system_status")))
+
+
+@fireo.transactional
+def mark_dispatched(transaction, uids: List[str], dispatched: bool) -> int:
+  """Marks the upload status of the documents dispatched, or no longer
+  dispatched when process_task did not accept them, and moves the in
+  flight counter by the documents changed. A document already picked up
+  by a stage, or already marked by an earlier delivery of the message, is
+  left as is so it is counted once.
+
+  Returns:
+    the number of documents changed
+  """
+  documents = Document.find_by_ids(uids, transaction=transaction)
+  changed = 0
+  for document in documents.values():
+    if not Document.is_uploaded(document.system_status) or \
+        Document.is_queued(document.system_status) == dispatched:
+      continue
+    document.system_status = [
+        dict(document.system_status[0], dispatched=dispatched)
+    ]
+    document.update(transaction=transaction)
+    changed += 1
+  if changed:
+    CounterShard.increment(
+        INFLIGHT_DOCUMENTS_COUNTER,
+        changed if dispatched else -changed,
+        transaction=transaction)
+  return changed
+
+
+def set_dispatched(uids: List[str], dispatched: bool) -> int:
+  """Runs mark_dispatched in transactions within the write limit, one
+  write is kept for the counter"""
+  changed = 0
+  step = FIRESTORE_BATCH_LIMIT - 1
+  for start in range(0, len(uids), step):
+    changed += mark_dispatched(fireo.transaction(), uids[start:start + step],
+                               dispatched)
+  return changed
+
+
+def read_message(data: bytes) -> Tuple[List[Dict], str]:
+  """Returns the documents of a message published by the upload service
+  and their priority lane, normal for the messages published without one
+
+  Raises:
+    ValueError: when the data is not a JSON object or the priority is
+      unknown
+  """
+  message = json.loads(data.decode("utf-8").strip())
+  if not isinstance(message, dict):
+    raise ValueError("Message is not a JSON object")
+  priority = message.get("priority") or PRIORITY_NORMAL
+  if priority not in PRIORITIES:
+    raise ValueError(f"Unknown priority {priority}")
+  return message.get("message_list") or [], priority
+
+
+async def dispatch(configs: List[Dict], priority: str = PRIORITY_NORMAL
+                  ) -> Tuple[int, Optional[float]]:
+  """Forwards the documents to process_task when the admission controller
+  lets them in. Bulk documents may only fill ADMISSION_BULK_SHARE of the
+  limit.
+
+  The documents are counted in flight before the call so a stage
+  reporting at once finds them counted, and taken out again when
+  process_task does not accept them.
+
+  Returns:
+    the status code of process_task, or 429 when not admitted, and the
+    seconds to wait before retrying when not admitted
+  """
+  doc_count = await get_count()
+  Logger.debug(f"doc_count = {doc_count}")
+  controller = get_admission_controller()
+  share = ADMISSION_BULK_SHARE if priority == PRIORITY_BULK else 1.0
+  retry_after = controller.admit(doc_count, share)
+  if retry_after is not None:
+    Logger.info(f"unacknowledge: {doc_count} documents waiting, limit "
+                f"{controller.limit:.1f}")
+    return status.HTTP_429_TOO_MANY_REQUESTS, retry_after
+
+  # Sample request body
+  # {
+  #   "configs": [
+  #     {
+  #       "case_id": "6075e034-2763-11ed-8345-aa81c3a89f04",
+  #       "uid": "jcdQmUqUKrcs8GGsmojp",
+  #       "gcs_url": "gs://sample-project-dev-document-upload/"
+  #                  "6075e034-2763-11ed-8345-aa81c3a89f04/"
+  #                  "jcdQmUqUKrcs8GGsmojp/arizona-application-form.pdf",
+  #       "context": "arizona"
+  #     }
+  #   ]
+  # }
+  Logger.info(f"Sending {len(configs)} {priority} documents to "
+              f"{PROCESS_TASK_URL}")
+
+  uids = [config["uid"] for config in configs if config.get("uid")]
+  await run_in_threadpool(set_dispatched, uids, True)
+  start_time = time.perf_counter()
+  try:
+    process_task_response = await get_async_service_client().process_task(
+        configs,
+        url=PROCESS_TASK_URL,
+        timeout=PROCESS_TASK_TIMEOUT_SECONDS,
+        priority=priority)
+  except Exception:
+    controller.record(time.perf_counter() - start_time,
+                      status.HTTP_503_SERVICE_UNAVAILABLE)
+    await run_in_threadpool(set_dispatched, uids, False)
+    raise
+  controller.record(time.perf_counter() - start_time,
+                    process_task_response.status_code)
+  if not 200 <= process_task_response.status_code < 300:
+    await run_in_threadpool(set_dispatched, uids, False)
+  Logger.info(f"Response from {PROCESS_TASK_URL}: "
+              f"{process_task_response.status_code}")
+  return process_task_response.status_code, None
@@ -0,0 +1,186 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the admission and forwarding of the queued documents
+"""
+# disabling pylint rules that conflict with pytest fixtures
+# pylint: disable=unused-argument,redefined-outer-name
+import asyncio
+import json
+from unittest import mock
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+from common.config import PRIORITY_BULK, PRIORITY_NORMAL, STATUS_SUCCESS
+from utils.admission import AdmissionController
+from utils.dispatcher import count_queued, dispatch, get_count, \
+  get_firestore_client, read_message, set_dispatched
+
+CONFIGS = [{"case_id": "case", "uid": f"uid{i}"} for i in range(4)]
+
+
+@pytest.fixture
+def firestore_client():
+  """The Firestore client of the process built with anonymous
+  credentials, the queries are answered by patching their stream"""
+  with mock.patch("utils.dispatcher._firestore_client", None), \
+    mock.patch("google.auth.default",
+               return_value=(AnonymousCredentials(), "fake-project")):
+    yield get_firestore_client()
+
+
+def snapshot(data):
+  document = mock.Mock()
+  document.get.side_effect = data.get
+  document.to_dict.return_value = data
+  return document
+
+
+class FakeServiceClient:
+  """Async service client answering process_task with a status code, or
+  raising the given exception"""
+
+  def __init__(self, status_code=200, error=None):
+    self.status_code = status_code
+    self.error = error
+    self.calls = []
+
+  async def process_task(self, configs, **kwargs):
+    self.calls.append((configs, kwargs))
+    if self.error is not None:
+      raise self.error
+    return mock.Mock(status_code=self.status_code)
+
+
+@pytest.fixture
+def controller():
+  return AdmissionController(
+      min_limit=2,
+      max_limit=20,
+      initial_limit=10,
+      decrease_factor=0.5,
+      cooldown=10,
+      clock=lambda: 0)
+
+
+def run_dispatch(controller, waiting, service_client, priority=None):
+  """Dispatches CONFIGS with the count, the controller and the client
+  given, returns the result and the set_dispatched mock"""
+
+  async def count():
+    return waiting
+
+  args = (CONFIGS,) if priority is None else (CONFIGS, priority)
+  with mock.patch("utils.dispatcher.get_count", count), \
+    mock.patch("utils.dispatcher.get_admission_controller",
+               return_value=controller), \
+    mock.patch("utils.dispatcher.get_async_service_client",
+               return_value=service_client), \
+    mock.patch("utils.dispatcher.set_dispatched") as marked, \
+    mock.patch("utils.dispatcher.Logger"):
+    return asyncio.run(dispatch(*args)), marked
+
+
+def test_get_count_sums_the_shards(firestore_client):
+  assert isinstance(firestore_client, firestore.Client)
+  shards = [snapshot({"count": 3}), snapshot({}), snapshot({"count": 4})]
+  with mock.patch("google.cloud.firestore_v1.query.Query.stream",
+                  return_value=iter(shards)):
+    assert asyncio.run(get_count()) == 7
+
+
+def test_count_queued(firestore_client):
+  uploaded = {"stage": "uploaded", "status": STATUS_SUCCESS}
+  documents = [
+      snapshot({"system_status": [dict(uploaded, dispatched=True)]}),
+      snapshot({"system_status": [uploaded]}),
+      snapshot({}),
+  ]
+  with mock.patch("google.cloud.firestore_v1.query.Query.stream",
+                  return_value=iter(documents)):
+    assert count_queued() == 1
+
+
+def test_read_message():
+  data = json.dumps({"message_list": CONFIGS}).encode("utf-8")
+  assert read_message(data) == (CONFIGS, PRIORITY_NORMAL)
+  data = json.dumps({"priority": PRIORITY_BULK}).encode("utf-8")
+  assert read_message(data) == ([], PRIORITY_BULK)
+  with pytest.raises(ValueError):
+    read_message(json.dumps({"priority": "urgent"}).encode("utf-8"))
+  with pytest.raises(ValueError):
+    read_message(b"[]")
+
+
+def test_dispatch_counts_the_documents(controller):
+  client = FakeServiceClient()
+  result, marked = run_dispatch(controller, 3, client, PRIORITY_BULK)
+  assert result == (200, None)
+  uids = [config["uid"] for config in CONFIGS]
+  marked.assert_called_once_with(uids, True)
+  assert client.calls[0][1]["priority"] == PRIORITY_BULK
+  assert controller.limit > 10
+
+
+def test_dispatch_not_admitted(controller):
+  client = FakeServiceClient()
+  (status_code, retry_after), marked = run_dispatch(controller, 10, client)
+  assert status_code == 429
+  assert retry_after > 0
+  assert not client.calls
+  marked.assert_not_called()
+
+
+def test_dispatch_bulk_share(controller):
+  client = FakeServiceClient()
+  with mock.patch("utils.dispatcher.ADMISSION_BULK_SHARE", 0.5):
+    (status_code, _), _ = run_dispatch(controller, 5, client, PRIORITY_BULK)
+    assert status_code == 429
+    (status_code, _), _ = run_dispatch(controller, 5, client)
+    assert status_code == 200
+    # Nothing in flight, the bulk documents get in whatever their number
+    (status_code, _), _ = run_dispatch(controller, 0, client, PRIORITY_BULK)
+    assert status_code == 200
+
+
+def test_dispatch_rejected_is_not_counted(controller):
+  client = FakeServiceClient(status_code=503)
+  result, marked = run_dispatch(controller, 0, client)
+  assert result == (503, None)
+  uids = [config["uid"] for config in CONFIGS]
+  assert marked.call_args_list == [mock.call(uids, True),
+                                   mock.call(uids, False)]
+  assert controller.limit == 5
+
+
+def test_dispatch_error_is_not_counted(controller):
+  client = FakeServiceClient(error=TimeoutError())
+  with pytest.raises(TimeoutError):
+    run_dispatch(controller, 0, client)
+  assert controller.limit == 5
+
+
+def test_set_dispatched_in_chunks():
+  uids = [f"uid{i}" for i in range(5)]
+  with mock.patch("utils.dispatcher.FIRESTORE_BATCH_LIMIT", 3), \
+    mock.patch("utils.dispatcher.fireo"), \
+    mock.patch("utils.dispatcher.mark_dispatched",
+               side_effect=lambda transaction, chunk, dispatched: len(chunk)
+              ) as mark:
+    assert set_dispatched(uids, True) == 5
+  assert [call[0][1] for call in mark.call_args_list
+         ] == [uids[:2], uids[2:4], uids[4:]]
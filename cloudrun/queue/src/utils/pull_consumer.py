@@ -0,0 +1,198 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Streaming pull consumer forwarding the messages in batches"""
+
+import asyncio
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.types import FlowControl
+from common.config import PROJECT_ID
+from common.utils.logging_handler import Logger
+from config import QUEUE_SUBSCRIPTION_ID, QUEUE_PULL_BATCH_SIZE, \
+  QUEUE_PULL_MAX_WAIT_SECONDS, QUEUE_PULL_MAX_MESSAGES, \
+  QUEUE_PULL_MAX_LEASE_SECONDS, QUEUE_PULL_RETRY_SECONDS
+from utils.dispatcher import dispatch, read_message
+
+# pylint: disable = broad-except
+
+
+class Batch:
+  """Messages of a priority lane forwarded together and acknowledged
+  together"""
+
+  def __init__(self, priority: str, started_at: float):
+    self.priority = priority
+    self.messages = []
+    self.configs = []
+    self.started_at = started_at
+
+  def add(self, message, configs: List[Dict]):
+    self.messages.append(message)
+    self.configs.extend(configs)
+
+
+class BatchConsumer:
+  """Pulls the messages of the subscription and merges their documents
+  into process_task calls of up to batch_size documents, one batch per
+  priority lane. A batch is sent once full or max_wait seconds after its
+  first message.
+
+  The messages of a batch are acknowledged once process_task accepted it.
+  A batch that is not admitted is kept and sent again after the retry hint
+  of the admission controller; the pull flow control allows at most
+  max_messages outstanding, so nothing more is pulled while the pipeline
+  is saturated. A batch held longer than the lease is nacked and
+  delivered again by Pub/Sub.
+  """
+
+  def __init__(self,
+               subscription_id: str = QUEUE_SUBSCRIPTION_ID,
+               dispatch_fn: Optional[Callable[[List[Dict], str],
+                                              Tuple[int,
+                                                    Optional[float]]]] = None,
+               batch_size: int = QUEUE_PULL_BATCH_SIZE,
+               max_wait: float = QUEUE_PULL_MAX_WAIT_SECONDS,
+               max_messages: int = QUEUE_PULL_MAX_MESSAGES,
+               max_lease: float = QUEUE_PULL_MAX_LEASE_SECONDS,
+               subscriber=None,
+               clock=time.monotonic):
+    self.subscription_id = subscription_id
+    self.dispatch_fn = dispatch_fn or self.dispatch_on_loop
+    self.batch_size = batch_size
+    self.max_wait = max_wait
+    self.max_messages = max_messages
+    self.max_lease = max_lease
+    self.subscriber = subscriber
+    self.clock = clock
+    self._batches = {}
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._future = None
+    self._flusher = None
+    self._loop = None
+
+  def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+    """Starts pulling, the batches are forwarded on the given event loop,
+    the loop of the app by default"""
+    self._loop = loop or asyncio.get_event_loop()
+    if self.subscriber is None:
+      self.subscriber = pubsub_v1.SubscriberClient()
+    subscription_path = self.subscriber.subscription_path(
+        PROJECT_ID, self.subscription_id)
+    self._future = self.subscriber.subscribe(
+        subscription_path,
+        callback=self.receive,
+        flow_control=FlowControl(
+            max_messages=self.max_messages,
+            max_lease_duration=self.max_lease))
+    self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+    self._flusher.start()
+    Logger.info(f"Pulling messages of {subscription_path}")
+
+  def stop(self):
+    """Stops pulling, the messages not yet acknowledged are delivered
+    again by Pub/Sub"""
+    self._stopped.set()
+    if self._future is not None:
+      self._future.cancel()
+    with self._lock:
+      batches, self._batches = self._batches, {}
+    for batch in batches.values():
+      self._nack(batch)
+
+  def receive(self, message):
+    """Subscriber callback, adds the message to the current batch"""
+    try:
+      configs, priority = read_message(message.data)
+    except Exception as e:
+      # The message can never be forwarded, do not deliver it again
+      Logger.error(f"Dropping message {message.message_id}: {e}")
+      message.ack()
+      return
+    with self._lock:
+      batch = self._batches.get(priority)
+      if batch is None:
+        batch = self._batches[priority] = Batch(priority, self.clock())
+      batch.add(message, configs)
+      if len(batch.configs) < self.batch_size:
+        return
+      del self._batches[priority]
+    self.send(batch)
+
+  def send(self, batch: Batch):
+    """Forwards the documents of the batch, acknowledges its messages on
+    success and schedules a retry otherwise"""
+    try:
+      status_code, retry_after = self.dispatch_fn(batch.configs,
+                                                  batch.priority)
+    except Exception:
+      Logger.error(traceback.format_exc().replace("\n", " "))
+      status_code, retry_after = None, None
+    if status_code is not None and 200 <= status_code < 300:
+      for message in batch.messages:
+        message.ack()
+      return
+    delay = retry_after or QUEUE_PULL_RETRY_SECONDS
+    if self._stopped.is_set() or \
+        self.clock() + delay - batch.started_at >= self.max_lease:
+      self._nack(batch)
+      return
+    Logger.warning(f"Batch of {len(batch.configs)} {batch.priority} "
+                   f"documents not accepted ({status_code}), retrying in "
+                   f"{delay:.0f}s")
+    timer = threading.Timer(delay, self.send, [batch])
+    timer.daemon = True
+    timer.start()
+
+  def dispatch_on_loop(self, configs: List[Dict], priority: str):
+    """Runs the async dispatch on the event loop and waits for it from the
+    subscriber thread"""
+    return asyncio.run_coroutine_threadsafe(dispatch(configs, priority),
+                                            self._loop).result()
+
+  def _nack(self, batch: Batch):
+    for message in batch.messages:
+      message.nack()
+
+  def _flush_loop(self):
+    while not self._stopped.wait(min(self.max_wait, 1)):
+      self.flush_due()
+
+  def flush_due(self):
+    """Sends the batches that waited max_wait seconds without filling up"""
+    now = self.clock()
+    with self._lock:
+      due = [
+          priority for priority, batch in self._batches.items()
+          if now - batch.started_at >= self.max_wait
+      ]
+      batches = [self._batches.pop(priority) for priority in due]
+    for batch in batches:
+      self.send(batch)
+
+
+_consumer = None
+
+
+def get_batch_consumer():
+  global _consumer
+  if _consumer is None:
+    _consumer = BatchConsumer()
+  return _consumer
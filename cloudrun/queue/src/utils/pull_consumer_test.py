@@ -0,0 +1,161 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the streaming pull batch consumer
+"""
+import json
+from unittest import mock
+from common.config import PRIORITY_BULK, PRIORITY_NORMAL
+from utils.pull_consumer import BatchConsumer
+
+
+class FakeClock:
+
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+def make_message(priority, count):
+  message = mock.Mock()
+  message.data = json.dumps({
+      "message_list": [{"uid": f"{priority}{i}"} for i in range(count)],
+      "priority": priority
+  }).encode("utf-8")
+  return message
+
+
+def make_consumer(results, clock=None):
+  """Consumer answering the dispatches with the results in turn, a
+  (status code, retry after) pair or an exception"""
+  dispatched = []
+
+  def dispatch(configs, priority):
+    dispatched.append((list(configs), priority))
+    result = results.pop(0)
+    if isinstance(result, Exception):
+      raise result
+    return result
+
+  consumer = BatchConsumer(
+      subscription_id="test",
+      dispatch_fn=dispatch,
+      batch_size=4,
+      max_wait=2,
+      max_lease=60,
+      clock=clock or FakeClock())
+  return consumer, dispatched
+
+
+def test_batches_by_priority():
+  consumer, dispatched = make_consumer([(200, None)])
+  normal = [make_message(PRIORITY_NORMAL, 2) for _ in range(2)]
+  bulk = make_message(PRIORITY_BULK, 3)
+  with mock.patch("utils.pull_consumer.Logger"):
+    consumer.receive(normal[0])
+    consumer.receive(bulk)
+    assert not dispatched
+    consumer.receive(normal[1])
+  assert dispatched == [([{"uid": "normal0"}, {"uid": "normal1"}] * 2,
+                         PRIORITY_NORMAL)]
+  for message in normal:
+    message.ack.assert_called_once()
+  bulk.ack.assert_not_called()
+
+
+def test_partial_batch_sent_after_max_wait():
+  clock = FakeClock()
+  consumer, dispatched = make_consumer([(200, None)], clock)
+  message = make_message(PRIORITY_BULK, 1)
+  with mock.patch("utils.pull_consumer.Logger"):
+    consumer.receive(message)
+    clock.now = 1
+    consumer.flush_due()
+    assert not dispatched
+    clock.now = 2
+    consumer.flush_due()
+  assert dispatched == [([{"uid": "bulk0"}], PRIORITY_BULK)]
+  message.ack.assert_called_once()
+
+
+def test_invalid_message_dropped():
+  consumer, dispatched = make_consumer([])
+  message = mock.Mock(data=b"not json")
+  with mock.patch("utils.pull_consumer.Logger"):
+    consumer.receive(message)
+  message.ack.assert_called_once()
+  assert not dispatched
+
+
+def test_not_admitted_retried_after_hint():
+  consumer, _ = make_consumer([(429, 12.0)])
+  messages = [make_message(PRIORITY_NORMAL, 2) for _ in range(2)]
+  with mock.patch("utils.pull_consumer.Logger"), \
+    mock.patch("utils.pull_consumer.threading.Timer") as timer:
+    for message in messages:
+      consumer.receive(message)
+  timer.assert_called_once()
+  delay, send, (batch,) = timer.call_args[0]
+  assert delay == 12.0
+  assert send == consumer.send
+  assert len(batch.configs) == 4
+  for message in messages:
+    message.ack.assert_not_called()
+    message.nack.assert_not_called()
+
+
+def test_error_retried_then_acknowledged():
+  clock = FakeClock()
+  consumer, dispatched = make_consumer([TimeoutError(), (200, None)], clock)
+  message = make_message(PRIORITY_NORMAL, 4)
+  with mock.patch("utils.pull_consumer.Logger"), \
+    mock.patch("utils.pull_consumer.QUEUE_PULL_RETRY_SECONDS", 5), \
+    mock.patch("utils.pull_consumer.threading.Timer") as timer:
+    consumer.receive(message)
+    delay, send, args = timer.call_args[0]
+    assert delay == 5
+    clock.now = delay
+    send(*args)
+  assert len(dispatched) == 2
+  message.ack.assert_called_once()
+
+
+def test_nacked_past_the_lease():
+  clock = FakeClock()
+  consumer, _ = make_consumer([(429, 30.0), (429, 30.0)], clock)
+  message = make_message(PRIORITY_NORMAL, 4)
+  with mock.patch("utils.pull_consumer.Logger"), \
+    mock.patch("utils.pull_consumer.threading.Timer") as timer:
+    consumer.receive(message)
+    _, send, args = timer.call_args[0]
+    clock.now = 30
+    # A retry in 30s would end past the 60s lease
+    send(*args)
+  assert timer.call_count == 1
+  message.nack.assert_called_once()
+  message.ack.assert_not_called()
+
+
+def test_stop_nacks_pending_batches():
+  consumer, _ = make_consumer([])
+  message = make_message(PRIORITY_BULK, 1)
+  with mock.patch("utils.pull_consumer.Logger"):
+    consumer.receive(message)
+    consumer.stop()
+  message.nack.assert_called_once()
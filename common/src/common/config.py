@@ -53,8 +53,59 @@ STATUS_TIMEOUT = "Timeout"
 # ========= Document upload ======================
 BUCKET_NAME = f"{PROJECT_ID}-document-upload"
 TOPIC_ID = "queue-topic"
+# Folder of the bulk JSON imports in the bucket, each part object holds the
+# records of many documents
+BULK_IMPORT_PREFIX = "bulk_import"
+
+# Messages are sent in batches once one of the limits is reached
+PUBSUB_BATCH_MAX_MESSAGES = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "100"))
+PUBSUB_BATCH_MAX_BYTES = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", "1000000"))
+PUBSUB_BATCH_MAX_LATENCY_SECONDS = float(
+    os.getenv("PUBSUB_BATCH_MAX_LATENCY_SECONDS", "0.01"))
+# Publishing blocks once this many messages or bytes are not yet sent
+PUBSUB_FLOW_CONTROL_MAX_MESSAGES = int(
+    os.getenv("PUBSUB_FLOW_CONTROL_MAX_MESSAGES", "1000"))
+PUBSUB_FLOW_CONTROL_MAX_BYTES = int(
+    os.getenv("PUBSUB_FLOW_CONTROL_MAX_BYTES", str(10 * 1024 * 1024)))
 PROCESS_TASK_API_PATH = "/upload_service/v1/process_task"
 
+# Priority lanes of the pipeline tasks, highest first: re-runs requested
+# by a caseworker, regular uploads and mass ingestion
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_NORMAL = "normal"
+PRIORITY_BULK = "bulk"
+PRIORITIES = [PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BULK]
+
+# Counter of the uploaded documents published for processing and not yet
+# picked up by a pipeline stage, read by the queue to admit new work
+INFLIGHT_DOCUMENTS_COUNTER = "inflight_documents"
+# Shards of the Firestore counters, each shard takes about one write per
+# second
+COUNTER_SHARDS = int(os.getenv("COUNTER_SHARDS", "10"))
+
+# Maximum number of writes Firestore accepts in a single batch commit
+FIRESTORE_BATCH_LIMIT = 500
+
+# ========= Service to service calls =============
+DOCUMENT_STATUS_SERVICE_URL = \
+  "http://document-status-service/document_status_service/v1"
+CLASSIFICATION_SERVICE_URL = \
+  "http://classification-service/classification_service/v1"
+EXTRACTION_SERVICE_URL = "http://extraction-service/extraction_service/v1"
+VALIDATION_SERVICE_URL = "http://validation-service/validation_service/v1"
+MATCHING_SERVICE_URL = "http://matching-service/matching_service/v1"
+UPLOAD_SERVICE_URL = "http://upload-service/upload_service/v1"
+
+# Keep-alive connections kept open per process to the other services
+SERVICE_CLIENT_POOL_SIZE = int(os.getenv("SERVICE_CLIENT_POOL_SIZE", "100"))
+SERVICE_CONNECT_TIMEOUT_SECONDS = 5
+SERVICE_CALL_TIMEOUT_SECONDS = 60
+# Classification and extraction wait on Vertex AI and Document AI
+SERVICE_LONG_CALL_TIMEOUT_SECONDS = PROCESS_TIMEOUT_SECONDS
+SERVICE_CALL_RETRIES = 3
+SERVICE_RETRY_BACKOFF_SECONDS = 0.5
+SERVICE_RETRY_MAX_BACKOFF_SECONDS = 8
+
 # ========= Validation ===========================
 BUCKET_NAME_VALIDATION = PROJECT_ID
 PATH = f"gs://{PROJECT_ID}/Validation/rules.json"
@@ -95,6 +146,8 @@ assert PARSER_CONFIG, "Unable to locate 'parser_config.json'"
 # ========= HITL and Frontend UI =======================
 
 # List of database keys and extracted entities that are searchable
+# The composite indexes of terraform/modules/firebase/indexes.tf cover the
+# DB_KEYS filters of the HITL search
 DB_KEYS = [
     "active",
     "auto_approval",
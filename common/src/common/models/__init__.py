@@ -4,4 +4,9 @@ Flatten import namespace for models
 
 from .base_model import *
 from .claim import *
+from .status_event import *
 from .document import *
+from .content_index import *
+from .pipeline_task import *
+from .bulk_import import *
+from .counter_shard import *
@@ -19,7 +19,10 @@ FireO BaseModel to be inherited by all other objects in ORM
 """
 
 import fireo
+from fireo.database import db
 from fireo.models import Model
+from fireo.queries.query_wrapper import ModelWrapper
+from common.utils.metrics import track_stage
 
 
 # pylint: disable = too-few-public-methods
@@ -38,6 +41,22 @@ class BaseModel(Model):
     # commenting until it does something
     abstract = True
 
+  def save(self, transaction=None, batch=None, merge=None):
+    """Saves the object, timed as a Firestore write unless it is part of a
+    transaction or batch committed later"""
+    if transaction is not None or batch is not None:
+      return super().save(transaction=transaction, batch=batch, merge=merge)
+    with track_stage("firestore_write"):
+      return super().save(merge=merge)
+
+  def update(self, key=None, transaction=None, batch=None):
+    """Updates the object, timed as a Firestore write unless it is part of
+    a transaction or batch committed later"""
+    if transaction is not None or batch is not None:
+      return super().update(key=key, transaction=transaction, batch=batch)
+    with track_stage("firestore_write"):
+      return super().update(key=key)
+
   @classmethod
   def find_by_id(cls, doc_id):
     """Looks up in the Database and returns an object of this type by id
@@ -54,7 +73,34 @@ class BaseModel(Model):
             the subclassed Model
         """
     key = fireo.utils.utils.generateKeyFromId(cls, doc_id)
-    return cls.collection.get(key)
+    with track_stage("firestore_read"):
+      return cls.collection.get(key)
+
+  @classmethod
+  def find_by_ids(cls, doc_ids, transaction=None):
+    """Looks up in the Database the objects of this type by id (not key)
+       in a single round trip
+
+        Args:
+            doc_ids (list): the document ids without collection_name
+            transaction: Firestore transaction the reads are part of
+
+        Returns:
+            dict: the objects found by their id, the ids not found are left
+            out
+        """
+    found = {}
+    collection = db.conn.collection(cls.collection_name)
+    refs = [collection.document(doc_id) for doc_id in set(doc_ids)]
+    if not refs:
+      return found
+    with track_stage("firestore_read"):
+      snapshots = list(db.conn.get_all(refs, transaction=transaction))
+    for snapshot in snapshots:
+      obj = ModelWrapper.from_query_result(cls(), snapshot)
+      if obj is not None:
+        found[snapshot.id] = obj
+    return found
 
   @classmethod
   def delete_by_id(cls, doc_id):
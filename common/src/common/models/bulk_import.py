@@ -0,0 +1,41 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Bulk import object in the ORM
+"""
+import os
+from common.models.base_model import BaseModel
+from fireo.fields import IDField, TextField, NumberField, DateTime
+
+DATABASE_PREFIX = os.getenv("DATABASE_PREFIX", "")
+
+
+class BulkImport(BaseModel):
+  """Progress of a bulk NDJSON ingestion, updated after every batch"""
+  import_id = IDField()
+  status = TextField()
+  lines_read = NumberField()
+  documents_created = NumberField()
+  error_count = NumberField()
+  errors_url = TextField()
+  gcs_prefix = TextField()
+  created_timestamp = DateTime(auto=True)
+  updated_timestamp = DateTime()
+
+  class Meta:
+    ignore_none_field = False
+    collection_name = DATABASE_PREFIX + "bulk_import"
@@ -22,7 +22,7 @@ import os
 
 import common.config as global_config
 from common.db_client import bq_client
-from common.models import BaseModel
+from common.models.base_model import BaseModel
 from fireo.fields import Field, TextField
 
 DATABASE_PREFIX = os.getenv("DATABASE_PREFIX", "")
@@ -0,0 +1,64 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Content hash index object in the ORM
+"""
+import os
+from common.models.base_model import BaseModel
+from fireo.fields import IDField, TextField, ListField, NumberField, DateTime
+
+DATABASE_PREFIX = os.getenv("DATABASE_PREFIX", "")
+
+
+class ContentIndex(BaseModel):
+  """Maps the sha256 of an uploaded document to the classification and
+  extraction output of the first document seen with that content, so a
+  byte identical upload can reuse them  """
+  content_hash = IDField()
+  uid = TextField()
+  document_class = TextField()
+  document_type = TextField()
+  context = TextField()
+  entities = ListField()
+  extraction_score = NumberField()
+  extraction_status = TextField()
+  timestamp = DateTime(auto=True)
+
+  class Meta:
+    ignore_none_field = False
+    collection_name = DATABASE_PREFIX + "content_index"
+
+  @classmethod
+  def find_by_hash(cls, content_hash):
+    """Find the index entry using the content hash
+    Args:
+        content_hash (string): sha256 of the document content
+    Returns:
+        ContentIndex: ContentIndex Object or None
+    """
+    if not content_hash:
+      return None
+    return cls.find_by_id(content_hash)
+
+  def has_classification(self):
+    return bool(self.document_class and self.document_type)
+
+  def has_extraction(self, document_class, context):
+    """Extraction depends on the parser of the document class and on the
+    entity mapping of the context, reuse only when both match"""
+    return (self.entities is not None and
+            self.document_class == document_class and self.context == context)
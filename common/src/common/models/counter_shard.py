@@ -0,0 +1,69 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Sharded counter object in the ORM
+"""
+import os
+import random
+import fireo
+from common.models.base_model import BaseModel
+from common.config import COUNTER_SHARDS
+from fireo.fields import IDField, TextField, NumberField
+
+DATABASE_PREFIX = os.getenv("DATABASE_PREFIX", "")
+
+
+class CounterShard(BaseModel):
+  """One shard of a counter. Increments go to a random shard so a busy
+  counter is not limited by the write rate of a single document, the
+  value is the sum of the COUNTER_SHARDS shards."""
+  shard_id = IDField()
+  counter = TextField()
+  count = NumberField()
+
+  class Meta:
+    ignore_none_field = False
+    collection_name = DATABASE_PREFIX + "counter_shard"
+
+  @classmethod
+  def increment(cls, counter, delta=1, transaction=None, batch=None):
+    """Adds delta to the counter, as part of the transaction or batch
+    when one is given"""
+    shard = cls()
+    shard.shard_id = f"{counter}-{random.randrange(COUNTER_SHARDS)}"
+    shard.counter = counter
+    shard.count = fireo.Increment(delta)
+    shard.upsert(transaction=transaction, batch=batch)
+
+  @classmethod
+  def total(cls, counter):
+    """Returns the value of the counter, reading its shards only"""
+    shards = cls.collection.filter("counter", "==", counter).fetch()
+    return sum(shard.count or 0 for shard in shards)
+
+  @classmethod
+  def reset(cls, counter, value=0):
+    """Sets the value of the counter, increments running at the same
+    time may be lost"""
+    batch = fireo.batch()
+    for i in range(COUNTER_SHARDS):
+      shard = cls()
+      shard.shard_id = f"{counter}-{i}"
+      shard.counter = counter
+      shard.count = value if i == 0 else 0
+      shard.save(batch=batch)
+    batch.commit()
@@ -18,8 +18,13 @@ limitations under the License.
 Document Status object in the ORM
 """
 import os
-from common.models import BaseModel
-from fireo.fields import TextField, ListField, NumberField, BooleanField, DateTime
+from common.models.base_model import BaseModel
+from common.models.status_event import StatusEvent, STATUS_KIND_SYSTEM, \
+  STATUS_KIND_HITL
+from common.utils.status_fields import derive_status_fields
+from common.utils.search_terms import search_terms as derive_search_terms
+from common.config import DB_KEYS, STATUS_SUCCESS
+from fireo.fields import IDField, TextField, ListField, NumberField, BooleanField, DateTime, MapField
 
 DATABASE_PREFIX = os.getenv("DATABASE_PREFIX", "")
 PROJECT_ID = os.environ.get("PROJECT_ID", "")
@@ -27,12 +32,16 @@ PROJECT_ID = os.environ.get("PROJECT_ID", "")
 
 class Document(BaseModel):
   """Documentstatus ORM class  """
+  # Generated by Firestore unless set, the uid is the same id
+  id = IDField()
   case_id = TextField()
   uid = TextField()
   url = TextField()
   document_type = TextField()
   document_class = TextField()
   context = TextField()
+  # Latest system and HITL status, the full history is in the
+  # status_event subcollection
   system_status = ListField()
   hitl_status = ListField()
   active = TextField()
@@ -47,6 +56,20 @@ class Document(BaseModel):
   external_case_id = TextField()
   extraction_status = TextField()
   error_detail = TextField()
+  content_hash = TextField()
+  # page_count, encrypted, has_text_layer and size read at upload
+  pdf_metadata = MapField()
+  # Shown by the HITL lists, derived from the latest statuses whenever a
+  # status is written, see refresh_status_fields
+  current_status = TextField()
+  process_status = TextField()
+  status_last_updated_by = TextField()
+  last_update_timestamp = DateTime()
+  applicant_name = TextField()
+  is_unclassified = BooleanField()
+  # Terms of the DB_KEYS fields and ENTITY_KEYS entities looked up by the
+  # HITL search, see refresh_search_terms
+  search_terms = ListField()
 
   class Meta:
     ignore_none_field = False
@@ -54,10 +77,99 @@ class Document(BaseModel):
 
   @classmethod
   def find_by_uid(cls, uid):
-    """Find the document  using  uid
+    """Find the document  using  uid. The uid is the id of the documents
+    created by the services so it is read with a direct get, documents
+    saved with another id are looked up by a query when the get misses.
     Args:
         uid (string):  UID
     Returns:
         Document: Document Object
     """
-    return Document.collection.filter("uid", "==", uid).get()
+    document = cls.find_by_id(uid)
+    if document is None:
+      document = Document.collection.filter("uid", "==", uid).get()
+    return document
+
+  def add_status(self, kind, entry, transaction=None, batch=None,
+                 event_id=None):
+    """Records the entry as the latest system or hitl status and appends
+    it to the status history. The document itself is written by the
+    caller, with the same transaction or batch, along with the status
+    fields and the search terms derived from it.
+
+    Entries of the lists written before the history existed have no
+    event_id, they are moved to the history first.
+    Args:
+        kind (string): STATUS_KIND_SYSTEM or STATUS_KIND_HITL
+        entry (dict): the status, with its stage, status and timestamp
+        event_id (string): id of the event given by the caller, a new id
+          when not given
+    """
+    field = "system_status" if kind == STATUS_KIND_SYSTEM else "hitl_status"
+    for legacy in self.status_entries(field):
+      if "event_id" not in legacy:
+        StatusEvent.record(
+            self.key, kind, legacy, transaction=transaction, batch=batch)
+    entry = dict(entry)
+    entry["event_id"] = StatusEvent.record(
+        self.key,
+        kind,
+        entry,
+        transaction=transaction,
+        batch=batch,
+        event_id=event_id)
+    setattr(self, field, [entry])
+    self.refresh_status_fields()
+    self.refresh_search_terms()
+    return entry
+
+  def status_entries(self, field):
+    """Returns the entries of the system_status or hitl_status list"""
+    entries = getattr(self, field)
+    return list(entries) if entries else []
+
+  def refresh_status_fields(self):
+    """Derives current_status, process_status and the other fields of the
+    HITL lists from the latest statuses, the auto approval and the
+    entities of the document"""
+    fields = derive_status_fields(self.system_status, self.hitl_status,
+                                  self.auto_approval, self.entities)
+    for field, value in fields.items():
+      setattr(self, field, value)
+
+  def refresh_search_terms(self):
+    """Indexes the DB_KEYS fields and the ENTITY_KEYS entities of the
+    document for the HITL search, see common.utils.search_terms"""
+    fields = {key: getattr(self, key, None) for key in DB_KEYS}
+    self.search_terms = derive_search_terms(fields, self.entities)
+
+  def audit_trail(self):
+    """Returns the system and hitl statuses of the document, oldest first,
+    each with its kind. Entries of the lists not yet moved to the history
+    are included."""
+    trail = [
+        dict(event.entry, kind=event.kind)
+        for event in StatusEvent.history(self.key)
+    ]
+    for kind, field in ((STATUS_KIND_SYSTEM, "system_status"),
+                        (STATUS_KIND_HITL, "hitl_status")):
+      trail.extend(
+          dict(entry, kind=kind)
+          for entry in self.status_entries(field)
+          if "event_id" not in entry)
+    return sorted(trail, key=lambda entry: entry["timestamp"])
+
+  @staticmethod
+  def is_uploaded(system_status):
+    """True while the only system status is the successful upload: the
+    document waits to be dispatched or for its first pipeline stage"""
+    return bool(system_status) and len(system_status) == 1 and \
+      system_status[0].get("stage") == "uploaded" and \
+      system_status[0].get("status") == STATUS_SUCCESS
+
+  @staticmethod
+  def is_queued(system_status):
+    """True while the document is counted in flight: dispatched to
+    process_task by the queue and no pipeline stage reported yet"""
+    return Document.is_uploaded(system_status) and \
+      system_status[0].get("dispatched", False)
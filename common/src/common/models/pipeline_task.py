@@ -0,0 +1,55 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Pipeline task object in the ORM
+"""
+import os
+from common.models.base_model import BaseModel
+from fireo.fields import IDField, TextField, ListField, NumberField, \
+  BooleanField, DateTime
+
+DATABASE_PREFIX = os.getenv("DATABASE_PREFIX", "")
+
+
+class PipelineTask(BaseModel):
+  """A process_task request accepted by the pipeline engine. The task is
+  persisted before it is queued so it can be resumed after a restart.
+
+  available_at is when the task may next be claimed by a worker other
+  than the one holding its lease: the lease expiry of the pod that queued
+  it while pending, of the worker running it while in progress, and None
+  once the task failed. priority is the lane of the task, interactive,
+  normal or bulk. Completed tasks are deleted, failed ones are removed by
+  the TTL policy on expire_at.
+  """
+  task_id = IDField()
+  configs = ListField()
+  is_hitl = BooleanField()
+  is_reassign = BooleanField()
+  priority = TextField()
+  status = TextField()
+  attempts = NumberField()
+  worker = TextField()
+  error = TextField()
+  available_at = DateTime()
+  expire_at = DateTime()
+  created_timestamp = DateTime(auto=True)
+  updated_timestamp = DateTime()
+
+  class Meta:
+    ignore_none_field = False
+    collection_name = DATABASE_PREFIX + "pipeline_task"
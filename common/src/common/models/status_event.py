@@ -0,0 +1,101 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Status history object in the ORM
+"""
+import uuid
+from typing import Iterable, Set, Tuple
+from fireo.database import db
+from common.models.base_model import BaseModel
+from fireo.fields import IDField, TextField, DateTime, MapField
+
+STATUS_KIND_SYSTEM = "system"
+STATUS_KIND_HITL = "hitl"
+
+
+class StatusEvent(BaseModel):
+  """Entry of the status history of a document, kept in the status_event
+  subcollection of the document and never changed once written.
+
+  kind is "system" for the pipeline stages and "hitl" for the reviewer
+  actions, entry is the status dict as recorded in the latest status of
+  the document. The event id may be given by the service reporting the
+  status, so a status sent again is recognized and recorded once.
+  """
+  event_id = IDField()
+  kind = TextField()
+  stage = TextField()
+  status = TextField()
+  timestamp = DateTime()
+  entry = MapField()
+
+  class Meta:
+    ignore_none_field = False
+    collection_name = "status_event"
+
+  @classmethod
+  def record(cls,
+             document_key,
+             kind,
+             entry,
+             transaction=None,
+             batch=None,
+             event_id=None):
+    """Appends the entry to the history of the document, as part of the
+    transaction or batch when one is given
+
+    Returns:
+        str: id of the event, event_id or a new id
+    """
+    event = cls(parent=document_key)
+    event.event_id = event_id or uuid.uuid4().hex
+    event.kind = kind
+    event.stage = entry.get("stage")
+    event.status = entry.get("status")
+    event.timestamp = entry.get("timestamp")
+    event.entry = entry
+    event.save(transaction=transaction, batch=batch)
+    return event.event_id
+
+  @classmethod
+  def recorded(cls,
+               events: Iterable[Tuple[str, str]],
+               transaction=None) -> Set[str]:
+    """Returns the ids of the events already in the history, read in a
+    single round trip
+
+    Args:
+        events: (document key, event id) pairs
+        transaction: Firestore transaction the reads are part of
+    """
+    refs = [
+        db.conn.document(f"{document_key}/{cls.collection_name}/{event_id}")
+        for document_key, event_id in events
+    ]
+    if not refs:
+      return set()
+    return {
+        snapshot.id
+        for snapshot in db.conn.get_all(refs, transaction=transaction)
+        if snapshot.exists
+    }
+
+  @classmethod
+  def history(cls, document_key):
+    """Returns the events of the document, oldest first"""
+    return list(
+        cls.collection.parent(document_key).order("timestamp").fetch())
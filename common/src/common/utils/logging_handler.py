@@ -29,6 +29,11 @@ logging.basicConfig(level=logging.INFO)
 class Logger():
   """class def handling logs."""
 
+  @staticmethod
+  def debug(message):
+    """Display debug logs."""
+    logging.debug(message)
+
   @staticmethod
   def info(message):
     """Display info logs."""
@@ -0,0 +1,137 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+""" Prometheus metrics of the pipeline stages and the API requests """
+
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
+from starlette.responses import Response
+
+# Prometheus text format, the charset is added by the response
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4"
+
+# Stages go from a few milliseconds for a Firestore write to minutes for a
+# Document AI batch process
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+                 60, 120, 300, 600)
+
+STAGE_DURATION = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Time spent in a pipeline stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS)
+STAGE_IN_FLIGHT = Gauge(
+    "pipeline_stage_in_flight",
+    "Pipeline stages currently running", ["stage"])
+STAGE_ERRORS = Counter(
+    "pipeline_stage_errors_total",
+    "Pipeline stages that raised an error", ["stage"])
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling an API request",
+    ["method", "path", "status"],
+    buckets=STAGE_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight",
+                           "API requests currently handled")
+
+
+@contextmanager
+def track_stage(stage: str):
+  """Records the duration, the in flight count and the errors of the
+  code run in the block
+
+  Example:
+    with track_stage("docai_call"):
+      result = client.process_document(request=request)
+  """
+  STAGE_IN_FLIGHT.labels(stage).inc()
+  start_time = time.perf_counter()
+  try:
+    yield
+  except Exception:
+    STAGE_ERRORS.labels(stage).inc()
+    raise
+  finally:
+    STAGE_DURATION.labels(stage).observe(time.perf_counter() - start_time)
+    STAGE_IN_FLIGHT.labels(stage).dec()
+
+
+def timed_stage(stage: str):
+  """Decorator recording the function as a pipeline stage, for plain and
+  async functions"""
+
+  def decorator(fn):
+    if inspect.iscoroutinefunction(fn):
+
+      @functools.wraps(fn)
+      async def async_wrapper(*args, **kwargs):
+        with track_stage(stage):
+          return await fn(*args, **kwargs)
+
+      return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      with track_stage(stage):
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+  return decorator
+
+
+def route_path(scope):
+  """Path of the request with the path parameters put back as templates,
+  so a label is kept per route and not per id"""
+  # A mounted app is the endpoint until a route of the app matched
+  if not inspect.isroutine(scope.get("endpoint")):
+    return "unmatched"
+  path = scope.get("root_path", "") + scope.get("path", "")
+  for name, value in (scope.get("path_params") or {}).items():
+    path = path.replace(f"/{value}", f"/{{{name}}}")
+  return path
+
+
+@contextmanager
+def track_request(scope):
+  """Records an API request, the status code is set on the yielded dict
+
+  Example:
+    with track_request(request.scope) as labels:
+      response = await call_next(request)
+      labels["status"] = response.status_code
+  """
+  labels = {"status": 500}
+  REQUESTS_IN_FLIGHT.inc()
+  start_time = time.perf_counter()
+  try:
+    yield labels
+  finally:
+    # path_params are set on the scope once the route matched
+    REQUEST_DURATION.labels(scope.get("method"), route_path(scope),
+                            str(labels["status"])).observe(
+                                time.perf_counter() - start_time)
+    REQUESTS_IN_FLIGHT.dec()
+
+
+def metrics_response():
+  """Response with all the metrics of the process in Prometheus text
+  format"""
+  return Response(generate_latest(), media_type=METRICS_MEDIA_TYPE)
@@ -0,0 +1,71 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the pipeline metrics
+"""
+import pytest
+from prometheus_client import REGISTRY
+from common.utils.metrics import track_stage, timed_stage, route_path
+
+
+def sample(name, stage):
+  return REGISTRY.get_sample_value(name, {"stage": stage}) or 0
+
+
+def test_track_stage_records_duration_and_errors():
+  """Every run is observed, only the failed ones are counted as errors"""
+  count = sample("pipeline_stage_duration_seconds_count", "test_stage")
+  errors = sample("pipeline_stage_errors_total", "test_stage")
+  with track_stage("test_stage"):
+    pass
+  with pytest.raises(ValueError):
+    with track_stage("test_stage"):
+      raise ValueError()
+  assert sample("pipeline_stage_duration_seconds_count",
+                "test_stage") == count + 2
+  assert sample("pipeline_stage_errors_total", "test_stage") == errors + 1
+  assert sample("pipeline_stage_in_flight", "test_stage") == 0
+
+
+def test_timed_stage_decorator():
+  """The decorated function is recorded and its result returned"""
+
+  @timed_stage("test_decorated")
+  def add(a, b):
+    return a + b
+
+  assert add(1, 2) == 3
+  assert sample("pipeline_stage_duration_seconds_count",
+                "test_decorated") == 1
+
+
+def test_route_path_uses_templates():
+  """Path parameters are replaced by their name"""
+
+  def get_claim():
+    pass
+
+  scope = {
+      "root_path": "/sample_service/v1",
+      "path": "/claim/abc123",
+      "path_params": {
+          "claim_id": "abc123"
+      },
+      "endpoint": get_claim
+  }
+  assert route_path(scope) == "/sample_service/v1/claim/{claim_id}"
+  assert route_path({"path": "/unknown/path"}) == "unmatched"
@@ -16,18 +16,80 @@ limitations under the License.
 
 """ Publishes the messages to pubsub """
 
+import asyncio
 import json
+from typing import Dict, List
 from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.types import BatchSettings, PublisherOptions, \
+  PublishFlowControl, LimitExceededBehavior
 from common.config import PROJECT_ID, TOPIC_ID
+from common.config import PUBSUB_BATCH_MAX_MESSAGES, PUBSUB_BATCH_MAX_BYTES, \
+  PUBSUB_BATCH_MAX_LATENCY_SECONDS, PUBSUB_FLOW_CONTROL_MAX_MESSAGES, \
+  PUBSUB_FLOW_CONTROL_MAX_BYTES
 
-publisher = pubsub_v1.PublisherClient()
-topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+_publisher = None
+
+
+def get_publisher():
+  """Returns the publisher client of the process, created on first use.
+  Messages are batched and publishing blocks when too many are pending."""
+  global _publisher
+  if _publisher is None:
+    _publisher = pubsub_v1.PublisherClient(
+        batch_settings=BatchSettings(
+            max_messages=PUBSUB_BATCH_MAX_MESSAGES,
+            max_bytes=PUBSUB_BATCH_MAX_BYTES,
+            max_latency=PUBSUB_BATCH_MAX_LATENCY_SECONDS),
+        publisher_options=PublisherOptions(
+            flow_control=PublishFlowControl(
+                message_limit=PUBSUB_FLOW_CONTROL_MAX_MESSAGES,
+                byte_limit=PUBSUB_FLOW_CONTROL_MAX_BYTES,
+                limit_exceeded_behavior=LimitExceededBehavior.BLOCK)))
+  return _publisher
+
+
+def get_topic_path():
+  return get_publisher().topic_path(PROJECT_ID, TOPIC_ID)
+
+
+def publish_many(message_dicts: List[Dict]):
+  """Queues the messages for publishing
+
+  Returns:
+    the publish futures of the messages, resolving to the message ids
+  """
+  publisher = get_publisher()
+  topic_path = get_topic_path()
+  return [
+      publisher.publish(topic_path,
+                        json.dumps(message_dict).encode("utf-8"))
+      for message_dict in message_dicts
+  ]
 
 
 def publish_document(message_dict):
-  # print("inside publisher")
-  message_json = json.dumps(message_dict)
-  message_json = message_json.encode("utf-8")
-  future = publisher.publish(topic_path, message_json)
-  return future.result()
+  """Publishes the message and waits for its message id"""
+  return publish_many([message_dict])[0].result()
+
+
+async def publish_many_async(message_dicts: List[Dict]):
+  """Publishes the messages without blocking the event loop
+
+  Returns:
+    the message ids
+  """
+  loop = asyncio.get_running_loop()
+  # Queuing only blocks under flow control, keep it off the event loop
+  futures = await loop.run_in_executor(None, publish_many, message_dicts)
+  return await asyncio.gather(
+      *[asyncio.wrap_future(future) for future in futures])
+
+
+async def publish_document_async(message_dict):
+  """Publishes the message without blocking the event loop
 
+  Returns:
+    the message id
+  """
+  message_ids = await publish_many_async([message_dict])
+  return message_ids[0]
@@ -0,0 +1,116 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Search terms of a document, stored in an array field of the document
+so Firestore indexes them and a search reads only the documents holding
+a term of the query.
+
+The values of the DB_KEYS fields and of the ENTITY_KEYS entities give
+  t:<value> and t:<token> for the whole value and each of its words,
+  g:<trigram> for every 3 characters of the value, so any substring of
+    3 characters or more has all its trigrams in the terms,
+  p:<prefix> for the first 1 and 2 characters of each word.
+"""
+
+import datetime
+import re
+from typing import Dict, List, Optional
+from common.config import DB_KEYS, ENTITY_KEYS
+
+TOKEN_SEPARATORS = re.compile(r"[\s,;:()\[\]/\\\"'@._+-]+")
+# Grams of longer values are not indexed past this length
+MAX_INDEXED_LENGTH = 200
+GRAM_SIZE = 3
+
+
+def normalize(value) -> Optional[str]:
+  if value is None or isinstance(value, (dict, list, datetime.datetime)):
+    return None
+  if isinstance(value, bool):
+    value = str(value)
+  return str(value).strip().lower()
+
+
+def entity_value(entity: Dict):
+  """The value a search compares, the correction when there is one"""
+  if entity.get("corrected_value") is not None:
+    return entity["corrected_value"]
+  return entity.get("value")
+
+
+def indexed_values(fields: Dict, entities: Optional[List[Dict]]) -> List:
+  values = [fields.get(key) for key in DB_KEYS]
+  for entity in entities or []:
+    if entity.get("entity") in ENTITY_KEYS:
+      values.append(entity_value(entity))
+  return values
+
+
+def value_terms(value: str) -> set:
+  terms = {"t:" + value[:MAX_INDEXED_LENGTH]}
+  for token in TOKEN_SEPARATORS.split(value):
+    if token:
+      terms.add("t:" + token[:MAX_INDEXED_LENGTH])
+      terms.add("p:" + token[:1])
+      if len(token) > 1:
+        terms.add("p:" + token[:2])
+  indexed = value[:MAX_INDEXED_LENGTH]
+  for start in range(len(indexed) - GRAM_SIZE + 1):
+    terms.add("g:" + indexed[start:start + GRAM_SIZE])
+  return terms
+
+
+def search_terms(fields: Dict, entities: Optional[List[Dict]]) -> List[str]:
+  """Terms of the document with the given DB_KEYS fields and entities,
+  sorted so an unchanged document gets the same list"""
+  terms = set()
+  for value in indexed_values(fields, entities):
+    value = normalize(value)
+    if value:
+      terms |= value_terms(value)
+  return sorted(terms)
+
+
+def query_terms(term) -> List[List[str]]:
+  """Terms of the tiers of a search, best matches first: the documents
+  with a value or a word equal to the search term, then the others
+  containing it. A document of a tier holds every term of the tier, the
+  first term is looked up and the others are checked on the candidates,
+  which are then checked against the search term.
+
+  A search term of 3 characters or more gives the tier of all its
+  trigrams. A shorter term has no trigram, it gives the tier of the words
+  starting with it then an empty tier: every document is a candidate, so
+  the substrings in the middle of a word are still found by a scan.
+
+  Returns:
+    the terms of each tier, no tier for a blank search term and only the
+    exact tier for terms that are not strings, they only match exactly
+  """
+  value = normalize(term)
+  if not value:
+    return []
+  tiers = [["t:" + value[:MAX_INDEXED_LENGTH]]]
+  if not isinstance(term, str):
+    return tiers
+  if len(value) < GRAM_SIZE:
+    return tiers + [["p:" + value], []]
+  indexed = value[:MAX_INDEXED_LENGTH]
+  grams = {
+      "g:" + indexed[start:start + GRAM_SIZE]
+      for start in range(len(indexed) - GRAM_SIZE + 1)
+  }
+  return tiers + [sorted(grams)]
@@ -0,0 +1,67 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the search terms of the documents
+"""
+from common.utils.search_terms import search_terms, query_terms
+
+
+def document_terms(**fields):
+  entities = fields.pop("entities", None)
+  return set(search_terms(fields, entities))
+
+
+def test_terms_of_fields_and_entities():
+  terms = document_terms(
+      case_id="Case-42",
+      entities=[{
+          "entity": "name",
+          "value": "Jon Smith",
+          "corrected_value": "John Smith"
+      }, {
+          "entity": "ssn",
+          "value": "123",
+          "corrected_value": None
+      }])
+  assert {"t:case-42", "t:john smith", "t:john", "t:smith"} <= terms
+  assert {"g:cas", "g:n s", "g:ith", "p:j", "p:jo"} <= terms
+  # Values before the correction and entities not searched are left out
+  assert "t:jon" not in terms
+  assert "t:123" not in terms
+
+
+def test_every_substring_has_its_query_terms():
+  value = "arkansas-form"
+  terms = document_terms(case_id=value)
+  for start in range(len(value) - 2):
+    for end in range(start + 3, len(value) + 1):
+      exact, partial = query_terms(value[start:end].upper())
+      assert exact == ["t:" + value[start:end]]
+      assert set(partial) <= terms
+      assert len(partial) == end - start - 2
+  # Shorter terms find the words starting with them first, then scan
+  assert query_terms("fo") == [["t:fo"], ["p:fo"], []]
+  assert "p:fo" in terms
+  assert "p:ar" in terms
+  assert "t:arkansas" in terms
+
+
+def test_query_terms_of_other_values():
+  assert not query_terms(None)
+  assert not query_terms("  ")
+  assert query_terms(0.5) == [["t:0.5"]]
+  assert "t:0.5" in document_terms(extraction_score=0.5)
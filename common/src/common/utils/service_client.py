@@ -0,0 +1,389 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+""" Pooled HTTP client for the calls between the microservices """
+
+import abc
+import asyncio
+import random
+import time
+import uuid
+from typing import Optional, List, Dict
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from common.config import DOCUMENT_STATUS_SERVICE_URL, \
+  CLASSIFICATION_SERVICE_URL, EXTRACTION_SERVICE_URL, \
+  VALIDATION_SERVICE_URL, MATCHING_SERVICE_URL, UPLOAD_SERVICE_URL
+from common.config import SERVICE_CLIENT_POOL_SIZE, \
+  SERVICE_CONNECT_TIMEOUT_SECONDS, SERVICE_CALL_TIMEOUT_SECONDS, \
+  SERVICE_LONG_CALL_TIMEOUT_SECONDS, SERVICE_CALL_RETRIES, \
+  SERVICE_RETRY_BACKOFF_SECONDS, SERVICE_RETRY_MAX_BACKOFF_SECONDS
+from common.utils.logging_handler import Logger
+
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+def backoff_seconds(attempt: int):
+  """Exponential backoff with full jitter for the given retry attempt"""
+  ceiling = min(SERVICE_RETRY_MAX_BACKOFF_SECONDS,
+                SERVICE_RETRY_BACKOFF_SECONDS * (2**attempt))
+  return random.uniform(0, ceiling)
+
+
+def new_event_id() -> str:
+  """Id of the status event of a status update, sent along with each try
+  of the update"""
+  return uuid.uuid4().hex
+
+
+def clean_params(params: Optional[Dict]):
+  """Drops the query parameters that are not set"""
+  if not params:
+    return None
+  return {key: value for key, value in params.items() if value is not None}
+
+
+class ServiceCalls(abc.ABC):
+  """Typed calls to the microservice endpoints, shared by the sync and
+  async clients. Each call returns what post returns: a response for
+  ServiceClient and an awaitable response for AsyncServiceClient.
+
+  Calls marked idempotent=False are only retried when the connection
+  could not be established, so the request never reached the service.
+  The status updates are sent with a new event_id each, the document
+  status service records a status event once per event_id, so they are
+  retried like idempotent calls.
+  """
+
+  @abc.abstractmethod
+  def post(self,
+           url: str,
+           params: Optional[Dict] = None,
+           json=None,
+           timeout: float = SERVICE_CALL_TIMEOUT_SECONDS,
+           retries: int = SERVICE_CALL_RETRIES,
+           idempotent: bool = True):
+    """Sends the request, retried on 502, 503, 504 and network errors
+    when idempotent"""
+
+  # ========= Document status service ==============
+
+  def create_document(self,
+                      case_id: str,
+                      filename: str,
+                      context: str,
+                      user: Optional[str] = None):
+    return self.post(
+        f"{DOCUMENT_STATUS_SERVICE_URL}/create_document",
+        params={
+            "case_id": case_id,
+            "filename": filename,
+            "context": context,
+            "user": user
+        },
+        idempotent=False)
+
+  def create_document_json_input(self, case_id: str, document_class: str,
+                                 document_type: str, context: str,
+                                 entities: List[Dict]):
+    return self.post(
+        f"{DOCUMENT_STATUS_SERVICE_URL}/create_documet_json_input",
+        params={
+            "case_id": case_id,
+            "document_class": document_class,
+            "document_type": document_type,
+            "context": context
+        },
+        json=entities,
+        idempotent=False)
+
+  def update_classification_status(self,
+                                   case_id: str,
+                                   uid: str,
+                                   status: str,
+                                   is_hitl: Optional[bool] = None,
+                                   document_class: Optional[str] = None,
+                                   document_type: Optional[str] = None):
+    return self.post(
+        f"{DOCUMENT_STATUS_SERVICE_URL}/update_classification_status",
+        params={
+            "case_id": case_id,
+            "uid": uid,
+            "status": status,
+            "is_hitl": is_hitl,
+            "document_class": document_class,
+            "document_type": document_type,
+            "event_id": new_event_id()
+        })
+
+  def update_extraction_status(self,
+                               case_id: str,
+                               uid: str,
+                               status: str,
+                               entities: Optional[List[Dict]] = None,
+                               extraction_score: Optional[float] = None,
+                               extraction_status: Optional[str] = None):
+    return self.post(
+        f"{DOCUMENT_STATUS_SERVICE_URL}/update_extraction_status",
+        params={
+            "case_id": case_id,
+            "uid": uid,
+            "status": status,
+            "extraction_score": extraction_score,
+            "extraction_status": extraction_status,
+            "event_id": new_event_id()
+        },
+        json=entities)
+
+  def update_validation_status(self,
+                               case_id: str,
+                               uid: str,
+                               status: str,
+                               entities: Optional[List[Dict]] = None,
+                               validation_score: Optional[float] = None):
+    return self.post(
+        f"{DOCUMENT_STATUS_SERVICE_URL}/update_validation_status",
+        params={
+            "case_id": case_id,
+            "uid": uid,
+            "status": status,
+            "validation_score": validation_score,
+            "event_id": new_event_id()
+        },
+        json=entities)
+
+  def update_matching_status(self,
+                             case_id: str,
+                             uid: str,
+                             status: str,
+                             entities: Optional[List[Dict]] = None,
+                             matching_score: Optional[float] = None):
+    return self.post(
+        f"{DOCUMENT_STATUS_SERVICE_URL}/update_matching_status",
+        params={
+            "case_id": case_id,
+            "uid": uid,
+            "status": status,
+            "matching_score": matching_score,
+            "event_id": new_event_id()
+        },
+        json=entities)
+
+  def update_autoapproved_status(self, case_id: str, uid: str, status: str,
+                                 autoapproved_status: str,
+                                 is_autoapproved: str):
+    return self.post(
+        f"{DOCUMENT_STATUS_SERVICE_URL}/update_autoapproved_status",
+        params={
+            "case_id": case_id,
+            "uid": uid,
+            "status": status,
+            "autoapproved_status": autoapproved_status,
+            "is_autoapproved": is_autoapproved,
+            "event_id": new_event_id()
+        })
+
+  def update_status_batch(self, updates: List[Dict]):
+    """Applies status updates of many documents and stages at once, each
+    update has the fields of StatusUpdate of the document status
+    service. An update without an event_id gets a new one."""
+    updates = [
+        dict(update, event_id=update.get("event_id") or new_event_id())
+        for update in updates
+    ]
+    return self.post(
+        f"{DOCUMENT_STATUS_SERVICE_URL}/update_status_batch",
+        json={"updates": updates})
+
+  # ========= Pipeline stages ======================
+
+  def classify(self, case_id: str, uid: str, gcs_url: str):
+    return self.post(
+        f"{CLASSIFICATION_SERVICE_URL}/classification/classification_api",
+        params={
+            "case_id": case_id,
+            "uid": uid,
+            "gcs_url": gcs_url
+        },
+        timeout=SERVICE_LONG_CALL_TIMEOUT_SECONDS,
+        idempotent=False)
+
+  def extract(self, case_id: str, uid: str, doc_class: str,
+              document_type: str, context: str, gcs_url: str):
+    return self.post(
+        f"{EXTRACTION_SERVICE_URL}/extraction_api",
+        params={
+            "case_id": case_id,
+            "uid": uid,
+            "doc_class": doc_class,
+            "document_type": document_type,
+            "context": context,
+            "gcs_url": gcs_url
+        },
+        timeout=SERVICE_LONG_CALL_TIMEOUT_SECONDS,
+        idempotent=False)
+
+  def validate(self, case_id: str, uid: str, doc_class: str,
+               entities: List[Dict]):
+    return self.post(
+        f"{VALIDATION_SERVICE_URL}/validation/validation_api",
+        params={
+            "case_id": case_id,
+            "uid": uid,
+            "doc_class": doc_class
+        },
+        json=entities,
+        idempotent=False)
+
+  def match(self, case_id: str, uid: str):
+    return self.post(
+        f"{MATCHING_SERVICE_URL}/match_document",
+        params={
+            "case_id": case_id,
+            "uid": uid
+        },
+        idempotent=False)
+
+  def process_task(self,
+                   configs: List[Dict],
+                   is_hitl: bool = False,
+                   is_reassign: bool = False,
+                   url: str = f"{UPLOAD_SERVICE_URL}/process_task",
+                   timeout: float = SERVICE_CALL_TIMEOUT_SECONDS,
+                   priority: Optional[str] = None):
+    return self.post(
+        url,
+        params={
+            "is_hitl": is_hitl or None,
+            "is_reassign": is_reassign or None,
+            "priority": priority
+        },
+        json={"configs": configs},
+        timeout=timeout,
+        idempotent=False)
+
+
+class ServiceClient(ServiceCalls):
+  """Blocking client over a keep-alive connection pool, safe to share
+  between threads"""
+
+  def __init__(self, pool_size: int = SERVICE_CLIENT_POOL_SIZE):
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+  def post(self,
+           url: str,
+           params: Optional[Dict] = None,
+           json=None,
+           timeout: float = SERVICE_CALL_TIMEOUT_SECONDS,
+           retries: int = SERVICE_CALL_RETRIES,
+           idempotent: bool = True):
+    attempt = 0
+    while True:
+      try:
+        response = self.session.post(
+            url,
+            params=clean_params(params),
+            json=json,
+            timeout=(SERVICE_CONNECT_TIMEOUT_SECONDS, timeout))
+        if (not idempotent or response.status_code not in RETRY_STATUS_CODES
+            or attempt >= retries):
+          return response
+        Logger.warning(f"POST {url} returned {response.status_code}, "
+                       f"retry {attempt + 1} of {retries}")
+      except (requests.exceptions.ConnectionError,
+              requests.exceptions.Timeout) as e:
+        # ConnectTimeout is both a ConnectionError and a Timeout, a
+        # ReadTimeout means the request may already have been handled
+        connect_failed = not isinstance(e, requests.exceptions.ReadTimeout)
+        if attempt >= retries or not (idempotent or connect_failed):
+          raise
+        Logger.warning(f"POST {url} failed with {e}, "
+                       f"retry {attempt + 1} of {retries}")
+      time.sleep(backoff_seconds(attempt))
+      attempt += 1
+
+
+class AsyncServiceClient(ServiceCalls):
+  """Asyncio client over a keep-alive connection pool, the calls return
+  coroutines to be awaited from the event loop"""
+
+  def __init__(self, pool_size: int = SERVICE_CLIENT_POOL_SIZE):
+    self.client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size))
+
+  def post(self,
+           url: str,
+           params: Optional[Dict] = None,
+           json=None,
+           timeout: float = SERVICE_CALL_TIMEOUT_SECONDS,
+           retries: int = SERVICE_CALL_RETRIES,
+           idempotent: bool = True):
+    return self._post(url, params, json, timeout, retries, idempotent)
+
+  async def _post(self, url: str, params: Optional[Dict], json,
+                  timeout: float, retries: int, idempotent: bool):
+    attempt = 0
+    while True:
+      try:
+        response = await self.client.post(
+            url,
+            params=clean_params(params),
+            json=json,
+            timeout=httpx.Timeout(
+                timeout, connect=SERVICE_CONNECT_TIMEOUT_SECONDS))
+        if (not idempotent or response.status_code not in RETRY_STATUS_CODES
+            or attempt >= retries):
+          return response
+        Logger.warning(f"POST {url} returned {response.status_code}, "
+                       f"retry {attempt + 1} of {retries}")
+      except httpx.TransportError as e:
+        connect_failed = isinstance(e, (httpx.ConnectError,
+                                        httpx.ConnectTimeout))
+        if attempt >= retries or not (idempotent or connect_failed):
+          raise
+        Logger.warning(f"POST {url} failed with {e}, "
+                       f"retry {attempt + 1} of {retries}")
+      await asyncio.sleep(backoff_seconds(attempt))
+      attempt += 1
+
+  async def aclose(self):
+    await self.client.aclose()
+
+
+_service_client = None
+_async_service_client = None
+
+
+def get_service_client():
+  """Returns the process wide blocking service client"""
+  global _service_client
+  if _service_client is None:
+    _service_client = ServiceClient()
+  return _service_client
+
+
+def get_async_service_client():
+  """Returns the process wide async service client"""
+  global _async_service_client
+  if _async_service_client is None:
+    _async_service_client = AsyncServiceClient()
+  return _async_service_client
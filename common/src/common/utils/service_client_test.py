@@ -0,0 +1,134 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the service to service client
+"""
+# disabling pylint rules that conflict with pytest fixtures
+# pylint: disable=unused-argument,redefined-outer-name
+import asyncio
+from unittest import mock
+import pytest
+import requests
+from common.utils.service_client import AsyncServiceClient, ServiceCalls, \
+  ServiceClient
+from common.config import DOCUMENT_STATUS_SERVICE_URL, STATUS_SUCCESS
+
+
+def fake_response(status_code):
+  response = mock.Mock()
+  response.status_code = status_code
+  return response
+
+
+@pytest.fixture
+def client():
+  with mock.patch("common.utils.service_client.time.sleep"):
+    service_client = ServiceClient(pool_size=2)
+    service_client.session = mock.Mock()
+    yield service_client
+
+
+def test_unset_params_are_dropped(client):
+  """Optional parameters that are not set are not sent as 'None'"""
+  client.session.post.return_value = fake_response(200)
+  client.create_document("case_1", "form.pdf", "arkansas")
+  args, kwargs = client.session.post.call_args
+  assert args[0] == f"{DOCUMENT_STATUS_SERVICE_URL}/create_document"
+  assert kwargs["params"] == {
+      "case_id": "case_1",
+      "filename": "form.pdf",
+      "context": "arkansas"
+  }
+
+
+def test_status_update_retried_on_unavailable(client):
+  """Status updates are retried on 503 with the same event_id, the
+  service records the event once"""
+  client.session.post.side_effect = [fake_response(503), fake_response(200)]
+  response = client.update_matching_status("case_1", "uid_1", STATUS_SUCCESS)
+  assert response.status_code == 200
+  assert client.session.post.call_count == 2
+  first, retry = [call[1]["params"]["event_id"]
+                  for call in client.session.post.call_args_list]
+  assert first and first == retry
+
+
+def test_status_batch_event_ids(client):
+  """Each update of a batch gets an event_id, kept for the retries"""
+  client.session.post.side_effect = [fake_response(502), fake_response(200)]
+  client.update_status_batch([{"uid": "uid_1"}, {"uid": "uid_2",
+                                                 "event_id": "sent"}])
+  first, retry = [call[1]["json"]["updates"]
+                  for call in client.session.post.call_args_list]
+  assert first == retry
+  assert first[0]["event_id"] and first[1]["event_id"] == "sent"
+
+
+def test_async_client_retried_on_unavailable():
+  """The async client retries idempotent calls the same way"""
+  service_client = AsyncServiceClient(pool_size=2)
+  responses = [fake_response(503), fake_response(200)]
+  calls = []
+
+  async def post(*args, **kwargs):
+    calls.append((args, kwargs))
+    return responses.pop(0)
+
+  async def no_sleep(_):
+    pass
+
+  service_client.client = mock.Mock(post=post)
+  with mock.patch("common.utils.service_client.asyncio.sleep", no_sleep):
+    response = asyncio.run(
+        service_client.update_extraction_status("case_1", "uid_1",
+                                                STATUS_SUCCESS))
+  assert response.status_code == 200
+  assert len(calls) == 2
+
+
+def test_service_calls_is_abstract():
+  with pytest.raises(TypeError):
+    ServiceCalls()  # pylint: disable=abstract-class-instantiated
+
+
+def test_pipeline_call_not_retried_on_unavailable(client):
+  """Non idempotent calls return the first response that reached the
+  service"""
+  client.session.post.return_value = fake_response(503)
+  response = client.match("case_1", "uid_1")
+  assert response.status_code == 503
+  assert client.session.post.call_count == 1
+
+
+def test_pipeline_call_retried_on_connection_error(client):
+  """Non idempotent calls are retried when the connection failed"""
+  client.session.post.side_effect = [
+      requests.exceptions.ConnectionError(),
+      fake_response(200)
+  ]
+  response = client.classify("case_1", "uid_1", "gs://bucket/form.pdf")
+  assert response.status_code == 200
+  assert client.session.post.call_count == 2
+
+
+def test_pipeline_call_not_retried_on_read_timeout(client):
+  """A read timeout is raised for non idempotent calls"""
+  client.session.post.side_effect = requests.exceptions.ReadTimeout()
+  with pytest.raises(requests.exceptions.ReadTimeout):
+    client.extract("case_1", "uid_1", "driver_license", "supporting_documents",
+                   "arkansas", "gs://bucket/form.pdf")
+  assert client.session.post.call_count == 1
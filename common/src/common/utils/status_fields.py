@@ -0,0 +1,164 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Status fields of a document shown by the HITL lists, derived from its
+latest statuses when they are written"""
+
+import datetime
+from typing import Dict, List, Optional
+from common.config import STATUS_SUCCESS, STATUS_ERROR, STATUS_REVIEW, \
+  STATUS_IN_PROGRESS, STATUS_TIMEOUT
+
+PROCESS_NEXT_STAGE = {
+    "uploaded": "classifying",
+    "classification": "extracting",
+    "extraction": "validating",
+    "validation": "matching",
+    "matching": "Auto-approval checking",
+}
+
+
+def utc_naive(timestamp):
+  """Timestamps read from Firestore are aware, the ones of a status being
+  written are naive UTC, they are compared as naive UTC"""
+  if isinstance(timestamp, datetime.datetime) and timestamp.tzinfo:
+    return timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+  return timestamp
+
+
+def applicant_name(entities: Optional[List[Dict]]) -> str:
+  name = "N/A"
+  for entity in entities or []:
+    if entity["entity"] == "name":
+      if entity["corrected_value"]:
+        name = entity["corrected_value"]
+      elif entity["value"]:
+        name = entity["value"]
+  return name
+
+
+def derive_status_fields(system_status: Optional[List[Dict]],
+                         hitl_status: Optional[List[Dict]],
+                         auto_approval: Optional[str],
+                         entities: Optional[List[Dict]]) -> Dict:
+  """Works out the fields of the lists from the latest system and hitl
+  statuses of a document.
+
+  Returns:
+    dict with current_status, process_status, status_last_updated_by,
+    last_update_timestamp, applicant_name and is_unclassified. A document
+    still in progress is timed out by the sweeper of the document status
+    service, see timeout_status_fields.
+  """
+  process_stage = "-"
+  current_status = "-"
+  status_last_updated_by = "-"
+  last_update_timestamp = None
+  last_system_status = system_status[-1] if system_status else None
+  last_hitl_status = hitl_status[-1] if hitl_status else None
+
+  latest = [
+      status for status in (last_system_status, last_hitl_status) if status
+  ]
+  if latest:
+    last_status = max(latest, key=lambda d: utc_naive(d["timestamp"]))
+    last_update_timestamp = last_status["timestamp"]
+    status_last_updated_by = last_status.get("last_status", "System")
+
+  if last_system_status:
+    process_stage = last_system_status["stage"].lower()
+    status_last_updated_by = "System"
+
+    # If there's HITL status, use the latest HITL status.
+    if last_hitl_status:
+      if utc_naive(last_system_status["timestamp"]) > utc_naive(
+          last_hitl_status["timestamp"]):
+        if last_system_status["stage"] == "auto_approval":
+          if last_system_status["status"] == STATUS_SUCCESS:
+            current_status = auto_approval.title()
+          else:
+            current_status = STATUS_IN_PROGRESS
+        elif last_system_status["status"] == STATUS_SUCCESS:
+          current_status = STATUS_IN_PROGRESS
+        else:
+          current_status = STATUS_ERROR
+      else:
+        if last_hitl_status["status"] == "reassigned":
+          current_status = STATUS_IN_PROGRESS
+        else:
+          current_status = last_hitl_status["status"].title()
+          status_last_updated_by = last_hitl_status["user"]
+          last_update_timestamp = last_hitl_status["timestamp"]
+
+    # Otherwise, check the last system status.
+    else:
+      if last_system_status["stage"] == "auto_approval":
+        if last_system_status["status"] == STATUS_SUCCESS:
+          current_status = auto_approval.title()
+        else:
+          current_status = STATUS_REVIEW
+      elif last_system_status["status"] == STATUS_SUCCESS:
+        current_status = STATUS_IN_PROGRESS
+      else:
+        current_status = STATUS_ERROR
+
+    # Show next stage process status.
+    if current_status == STATUS_IN_PROGRESS:
+      if process_stage in PROCESS_NEXT_STAGE:
+        process_stage = PROCESS_NEXT_STAGE[process_stage] + "..."
+    else:
+      process_stage = process_stage + " " + last_system_status["status"]
+
+  return {
+      "current_status": current_status,
+      "process_status": process_stage.title(),
+      "status_last_updated_by": status_last_updated_by,
+      "last_update_timestamp": last_update_timestamp,
+      "applicant_name": applicant_name(entities),
+      "is_unclassified": bool(last_system_status) and
+                         last_system_status["stage"].lower() ==
+                         "classification" and
+                         last_system_status["status"] != STATUS_SUCCESS
+  }
+
+
+def timeout_status_fields(system_status: Optional[List[Dict]]) -> Dict:
+  """Fields of a document that stayed in progress past the process
+  timeout"""
+  stage = system_status[-1]["stage"] if system_status else "-"
+  return {
+      "current_status": STATUS_ERROR,
+      "process_status": (stage + " " + STATUS_TIMEOUT).title()
+  }
+
+
+def list_documents(docs_list: List[Dict]) -> List[Dict]:
+  """Adds the fields shown by the lists to the document dicts. The status
+  fields are stored on the document whenever a status is written, they
+  are only derived here for the documents written before they existed."""
+  for doc in docs_list:
+    if doc.get("current_status") is None:
+      doc.update(
+          derive_status_fields(
+              doc.get("system_status"), doc.get("hitl_status"),
+              doc.get("auto_approval"), doc.get("entities")))
+    doc.pop("search_terms", None)
+    # The lists only keep the latest statuses, see /get_audit_trail
+    all_status_list = (doc.get("hitl_status", []) or []) + (
+        doc.get("system_status", []) or [])
+    doc["audit_trail"] = sorted(
+        all_status_list, key=lambda d: utc_naive(d["timestamp"]))
+  return docs_list
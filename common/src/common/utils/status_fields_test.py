@@ -0,0 +1,101 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the status fields of the HITL lists
+"""
+import datetime
+from common.config import STATUS_IN_PROGRESS, STATUS_ERROR, STATUS_SUCCESS
+from common.utils.status_fields import derive_status_fields, \
+  timeout_status_fields, list_documents
+
+UTC = datetime.timezone.utc
+
+
+def system(stage, status, hour):
+  return {
+      "stage": stage,
+      "status": status,
+      "timestamp": datetime.datetime(2022, 1, 1, hour, tzinfo=UTC)
+  }
+
+
+def test_stage_in_progress():
+  fields = derive_status_fields([system("classification", STATUS_SUCCESS, 1)],
+                                None, None, None)
+  assert fields["current_status"] == STATUS_IN_PROGRESS
+  assert fields["process_status"] == "Extracting..."
+  assert fields["status_last_updated_by"] == "System"
+  assert fields["applicant_name"] == "N/A"
+  assert not fields["is_unclassified"]
+
+
+def test_failed_classification_is_unclassified():
+  fields = derive_status_fields([system("classification", "unclassified", 1)],
+                                None, None, None)
+  assert fields["current_status"] == STATUS_ERROR
+  assert fields["process_status"] == "Classification Unclassified"
+  assert fields["is_unclassified"]
+
+
+def test_latest_of_system_and_hitl_status():
+  entities = [{"entity": "name", "value": "Max", "corrected_value": "Maxim"}]
+  system_status = [system("auto_approval", STATUS_SUCCESS, 1)]
+  # A status being written is naive UTC, the stored ones are aware
+  hitl_status = [{
+      "status": "rejected",
+      "user": "Jon",
+      "timestamp": datetime.datetime(2022, 1, 1, 2)
+  }]
+  fields = derive_status_fields(system_status, hitl_status, "approved",
+                                entities)
+  assert fields["current_status"] == "Rejected"
+  assert fields["status_last_updated_by"] == "Jon"
+  assert fields["applicant_name"] == "Maxim"
+
+  fields = derive_status_fields(system_status, None, "approved", entities)
+  assert fields["current_status"] == "Approved"
+  assert fields["process_status"] == "Auto_Approval Complete"
+
+
+def test_timeout():
+  fields = timeout_status_fields([system("extraction", STATUS_SUCCESS, 1)])
+  assert fields == {
+      "current_status": STATUS_ERROR,
+      "process_status": "Extraction Timeout"
+  }
+
+
+def test_list_documents():
+  hitl = {
+      "status": "rejected",
+      "user": "Jon",
+      "timestamp": datetime.datetime(2022, 1, 1, 3)
+  }
+  docs = list_documents([{
+      "system_status": [system("extraction", STATUS_SUCCESS, 2)],
+      "hitl_status": [hitl],
+      "search_terms": ["t:jon"]
+  }, {
+      "current_status": "Approved",
+      "system_status": None
+  }])
+  assert docs[0]["current_status"] == "Rejected"
+  assert "search_terms" not in docs[0]
+  assert [status.get("user") for status in docs[0]["audit_trail"]
+         ] == [None, "Jon"]
+  assert docs[1]["current_status"] == "Approved"
+  assert docs[1]["audit_trail"] == []
@@ -18,6 +18,7 @@ limitations under the License.
 import copy
 import json
 from .logging_handler import Logger
+from .metrics import track_stage
 from common.config import PROJECT_ID, DATABASE_PREFIX ,BIGQUERY_DB
 
 def stream_claim_to_bigquery(client, claim_dict, operation, timestamp):
@@ -79,7 +80,8 @@ def stream_document_to_bigquery(client, case_id ,uid,
     "document_type":document_type,
     "entities":entites}
   ]
-  errors = client.insert_rows_json(table_id, rows_to_insert)
+  with track_stage("bigquery_insert"):
+    errors = client.insert_rows_json(table_id, rows_to_insert)
   if errors == []:
     Logger.info(f"New rows have been added for "
                 f"case_id {case_id} and {uid}")
@@ -22,6 +22,7 @@ import asyncio
 import time
 import config
 from common.utils.logging_handler import Logger
+from common.utils.metrics import track_request, metrics_response
 from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Request
 from routes import classification
@@ -39,12 +40,15 @@ def set_default_executor():
 async def add_process_time_header(request: Request, call_next):
   method = request.method
   path = request.scope.get("path")
+  if path in ("/ping", "/metrics"):
+    return await call_next(request)
   start_time = time.time()
-  response = await call_next(request)
-  if path != "/ping":
-    process_time = time.time() - start_time
-    time_elapsed = round(process_time * 1000)
-    Logger.info(f"{method} {path} Time elapsed: {str(time_elapsed)} ms")
+  with track_request(request.scope) as labels:
+    response = await call_next(request)
+    labels["status"] = response.status_code
+  process_time = time.time() - start_time
+  time_elapsed = round(process_time * 1000)
+  Logger.info(f"{method} {path} Time elapsed: {str(time_elapsed)} ms")
   return response
 
 
@@ -53,6 +57,11 @@ def health_check():
   return True
 
 
+@app.get("/metrics")
+def metrics():
+  return metrics_response()
+
+
 api = FastAPI(title="Classification Service API", version="latest")
 
 api.include_router(classification.router)
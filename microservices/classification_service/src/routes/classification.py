@@ -18,12 +18,13 @@ limitations under the License.
 import os
 import shutil
 import json
-import requests
 from typing import Optional
 import traceback
 from fastapi import APIRouter, HTTPException
 
 from common.utils.logging_handler import Logger
+from common.utils.metrics import track_stage
+from common.utils.service_client import get_service_client
 from common.config import DOC_CLASS_STANDARDISATION_MAP,\
   APPLICATION_FORMS,SUPPORTING_DOCS
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
@@ -53,7 +54,8 @@ def predict_doc_type(case_id: str, uid: str, gcs_url: str):
 
   classifier = DocClassifier(case_id, uid, gcs_url, outfolder)
 
-  doc_type = json.loads(classifier.execute_job())
+  with track_stage("classification"):
+    doc_type = json.loads(classifier.execute_job())
   shutil.rmtree(outfolder)
   return doc_type
 
@@ -70,21 +72,17 @@ def update_classification_status(case_id: str,
      status (str): status success/failure depending on the validation_score
 
     """
-  base_url = "http://document-status-service/document_status_service" \
-  "/v1/update_classification_status"
-
   if status == STATUS_SUCCESS:
-    req_url = f"{base_url}?case_id={case_id}&uid={uid}" \
-    f"&status={status}&document_class={document_class}"\
-      f"&document_type={document_type}"
-    response = requests.post(req_url)
-    return response
+    return get_service_client().update_classification_status(
+        case_id,
+        uid,
+        status,
+        document_class=document_class,
+        document_type=document_type)
 
   else:
-    req_url = f"{base_url}?case_id={case_id}&uid={uid}" \
-    f"&status={status}"
-    response = requests.post(req_url)
-    return response
+    return get_service_client().update_classification_status(
+        case_id, uid, status)
 
 
 @router.post("/classification_api")
@@ -38,3 +38,10 @@ COLLECTION = os.getenv("COLLECTION")
 API_BASE_URL = os.getenv("API_BASE_URL")
 
 SERVICE_NAME = os.getenv("SERVICE_NAME")
+
+# Documents in progress for longer than PROCESS_TIMEOUT_SECONDS are marked
+# timed out by a sweep every interval, 0 disables the periodic sweep
+STATUS_SWEEP_INTERVAL_SECONDS = float(
+    os.getenv("STATUS_SWEEP_INTERVAL_SECONDS", "60"))
+# Documents timed out per transaction of a sweep
+STATUS_SWEEP_BATCH_SIZE = int(os.getenv("STATUS_SWEEP_BATCH_SIZE", "100"))
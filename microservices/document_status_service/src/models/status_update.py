@@ -0,0 +1,50 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+""" Arguments Classess """
+# pylint:disable=E0401,R0903,E0611
+from pydantic import BaseModel
+from typing import List, Dict, Optional
+
+
+class StatusUpdate(BaseModel):
+  """Status of one pipeline stage for a document, with the fields the
+  stage sets on success. stage is one of classification, extraction,
+  validation, matching or auto_approval. event_id identifies the status
+  event, an update sent again with the same event_id is recorded once.
+  """
+  case_id: str
+  uid: str
+  stage: str
+  status: str
+  is_hitl: Optional[bool] = False
+  document_class: Optional[str] = None
+  document_type: Optional[str] = None
+  entities: Optional[List[Dict]] = None
+  extraction_score: Optional[float] = None
+  extraction_status: Optional[str] = None
+  validation_score: Optional[float] = None
+  matching_score: Optional[float] = None
+  autoapproved_status: Optional[str] = None
+  is_autoapproved: Optional[str] = None
+  event_id: Optional[str] = None
+
+
+class StatusBatch(BaseModel):
+  """ Argument class for update_status_batch API
+  """
+  updates: List[StatusUpdate]
@@ -16,21 +16,54 @@ limitations under the License.
 
 """ Document status endpoints """
 from common.config import BUCKET_NAME
-from common.models import Document
+from common.models import Document, CounterShard, StatusEvent, \
+  STATUS_KIND_SYSTEM
 from common.utils.logging_handler import Logger
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
+from common.config import INFLIGHT_DOCUMENTS_COUNTER, FIRESTORE_BATCH_LIMIT
+from models.status_update import StatusBatch
+from utils.timeout_sweeper import get_timeout_sweeper
 
 import fireo
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional, List, Dict
 import datetime
 import traceback
+import uuid
 
 # disabling for linting to pass
 # pylint: disable = broad-except
 
 router = APIRouter()
 
+# Document fields set by each stage on success, from the fields of the
+# status update
+STAGE_FIELDS = {
+    "classification": {
+        "document_class": "document_class",
+        "document_type": "document_type",
+        "is_hitl_classified": "is_hitl"
+    },
+    "extraction": {
+        "entities": "entities",
+        "extraction_score": "extraction_score",
+        "extraction_status": "extraction_status"
+    },
+    "validation": {
+        "validation_score": "validation_score",
+        "entities": "entities"
+    },
+    "matching": {
+        "matching_score": "matching_score",
+        "entities": "entities"
+    },
+    "auto_approval": {
+        "auto_approval": "autoapproved_status",
+        "is_autoapproved": "is_autoapproved"
+    }
+}
+
 
 @router.post("/create_document")
 async def create_document(case_id: str, filename: str, context: str, user=None):
@@ -50,16 +83,22 @@ async def create_document(case_id: str, filename: str, context: str, user=None):
     document.case_id = case_id
     document.upload_timestamp = datetime.datetime.utcnow()
     document.context = context
-    document.uid = document.save().id
+    # The uid is the document id, set here so the record is written once
+    document.id = uuid.uuid4().hex
+    document.uid = document.id
     document.active = "active"
-    document.system_status = [{
-        "is_hitl": True if user else False,
-        "user": "User" if user else None,
-        "stage": "upload",
-        "status": STATUS_SUCCESS,
-        "timestamp": datetime.datetime.utcnow()
-    }]
-    document.save()
+    batch = fireo.batch()
+    document.add_status(
+        STATUS_KIND_SYSTEM, {
+            "is_hitl": True if user else False,
+            "user": "User" if user else None,
+            "stage": "upload",
+            "status": STATUS_SUCCESS,
+            "timestamp": datetime.datetime.utcnow()
+        },
+        batch=batch)
+    document.save(batch=batch)
+    batch.commit()
     return {"status": STATUS_SUCCESS, "status_code": 200, "uid": document.uid}
 
   except Exception as e:
@@ -81,6 +120,7 @@ async def update_classification_status(
     is_hitl: Optional[bool] = False,
     document_class: Optional[str] = None,
     document_type: Optional[str] = None,
+    event_id: Optional[str] = None,
 ):
   """takes case_id , uid , document_class ,document_type ,status of
         classification service as input
@@ -102,42 +142,30 @@ async def update_classification_status(
        500 :Internal Server Error if something fails
        """
   try:
-    document = Document.find_by_uid(uid)
     if status == STATUS_SUCCESS:
       #update  the document type and document class
-      document.document_class = document_class
-      document.document_type = document_type
-      document.is_hitl_classified = is_hitl
       system_status = {
           "is_hitl": is_hitl,
           "stage": "classification",
           "status": STATUS_SUCCESS,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.update()
-      #Check if document with same case_id , document type and
-      #document class already exists
-      #in db if yes mark the old documents as inactive
-      documents = Document.collection.filter(case_id=case_id).filter(
-          document_type=document_type).filter(
-              document_class=document_class).fetch()
-      documents_list = list(documents)
-      for i in documents_list:
-        if i.uid == uid:
-          i.active = "active"
-          i.update()
-        else:
-          i.active = "inactive"
-          i.update()
+      #Mark the documents with same case_id , document type and
+      #document class inactive in the same transaction
+      update_classification(
+          fireo.transaction(), case_id, uid, system_status, {
+              "document_class": document_class,
+              "document_type": document_type,
+              "is_hitl_classified": is_hitl
+          }, event_id)
     else:
       system_status = {
           "stage": "classification",
           "status": status,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.update()
+      update_with_status(
+          fireo.transaction(), uid, system_status, event_id=event_id)
     return {
         "status": STATUS_SUCCESS,
         "status_code": 200,
@@ -162,7 +190,8 @@ async def update_extraction_status(case_id: str,
                                    status: str,
                                    entity: Optional[List[Dict]] = None,
                                    extraction_score: Optional[float] = None,
-                                   extraction_status: Optional[str] = None):
+                                   extraction_status: Optional[str] = None,
+                                   event_id: Optional[str] = None):
   """takes case_id , uid , extraction_score ,document_type ,status
     of classification service as input
     updates the document class ,document_type ,status in database
@@ -177,26 +206,26 @@ async def update_extraction_status(case_id: str,
            200 : Database updated successfully
            """
   try:
-    document = Document.find_by_uid(uid)
     if status == STATUS_SUCCESS:
       system_status = {
           "stage": "extraction",
           "status": STATUS_SUCCESS,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.entities = entity
-      document.extraction_score = extraction_score
-      document.extraction_status = extraction_status
-      document.update()
+      update_with_status(
+          fireo.transaction(), uid, system_status, {
+              "entities": entity,
+              "extraction_score": extraction_score,
+              "extraction_status": extraction_status
+          }, event_id)
     else:
       system_status = {
           "stage": "extraction",
           "status": STATUS_ERROR,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.update()
+      update_with_status(
+          fireo.transaction(), uid, system_status, event_id=event_id)
     return {
         "status": STATUS_SUCCESS,
         "status_code": 200,
@@ -220,7 +249,8 @@ async def update_validation_status(case_id: str,
                                    uid: str,
                                    status: str,
                                    entities: Optional[List[Dict]] = None,
-                                   validation_score: Optional[float] = None):
+                                   validation_score: Optional[float] = None,
+                                   event_id: Optional[str] = None):
   """takes case_id , uid , validation status of validation
   service as input and updates in database
 
@@ -234,25 +264,24 @@ async def update_validation_status(case_id: str,
            505 : If something fails
           """
   try:
-    document = Document.find_by_uid(uid)
     if status == STATUS_SUCCESS:
-      document.validation_score = validation_score
-      document.entities = entities
       system_status = {
           "stage": "validation",
           "status": STATUS_SUCCESS,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.update()
+      update_with_status(fireo.transaction(), uid, system_status, {
+          "validation_score": validation_score,
+          "entities": entities
+      }, event_id)
     else:
       system_status = {
           "stage": "validation",
           "status": STATUS_ERROR,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.update()
+      update_with_status(
+          fireo.transaction(), uid, system_status, event_id=event_id)
 
     return {
         "status": STATUS_SUCCESS,
@@ -277,7 +306,8 @@ async def update_matching_status(case_id: str,
                                  uid: str,
                                  status: str,
                                  entity: Optional[List[dict]] = None,
-                                 matching_score: Optional[float] = None):
+                                 matching_score: Optional[float] = None,
+                                 event_id: Optional[str] = None):
   """takes case_id , uid , entity,
   status  of matching service as input and updates in database
 
@@ -292,26 +322,24 @@ async def update_matching_status(case_id: str,
                505 : If something fails
            """
   try:
-    document = Document.find_by_uid(uid)
     if status == STATUS_SUCCESS:
       system_status = {
           "stage": "matching",
           "status": STATUS_SUCCESS,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.update()
-      document.matching_score = matching_score
-      document.entities = entity
-      document.save()
+      update_with_status(fireo.transaction(), uid, system_status, {
+          "matching_score": matching_score,
+          "entities": entity
+      }, event_id)
     else:
       system_status = {
           "stage": "matching",
           "status": STATUS_ERROR,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.update()
+      update_with_status(
+          fireo.transaction(), uid, system_status, event_id=event_id)
 
     return {
         "status": STATUS_SUCCESS,
@@ -331,28 +359,32 @@ async def update_matching_status(case_id: str,
 
 
 @router.post("/update_autoapproved_status")
-async def update_autoapproved(case_id: str, uid: str, status: str,
-                              autoapproved_status: str, is_autoapproved: str):
+async def update_autoapproved(case_id: str,
+                              uid: str,
+                              status: str,
+                              autoapproved_status: str,
+                              is_autoapproved: str,
+                              event_id: Optional[str] = None):
   try:
-    document = Document.find_by_uid(uid)
     if status == STATUS_SUCCESS:
-      document.auto_approval = autoapproved_status
       system_status = {
           "stage": "auto_approval",
           "status": STATUS_SUCCESS,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.is_autoapproved = is_autoapproved
-      document.update()
+      update_with_status(
+          fireo.transaction(), uid, system_status, {
+              "auto_approval": autoapproved_status,
+              "is_autoapproved": is_autoapproved
+          }, event_id)
     else:
       system_status = {
           "stage": "auto_approval",
           "status": STATUS_ERROR,
           "timestamp": datetime.datetime.utcnow()
       }
-      document.system_status = fireo.ListUnion([system_status])
-      document.update()
+      update_with_status(
+          fireo.transaction(), uid, system_status, event_id=event_id)
     return {"status": STATUS_SUCCESS, "case_id": case_id, "uid": uid}
   except Exception as e:
     err = traceback.format_exc().replace("\n", " ")
@@ -386,16 +418,19 @@ async def create_documet_json_input(case_id: str, document_class: str,
         "status": STATUS_SUCCESS,
         "timestamp": datetime.datetime.utcnow()
     }
-    document.system_status = fireo.ListUnion([system_status])
     document.active = "active"
     document.document_class = document_class
     document.document_type = document_type
     document.context = context
-    document.uid = document.save().id
+    document.id = uuid.uuid4().hex
+    document.uid = document.id
     gcs_base_url = f"gs://{BUCKET_NAME}"
     document.url = f"{gcs_base_url}/{case_id}/{document.uid}" \
                 f"/input_data_{case_id}_{document.uid}.json"
-    document.save()
+    batch = fireo.batch()
+    document.add_status(STATUS_KIND_SYSTEM, system_status, batch=batch)
+    document.save(batch=batch)
+    batch.commit()
     return {"status": STATUS_SUCCESS, "uid": document.uid}
 
   except Exception as e:
@@ -406,3 +441,282 @@ async def create_documet_json_input(case_id: str, document_class: str,
     raise HTTPException(
         status_code=500, detail="Error in"
         " creating the document") from e
+
+
+@router.post("/update_status_batch")
+async def update_status_batch(payload: StatusBatch):
+  """Applies the status updates of many documents and stages. The updates
+  of a document are merged into one write, plus one status event per
+  update, and the writes are committed in transactions within the
+  FIRESTORE_BATCH_LIMIT, a single round trip for most cases. A successful
+  classification marks the other documents of the case with the same
+  class and type inactive in the transaction of its status.
+
+  Args:
+    payload (StatusBatch): status updates, see StatusUpdate
+  Returns:
+    200 : per update result, with the status Complete or Error and the
+      detail of the error
+    422 : Invalid json provided
+  """
+  updates = [update.dict() for update in payload.updates]
+  results = [{
+      "case_id": update["case_id"],
+      "uid": update["uid"],
+      "stage": update["stage"],
+      "status": STATUS_SUCCESS,
+      "detail": None
+  } for update in updates]
+  by_uid = {}
+  for index, update in enumerate(updates):
+    if update["stage"] not in STAGE_FIELDS:
+      results[index]["status"] = STATUS_ERROR
+      results[index]["detail"] = f"Unknown stage {update['stage']}"
+      continue
+    by_uid.setdefault(update["uid"], []).append(index)
+
+  for chunk in write_chunks(updates, by_uid):
+    try:
+      missing = apply_status_updates(fireo.transaction(), updates, chunk)
+    except Exception as e:
+      Logger.error(f"Error in updating the status of {len(chunk)} "
+                   f"documents: {e}")
+      Logger.error(traceback.format_exc().replace("\n", " "))
+      missing = []
+      for indexes in chunk.values():
+        for index in indexes:
+          results[index]["status"] = STATUS_ERROR
+          results[index]["detail"] = "Error in updating status"
+    for uid in missing:
+      for index in chunk[uid]:
+        results[index]["status"] = STATUS_ERROR
+        results[index]["detail"] = "Document not found"
+  return {"status": STATUS_SUCCESS, "results": results}
+
+
+@router.post("/sweep_timeouts")
+async def sweep_timeouts():
+  """Marks the documents in progress for longer than the process timeout
+  as timed out, the service also sweeps periodically
+
+  Returns:
+    200 : the number of documents timed out
+  """
+  count = await run_in_threadpool(get_timeout_sweeper().sweep)
+  return {"status": STATUS_SUCCESS, "count": count}
+
+
+@router.post("/refresh_status_fields")
+async def refresh_status_fields():
+  """Derives current_status, process_status, the other status fields and
+  the search terms of every document. Meant for the documents written
+  before these fields existed, the scan reads every document.
+
+  Returns:
+    200 : the number of documents updated
+  """
+  count = await run_in_threadpool(get_timeout_sweeper().refresh_all)
+  Logger.info(f"Status fields refreshed for {count} documents")
+  return {"status": STATUS_SUCCESS, "count": count}
+
+
+def is_classified(update: Dict) -> bool:
+  return update["stage"] == "classification" and \
+    update["status"] == STATUS_SUCCESS
+
+
+def write_chunks(updates: List[Dict], by_uid: Dict[str, List[int]]):
+  """Splits the documents into transactions within the write limit. A
+  document takes one write and one per status event, a classification
+  one more for the previous document of its class it marks inactive, half
+  of the limit is left for the legacy status lists moved to the history."""
+  chunk = {}
+  writes = 0
+  for uid, indexes in by_uid.items():
+    document_writes = 1 + len(indexes) + sum(
+        is_classified(updates[index]) for index in indexes)
+    if chunk and writes + document_writes > FIRESTORE_BATCH_LIMIT // 2:
+      yield chunk
+      chunk = {}
+      writes = 0
+    chunk[uid] = indexes
+    writes += document_writes
+  if chunk:
+    yield chunk
+
+
+def stage_status(update: Dict) -> Dict:
+  """System status entry of a status update, as the update_*_status
+  endpoints record it"""
+  succeeded = update["status"] == STATUS_SUCCESS
+  if succeeded or update["stage"] == "classification":
+    status = update["status"]
+  else:
+    status = STATUS_ERROR
+  system_status = {
+      "stage": update["stage"],
+      "status": status,
+      "timestamp": datetime.datetime.utcnow()
+  }
+  if update["stage"] == "classification" and succeeded:
+    system_status["is_hitl"] = update["is_hitl"]
+  return system_status
+
+
+@fireo.transactional
+def apply_status_updates(transaction, updates: List[Dict],
+                         chunk: Dict[str, List[int]]) -> List[str]:
+  """Reads the documents of the chunk and writes their updates in the
+  transaction. A successful classification marks the document active and
+  the other documents of the case with the same class and type inactive,
+  the last classification of the request wins.
+
+  Args:
+    updates: every status update of the request
+    chunk: indexes of the updates of each document uid
+  Returns:
+    the uids of the documents not found
+  """
+  documents = Document.find_by_ids(list(chunk), transaction=transaction)
+  # Updates sent again by a retry of the caller are already recorded
+  recorded = StatusEvent.recorded([
+      (documents[uid].key, updates[index]["event_id"])
+      for uid, indexes in chunk.items() if uid in documents
+      for index in indexes if updates[index].get("event_id")
+  ], transaction=transaction)
+  pending = {}
+  for uid, indexes in chunk.items():
+    indexes = [
+        index for index in indexes
+        if updates[index].get("event_id") not in recorded
+    ]
+    if uid in documents and indexes:
+      pending[uid] = indexes
+  # Firestore transactions do every read before the first write
+  classified = sorted(
+      index for indexes in pending.values() for index in indexes
+      if is_classified(updates[index]))
+  siblings = {
+      index: active_siblings(transaction, updates[index]["case_id"],
+                             updates[index]["uid"],
+                             updates[index]["document_class"],
+                             updates[index]["document_type"])
+      for index in classified
+  }
+  dequeued = 0
+  written = {}
+  for uid, indexes in pending.items():
+    document = written[uid] = documents[uid]
+    if Document.is_queued(document.system_status):
+      dequeued += 1
+    for index in indexes:
+      update = updates[index]
+      if update["status"] == STATUS_SUCCESS:
+        for field, key in STAGE_FIELDS[update["stage"]].items():
+          setattr(document, field, update[key])
+      document.add_status(
+          STATUS_KIND_SYSTEM,
+          stage_status(update),
+          transaction=transaction,
+          event_id=update.get("event_id"))
+  for index in classified:
+    documents[updates[index]["uid"]].active = "active"
+    for sibling in siblings[index]:
+      # A sibling in the chunk is written once, with its own updates
+      sibling = written.setdefault(sibling.uid,
+                                   documents.get(sibling.uid, sibling))
+      sibling.active = "inactive"
+  for document in written.values():
+    document.update(transaction=transaction)
+  if dequeued:
+    CounterShard.increment(
+        INFLIGHT_DOCUMENTS_COUNTER, -dequeued, transaction=transaction)
+  return [uid for uid in chunk if uid not in documents]
+
+
+def active_siblings(transaction, case_id: str, uid: str,
+                    document_class: str, document_type: str) -> List:
+  """Reads in the transaction the other documents of the case with the
+  same class and type that are not inactive yet"""
+  documents = Document.collection.filter(case_id=case_id).filter(
+      document_type=document_type).filter(
+          document_class=document_class).transaction(transaction).fetch()
+  return [
+      document for document in documents
+      if document.uid != uid and document.active != "inactive"
+  ]
+
+
+def mark_inactive(transaction, documents: List):
+  for document in documents:
+    document.active = "inactive"
+    document.update(transaction=transaction)
+
+
+@fireo.transactional
+def update_classification(transaction,
+                          case_id: str,
+                          uid: str,
+                          system_status: Dict,
+                          fields: Dict,
+                          event_id: Optional[str] = None):
+  """Records the classification of the document, marks it active and the
+  other documents of the case with the same class and type inactive, all
+  in one transaction"""
+  # Firestore transactions do every read before the first write
+  siblings = active_siblings(transaction, case_id, uid,
+                             fields["document_class"],
+                             fields["document_type"])
+  if apply_status(transaction, uid, system_status,
+                  dict(fields, active="active"), event_id):
+    mark_inactive(transaction, siblings)
+
+
+@fireo.transactional
+def update_with_status(transaction,
+                       uid: str,
+                       system_status: Dict,
+                       fields: Optional[Dict] = None,
+                       event_id: Optional[str] = None):
+  """Sets the fields and appends the system status of the document in a
+  transaction, see apply_status"""
+  apply_status(transaction, uid, system_status, fields, event_id)
+
+
+def apply_status(transaction,
+                 uid: str,
+                 system_status: Dict,
+                 fields: Optional[Dict] = None,
+                 event_id: Optional[str] = None) -> bool:
+  """Reads the document by key in the transaction, sets the fields and
+  appends the system status in a single write. The first status reported
+  after the upload takes the document out of the in flight counter in the
+  same transaction.
+
+  A status whose event_id is already in the history was sent again by a
+  retry of the caller, nothing is written.
+
+  Returns:
+    False when the status was already recorded
+  Raises:
+    ValueError: when there is no document with the uid
+  """
+  key = fireo.utils.utils.generateKeyFromId(Document, uid)
+  document = Document.collection.get(key, transaction=transaction)
+  if document is None:
+    raise ValueError(f"Document with uid {uid} not found")
+  if event_id and StatusEvent.recorded([(key, event_id)],
+                                       transaction=transaction):
+    return False
+  if Document.is_queued(document.system_status):
+    CounterShard.increment(
+        INFLIGHT_DOCUMENTS_COUNTER, -1, transaction=transaction)
+  for field, value in (fields or {}).items():
+    setattr(document, field, value)
+  document.add_status(
+      STATUS_KIND_SYSTEM,
+      system_status,
+      transaction=transaction,
+      event_id=event_id)
+  document.update(transaction=transaction)
+  return True
@@ -18,12 +18,14 @@ limitations under the License.
   Tests for Document status endpoints
 """
 import os
+import datetime
 # disabling pylint rules that conflict with pytest fixtures
 # pylint: disable=unused-argument,redefined-outer-name,unused-import
 from testing.fastapi_fixtures import client_with_emulator
-from common.models import Document
+from common.models import Document, CounterShard
 from common.testing.firestore_emulator import firestore_emulator, clean_firestore
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
+from common.config import INFLIGHT_DOCUMENTS_COUNTER
 
 # assigning url
 api_url = "http://localhost:8080/document_status_service/v1/"
@@ -149,3 +151,144 @@ def test_create_documet_json_input(client_with_emulator):
       }])
   print(response)
   assert response.status_code == 200
+
+
+def test_first_status_leaves_inflight_counter(client_with_emulator):
+  uid = create_document(client_with_emulator, "test-02")
+  document = Document.find_by_uid(uid)
+  document.system_status = [{
+      "stage": "uploaded",
+      "status": STATUS_SUCCESS,
+      "dispatched": True
+  }]
+  document.update()
+  CounterShard.reset(INFLIGHT_DOCUMENTS_COUNTER, 1)
+  for _ in range(2):
+    response = client_with_emulator.post(
+        f"{api_url}update_classification_status?case_id=test-02&"
+        f"uid={uid}&status={STATUS_ERROR}")
+    assert response.status_code == 200
+  assert CounterShard.total(INFLIGHT_DOCUMENTS_COUNTER) == 0
+
+
+
+def test_update_status_batch(client_with_emulator):
+  uid_1 = create_document(client_with_emulator, "test-03")
+  uid_2 = create_document(client_with_emulator, "test-03")
+  document = Document.find_by_uid(uid_2)
+  document.system_status = [{
+      "stage": "uploaded",
+      "status": STATUS_SUCCESS,
+      "dispatched": True
+  }]
+  document.update()
+  CounterShard.reset(INFLIGHT_DOCUMENTS_COUNTER, 1)
+  updates = [{
+      "case_id": "test-03",
+      "uid": uid_1,
+      "stage": "extraction",
+      "status": STATUS_SUCCESS,
+      "extraction_score": 0.9,
+      "entities": [{"entity": "name", "value": "Max"}]
+  }, {
+      "case_id": "test-03",
+      "uid": uid_1,
+      "stage": "auto_approval",
+      "status": STATUS_SUCCESS,
+      "autoapproved_status": "Approved",
+      "is_autoapproved": "yes"
+  }, {
+      "case_id": "test-03",
+      "uid": uid_2,
+      "stage": "classification",
+      "status": STATUS_ERROR
+  }, {
+      "case_id": "test-03",
+      "uid": "missing",
+      "stage": "matching",
+      "status": STATUS_SUCCESS
+  }]
+  response = client_with_emulator.post(
+      f"{api_url}update_status_batch", json={"updates": updates})
+  assert response.status_code == 200
+  statuses = [result["status"] for result in response.json()["results"]]
+  assert statuses == [STATUS_SUCCESS, STATUS_SUCCESS, STATUS_SUCCESS,
+                      STATUS_ERROR]
+  document = Document.find_by_uid(uid_1)
+  assert document.extraction_score == 0.9
+  assert document.auto_approval == "Approved"
+  assert [status["stage"] for status in document.system_status
+         ] == ["auto_approval"]
+  assert [status["stage"] for status in document.audit_trail()
+         ][-2:] == ["extraction", "auto_approval"]
+  assert CounterShard.total(INFLIGHT_DOCUMENTS_COUNTER) == 0
+
+
+def test_status_update_deduped_by_event_id(client_with_emulator):
+  uid = create_document(client_with_emulator, "test-06")
+  for _ in range(2):
+    response = client_with_emulator.post(
+        f"{api_url}update_matching_status?case_id=test-06&"
+        f"uid={uid}&status={STATUS_SUCCESS}&event_id=event-1")
+    assert response.status_code == 200
+  updates = [{
+      "case_id": "test-06",
+      "uid": uid,
+      "stage": "matching",
+      "status": STATUS_SUCCESS,
+      "event_id": "event-1"
+  }]
+  response = client_with_emulator.post(
+      f"{api_url}update_status_batch", json={"updates": updates})
+  assert response.status_code == 200
+  assert [status["stage"] for status in Document.find_by_uid(uid).audit_trail()
+         ].count("matching") == 1
+
+
+def test_classification_marks_previous_inactive(client_with_emulator):
+  uids = [create_document(client_with_emulator, "test-04") for _ in range(2)]
+  for uid in uids:
+    response = client_with_emulator.post(
+        f"{api_url}update_classification_status?case_id=test-04&"
+        f"uid={uid}&status={STATUS_SUCCESS}&document_class=driver_license&"
+        f"document_type=supporting_documents")
+    assert response.status_code == 200
+  assert Document.find_by_uid(uids[0]).active == "inactive"
+  assert Document.find_by_uid(uids[1]).active == "active"
+
+
+def test_update_status_batch_marks_previous_inactive(client_with_emulator):
+  uids = [create_document(client_with_emulator, "test-07") for _ in range(3)]
+  response = client_with_emulator.post(
+      f"{api_url}update_classification_status?case_id=test-07&"
+      f"uid={uids[0]}&status={STATUS_SUCCESS}&document_class=driver_license&"
+      f"document_type=supporting_documents")
+  assert response.status_code == 200
+  updates = [{
+      "case_id": "test-07",
+      "uid": uid,
+      "stage": "classification",
+      "status": STATUS_SUCCESS,
+      "document_class": "driver_license",
+      "document_type": "supporting_documents",
+      "is_hitl": False
+  } for uid in uids[1:]]
+  response = client_with_emulator.post(
+      f"{api_url}update_status_batch", json={"updates": updates})
+  assert response.status_code == 200
+  assert [Document.find_by_uid(uid).active for uid in uids
+         ] == ["inactive", "inactive", "active"]
+
+
+def test_sweep_timeouts(client_with_emulator):
+  uid = create_document(client_with_emulator, "test-05")
+  document = Document.find_by_uid(uid)
+  assert document.current_status == STATUS_IN_PROGRESS
+  document.last_update_timestamp = datetime.datetime(2022, 1, 1)
+  document.update()
+  response = client_with_emulator.post(f"{api_url}sweep_timeouts")
+  assert response.status_code == 200
+  assert response.json()["count"] == 1
+  document = Document.find_by_uid(uid)
+  assert document.current_status == STATUS_ERROR
+  assert document.process_status == "Upload Timeout"
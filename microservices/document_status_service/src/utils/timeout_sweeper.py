@@ -0,0 +1,155 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Periodic sweep marking the documents left in progress as timed out"""
+
+import datetime
+import threading
+import traceback
+from typing import Optional
+import fireo
+from common.config import PROCESS_TIMEOUT_SECONDS, STATUS_IN_PROGRESS, \
+  FIRESTORE_BATCH_LIMIT
+from common.models import Document
+from common.utils.logging_handler import Logger
+from common.utils.status_fields import timeout_status_fields, utc_naive
+from config import STATUS_SWEEP_INTERVAL_SECONDS, STATUS_SWEEP_BATCH_SIZE
+
+# pylint: disable = broad-except
+
+
+def is_stale(document: Document, deadline: datetime.datetime) -> bool:
+  return document.current_status == STATUS_IN_PROGRESS and \
+    document.last_update_timestamp is not None and \
+    utc_naive(document.last_update_timestamp) < deadline
+
+
+@fireo.transactional
+def time_out(transaction, key: str, deadline: datetime.datetime) -> bool:
+  """Marks the document timed out unless a status was written since it
+  was found stale. Returns True when it was marked."""
+  document = Document.collection.get(key, transaction=transaction)
+  if document is None or not is_stale(document, deadline):
+    return False
+  for field, value in timeout_status_fields(document.system_status).items():
+    setattr(document, field, value)
+  document.update(transaction=transaction)
+  return True
+
+
+class TimeoutSweeper:
+  """Finds the documents whose current_status stayed in progress longer
+  than the process timeout and sets their current_status to Error and
+  their process_status to the timed out stage.
+
+  The HITL lists read the stored status fields, this sweep replaces the
+  timeout they used to work out on every read. A status written later
+  derives the fields again. Every pod sweeps, a document found by two
+  pods is marked once since it is checked again in the transaction.
+  """
+
+  def __init__(self,
+               interval: float = STATUS_SWEEP_INTERVAL_SECONDS,
+               timeout: float = PROCESS_TIMEOUT_SECONDS,
+               batch_size: int = STATUS_SWEEP_BATCH_SIZE):
+    self.interval = interval
+    self.timeout = timeout
+    self.batch_size = batch_size
+    self.stopped = threading.Event()
+    self.thread = None
+
+  def start(self):
+    if self.thread is not None or not self.interval:
+      return
+    self.stopped.clear()
+    self.thread = threading.Thread(
+        target=self._sweep_periodically, name="timeout-sweeper", daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.stopped.set()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def deadline(self) -> datetime.datetime:
+    return datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=self.timeout)
+
+  def sweep(self) -> int:
+    """Marks the stale documents, batch_size at a time until none is
+    left. Returns the number of documents marked."""
+    marked = 0
+    while True:
+      deadline = self.deadline()
+      stale = list(
+          Document.collection.filter(
+              "current_status", "==", STATUS_IN_PROGRESS).filter(
+                  "last_update_timestamp", "<",
+                  deadline).fetch(self.batch_size))
+      for document in stale:
+        if time_out(fireo.transaction(), document.key, deadline):
+          marked += 1
+      if len(stale) < self.batch_size:
+        break
+    if marked:
+      Logger.info(f"Timed out {marked} documents in progress")
+    return marked
+
+  def refresh_all(self) -> int:
+    """Derives the status fields and the search terms of every document
+    and times out the stale ones. Meant for the documents written before
+    these fields existed, the scan reads every document. Returns the
+    number of documents written."""
+    deadline = self.deadline()
+    batch = fireo.batch()
+    write_count = 0
+    total = 0
+    for document in Document.collection.fetch():
+      document.refresh_status_fields()
+      document.refresh_search_terms()
+      if is_stale(document, deadline):
+        for field, value in timeout_status_fields(
+            document.system_status).items():
+          setattr(document, field, value)
+      document.update(batch=batch)
+      write_count += 1
+      if write_count == FIRESTORE_BATCH_LIMIT:
+        batch.commit()
+        total += write_count
+        batch = fireo.batch()
+        write_count = 0
+    if write_count:
+      batch.commit()
+      total += write_count
+    return total
+
+  def _sweep_periodically(self):
+    while not self.stopped.wait(self.interval):
+      try:
+        self.sweep()
+      except Exception:
+        Logger.error(traceback.format_exc().replace("\n", " "))
+
+
+_sweeper: Optional[TimeoutSweeper] = None
+
+
+def get_timeout_sweeper() -> TimeoutSweeper:
+  global _sweeper
+  if _sweeper is None:
+    _sweeper = TimeoutSweeper()
+  return _sweeper
@@ -20,12 +20,12 @@ from fastapi import APIRouter, HTTPException, status, Response
 from fastapi.concurrency import run_in_threadpool
 from common.db_client import bq_client
 from common.utils.logging_handler import Logger
+from common.utils.service_client import get_service_client
 from common.utils.stream_to_bq import stream_document_to_bigquery
 from common.utils.format_data_for_bq import format_data_for_bq
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
 
 from utils.extract_entities import extract_entities
-import requests
 import traceback
 
 # disabling for linting to pass
@@ -128,16 +128,15 @@ def update_extraction_status(case_id: str, uid: str, extraction_status: str,
      like duplicate keys present or not
   """
 
-  base_url = "http://document-status-service/document_status_service/v1/"
-  req_url = f"{base_url}update_extraction_status"
   if extraction_status == STATUS_SUCCESS:
-    response = requests.post(
-        f"{req_url}?case_id={case_id}"
-        f"&uid={uid}&status={extraction_status}"
-        f"&extraction_score={extraction_score}&"
-        f"extraction_status={extraction_type}",
-        json=entity)
+    response = get_service_client().update_extraction_status(
+        case_id,
+        uid,
+        extraction_status,
+        entities=entity,
+        extraction_score=extraction_score,
+        extraction_status=extraction_type)
   else:
-    response = requests.post(f"{req_url}?case_id={case_id}"
-                             f"&uid={uid}&status={extraction_status}")
+    response = get_service_client().update_extraction_status(
+        case_id, uid, extraction_status)
   return response
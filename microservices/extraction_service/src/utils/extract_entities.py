@@ -42,6 +42,7 @@ from common.extraction_config import DOCAI_OUTPUT_BUCKET_NAME, \
     DOCAI_ATTRIBUTES_TO_IGNORE, DOCAI_ENTITY_MAPPING
 from common.config import PARSER_CONFIG
 from common.utils.logging_handler import Logger
+from common.utils.metrics import track_stage
 import warnings
 
 warnings.simplefilter(action="ignore")
@@ -90,7 +91,8 @@ def specialized_parser_extraction(parser_details: dict, gcs_doc_path: str,
   request = {"name": name, "raw_document": document}
   Logger.info("Specialized parser extraction api called")
   # send request to parser
-  result = client.process_document(request=request)
+  with track_stage("docai_call"):
+    result = client.process_document(request=request)
   parser_doc_data = result.document
   # convert to json
   json_string = proto.Message.to_json(parser_doc_data)
@@ -187,9 +189,10 @@ def form_parser_extraction(parser_details: dict, gcs_doc_path: str,
       input_documents=input_config,
       document_output_config=output_config,
   )
-  operation = client.batch_process_documents(request)
-  # Wait for the operation to finish
-  operation.result(timeout=timeout)
+  with track_stage("docai_call"):
+    operation = client.batch_process_documents(request)
+    # Wait for the operation to finish
+    operation.result(timeout=timeout)
 
   # Results are written to GCS. Use a regex to find
   # output files
@@ -311,15 +314,16 @@ def extract_entities(gcs_doc_path: str, doc_type: str, context: str):
       desired_entities_list = specialized_parser_extraction(
           parser_information, gcs_doc_path, doc_type, context)
 
-    # calling standard entity mapping function to standardize the entities
-    final_extracted_entities = standard_entity_mapping(desired_entities_list,
-                                                       parser_name)
-    # calling post processing utility function
-    # input json is the extracted json file after your mapping script
-    input_dict = get_json_format_for_processing(final_extracted_entities)
-    input_dict, output_dict = data_transformation(input_dict)
-    final_extracted_entities = correct_json_format_for_db(
-        output_dict, final_extracted_entities)
+    with track_stage("post_processing"):
+      # calling standard entity mapping function to standardize the entities
+      final_extracted_entities = standard_entity_mapping(
+          desired_entities_list, parser_name)
+      # calling post processing utility function
+      # input json is the extracted json file after your mapping script
+      input_dict = get_json_format_for_processing(final_extracted_entities)
+      input_dict, output_dict = data_transformation(input_dict)
+      final_extracted_entities = correct_json_format_for_db(
+          output_dict, final_extracted_entities)
     # with open("{}.json".format(os.path.join(mapped_extracted_entities,
     #         gcs_doc_path.split('/')[-1][:-4])),
     #           "w") as outfile:
@@ -40,3 +40,41 @@ API_BASE_URL = os.getenv("API_BASE_URL")
 SERVICE_NAME = os.getenv("SERVICE_NAME")
 
 REDIS_HOST = os.getenv("REDIS_HOST")
+
+# Changes waiting to be sent to a status stream client, a client falling
+# further behind is disconnected and reloads on reconnect
+STATUS_STREAM_QUEUE_SIZE = int(os.getenv("STATUS_STREAM_QUEUE_SIZE", "1000"))
+# Comment sent on an idle status stream so proxies keep it open
+STATUS_STREAM_KEEPALIVE_SECONDS = float(
+    os.getenv("STATUS_STREAM_KEEPALIVE_SECONDS", "15"))
+
+# Documents returned by a page of the list endpoints when the client does
+# not ask for a page size, and the largest page a client may ask for
+HITL_PAGE_SIZE = int(os.getenv("HITL_PAGE_SIZE", "100"))
+HITL_MAX_PAGE_SIZE = int(os.getenv("HITL_MAX_PAGE_SIZE", "500"))
+# Pages filtered after the read stop after this many page sizes of
+# documents read, the client follows the cursor for the rest
+HITL_PAGE_SCAN_FACTOR = int(os.getenv("HITL_PAGE_SCAN_FACTOR", "10"))
+
+# Fields of an export when the client does not pick them
+EXPORT_FIELDS = [
+    "uid", "case_id", "document_class", "document_type", "context",
+    "upload_timestamp", "current_status", "process_status", "applicant_name",
+    "status_last_updated_by", "last_update_timestamp", "extraction_score",
+    "validation_score", "matching_score", "auto_approval"
+]
+# Documents read from Firestore at a time by an export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+# Bytes of a file read from GCS at a time by /fetch_file
+FETCH_FILE_CHUNK_SIZE = int(os.getenv("FETCH_FILE_CHUNK_SIZE",
+                                      str(1024 * 1024)))
+# Browsers may reuse a fetched file for this long without asking again
+FETCH_FILE_MAX_AGE_SECONDS = int(os.getenv("FETCH_FILE_MAX_AGE_SECONDS",
+                                           "300"))
+# /fetch_file redirects to a signed URL of the object instead of sending
+# the bytes, unless the client asks otherwise
+FETCH_FILE_REDIRECT = os.getenv("FETCH_FILE_REDIRECT",
+                                "false").lower() == "true"
+FETCH_FILE_SIGNED_URL_SECONDS = int(
+    os.getenv("FETCH_FILE_SIGNED_URL_SECONDS", "900"))
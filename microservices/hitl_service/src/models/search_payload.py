@@ -28,3 +28,5 @@ class SearchPayload(BaseModel):
   filter_value: Optional[object] = None
   limit_start: Optional[int] = None
   limit_end: Optional[int] = None
+  page_size: Optional[int] = None
+  cursor: Optional[str] = None
@@ -15,21 +15,34 @@ limitations under the License.
 """
 
 """ hitl endpoints """
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, HTTPException, Response, Request, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, RedirectResponse
 from typing import Optional
-from common.models import Document
+from common.models import Document, STATUS_KIND_HITL
 from common.utils.logging_handler import Logger
-from common.config import BUCKET_NAME,DB_KEYS,ENTITY_KEYS,\
+from common.utils.service_client import get_service_client
+from common.config import DB_KEYS,ENTITY_KEYS,\
   APPLICATION_FORMS,SUPPORTING_DOCS
 from common.config import STATUS_APPROVED, STATUS_REVIEW, STATUS_REJECTED, STATUS_PENDING
-from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR, STATUS_TIMEOUT
-from common.config import PROCESS_TIMEOUT_SECONDS
-from google.cloud import storage
+from common.config import STATUS_SUCCESS, STATUS_ERROR
+from common.config import PRIORITY_INTERACTIVE
+from common.utils.status_fields import list_documents
+import asyncio
 import datetime
-import requests
 import fireo
+import json
 import traceback
 from models.search_payload import SearchPayload
+from utils.status_stream import get_document_stream, active_documents_query
+from utils.pagination import fetch_page, search_page, decode_cursor, \
+  decode_search_cursor, page_size_or_default
+from utils.export import EXPORT_FORMATS, export_fields, export_documents, \
+  ndjson_lines, csv_lines
+from utils.file_stream import get_blob, is_shared, etag, parse_range, \
+  iter_range, signed_url
+from config import STATUS_STREAM_KEEPALIVE_SECONDS, FETCH_FILE_REDIRECT, \
+  FETCH_FILE_MAX_AGE_SECONDS, HITL_MAX_PAGE_SIZE
 # disabling for linting to pass
 # pylint: disable = broad-except
 
@@ -37,135 +50,58 @@ router = APIRouter()
 SUCCESS_RESPONSE = {"status": STATUS_SUCCESS}
 FAILED_RESPONSE = {"status": STATUS_ERROR}
 
-PROCESS_NEXT_STAGE = {
-    "uploaded": "classifying",
-    "classification": "extracting",
-    "extraction": "validating",
-    "validation": "matching",
-    "matching": "Auto-approval checking",
-}
-
-
-def get_doc_list_data(docs_list: list):
-  for doc in docs_list:
-    name = "N/A"
-    if doc["entities"]:
-      for entity in doc["entities"]:
-        if entity["entity"] == "name":
-          if entity["corrected_value"]:
-            name = entity["corrected_value"]
-          elif entity["value"]:
-            name = entity["value"]
-    doc["applicant_name"] = name
-
-    process_stage = "-"
-    current_status = "-"
-    status_last_updated_by = "-"
-    last_status = None
-    last_update_timestamp = None
-    last_system_status = ""
-
-    all_status_list = (doc.get("hitl_status", []) or []) + (
-        doc.get("system_status", []) or [])
-    audit_trail = sorted(all_status_list, key=lambda d: d["timestamp"])
-    if audit_trail and len(audit_trail) > 0:
-      last_status = audit_trail[-1]
-      last_update_timestamp = last_status["timestamp"]
-      status_last_updated_by = last_status.get("last_status", "System")
-
-    system_status = doc.get("system_status", None)
-    if system_status:
-      last_system_status = system_status[-1]
-      process_stage = (last_system_status["stage"]).lower()
-
-    hitl_status = doc.get("hitl_status", None)
-    last_hitl_status = hitl_status[-1] if hitl_status else None
-
-    if doc["system_status"]:
-      system_status = doc["system_status"]
-      last_system_status = system_status[-1]
-      status_last_updated_by = "System"
-
-      # If there's HITL status, use the latest HITL status.
-      if doc["hitl_status"]:
-        last_hitl_status = doc["hitl_status"][-1]
-
-        if last_system_status["timestamp"] > last_hitl_status["timestamp"]:
-          if last_system_status["stage"] == "auto_approval":
-            if last_system_status["status"] == STATUS_SUCCESS:
-              current_status = doc["auto_approval"].title()
-            else:
-              current_status = STATUS_IN_PROGRESS
-          elif last_system_status["status"] == STATUS_SUCCESS:
-            current_status = STATUS_IN_PROGRESS
-          else:
-            current_status = STATUS_ERROR
-        else:
-          if last_hitl_status["status"] == "reassigned":
-            current_status = STATUS_IN_PROGRESS
-          else:
-            current_status = last_hitl_status["status"].title()
-            status_last_updated_by = last_hitl_status["user"]
-            last_update_timestamp = last_hitl_status["timestamp"]
-
-      # Otherwise, check the last system status.
-      else:
-        if last_system_status["stage"] == "auto_approval":
-          if last_system_status["status"] == STATUS_SUCCESS:
-            current_status = doc["auto_approval"].title()
-          else:
-            current_status = STATUS_REVIEW
-
-        elif last_system_status["status"] == STATUS_SUCCESS:
-          current_status = STATUS_IN_PROGRESS
-        else:
-          current_status = STATUS_ERROR
-
-    # Show next stage process status.
-    if current_status == STATUS_IN_PROGRESS and process_stage in PROCESS_NEXT_STAGE:
-      process_stage = PROCESS_NEXT_STAGE[process_stage.lower()] + "..."
 
-    # Update process detail status
-    if current_status == STATUS_IN_PROGRESS:
-      time_difference = datetime.datetime.now() - last_update_timestamp.replace(
-          tzinfo=None)
-      if time_difference.seconds > PROCESS_TIMEOUT_SECONDS:
-        process_stage = last_system_status["stage"] + " " + STATUS_TIMEOUT
-        current_status = STATUS_ERROR
+def page_params(page_size: Optional[int],
+                cursor: Optional[str],
+                decode=decode_cursor) -> int:
+  """Validates the pagination parameters of a list endpoint and returns
+  the page size, HITL_PAGE_SIZE when not given
 
-    else:
-      process_stage = process_stage + " " + last_system_status["status"]
+  Raises:
+    HTTPException: 400 when the page size or the cursor is invalid
+  """
+  try:
+    if cursor:
+      decode(cursor)
+    return page_size_or_default(page_size)
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+def page_response(docs_list: list, next_cursor: Optional[str]):
+  response = {"status": STATUS_SUCCESS}
+  response["len"] = len(docs_list)
+  response["data"] = docs_list
+  response["next_cursor"] = next_cursor
+  return response
 
-    doc["process_status"] = process_stage.title()
-    doc["current_status"] = current_status
-    doc["status_last_updated_by"] = status_last_updated_by
-    doc["last_update_timestamp"] = last_update_timestamp
-    doc["audit_trail"] = audit_trail
 
-  return docs_list
+# The handlers reading Firestore or GCS are plain functions run in the
+# threadpool by FastAPI, a blocking call on the event loop would stall
+# every open /status_stream connection.
 
 
 @router.get("/report_data")
-async def report_data():
+def report_data(page_size: Optional[int] = None,
+                cursor: Optional[str] = None):
   """ reports all data to user
-            the database
+            the database, a page at a time, newest upload first
+          Args:
+              page_size : documents of the page, HITL_PAGE_SIZE by default
+              cursor : next_cursor of the previous page
           Returns:
-              200 : fetches all the data from database
+              200 : fetches a page of the data from database and the
+                next_cursor, None on the last page
+              400 : If the page size or the cursor is invalid
               500 : If any error occurs
     """
-  docs_list = []
+  page_size = page_params(page_size, cursor)
   try:
     #Fetching only active documents
-    docs_list = list(
-        map(lambda x: x.to_dict(),
-            Document.collection.filter(active="active").fetch()))
-    docs_list = sorted(
-        docs_list, key=lambda i: i["upload_timestamp"], reverse=True)
-    docs_list = get_doc_list_data(docs_list)
-    response = {"status": STATUS_SUCCESS}
-    response["len"] = len(docs_list)
-    response["data"] = docs_list
-    return response
+    docs_list, next_cursor = fetch_page(active_documents_query(), page_size,
+                                        cursor)
+    docs_list = list_documents(docs_list)
+    return page_response(docs_list, next_cursor)
 
   except Exception as e:
     print(e)
@@ -176,8 +112,91 @@ async def report_data():
         status_code=500, detail="Error in fetching documents") from e
 
 
+@router.get("/export")
+async def export(export_format: str = Query("ndjson", alias="format"),
+                 fields: Optional[str] = None,
+                 cursor: Optional[str] = None):
+  """ Streams the active documents, newest upload first, as NDJSON or CSV
+  rows read batch by batch from Firestore
+          Args:
+              format : ndjson or csv
+              fields : comma separated fields of the rows, a field of the
+                document or entity.<name> for the value of an entity
+              cursor : export_cursor of the last row received, to resume an
+                interrupted export. A resumed CSV export has no header.
+          Returns:
+              200 : the rows, each with its export_cursor
+              400 : If the format, a field or the cursor is invalid
+    """
+  if export_format not in EXPORT_FORMATS:
+    raise HTTPException(status_code=400, detail="Invalid Parameter")
+  try:
+    names = export_fields(fields)
+    if cursor:
+      decode_cursor(cursor)
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e)) from e
+
+  def rows():
+    try:
+      yield from export_documents(active_documents_query(), names, cursor)
+    except Exception:
+      # The status is sent, the client resumes from the last cursor
+      Logger.error(traceback.format_exc().replace("\n", " "))
+
+  if export_format == "csv":
+    return StreamingResponse(
+        csv_lines(rows(), names, header=not cursor),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=export.csv"})
+  return StreamingResponse(
+      ndjson_lines(rows()), media_type="application/x-ndjson")
+
+
+@router.get("/status_stream")
+async def status_stream(request: Request):
+  """ Server-sent events of the active documents that change, so the
+  dashboards refresh without polling /report_data or /get_queue
+          Events:
+              changed : data is the document with current_status,
+                process_status and the other fields of /report_data
+              removed : data has the uid of a document no longer active
+              reload : the client fell behind and should reload the lists
+    """
+  stream = get_document_stream()
+  queue = stream.subscribe()
+
+  async def events():
+    try:
+      yield "retry: 3000\n\n"
+      while True:
+        try:
+          event = await asyncio.wait_for(queue.get(),
+                                         STATUS_STREAM_KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+          if await request.is_disconnected():
+            return
+          yield ": keep-alive\n\n"
+          continue
+        if event is None:
+          yield "event: reload\ndata: {}\n\n"
+          return
+        data = json.dumps(event["data"])
+        yield f"event: {event['type']}\ndata: {data}\n\n"
+    finally:
+      stream.unsubscribe(queue)
+
+  return StreamingResponse(
+      events(),
+      media_type="text/event-stream",
+      headers={
+          "Cache-Control": "no-cache",
+          "X-Accel-Buffering": "no"
+      })
+
+
 @router.post("/get_document")
-async def get_document(uid: str):
+def get_document(uid: str):
   """ Returns a single document to user using uid from the database
         Args : uid - Unique ID for every document
         Returns:
@@ -191,7 +210,9 @@ async def get_document(uid: str):
       response["detail"] = "No Document found with the given uid"
       return response
     response = {"status": STATUS_SUCCESS}
-    docs = get_doc_list_data([doc.to_dict()])
+    docs = list_documents([doc.to_dict()])
+    # The lists only keep the latest statuses, the trail is in the history
+    docs[0]["audit_trail"] = doc.audit_trail()
     response["data"] = docs[0]
     return response
 
@@ -204,22 +225,46 @@ async def get_document(uid: str):
         status_code=500, detail="Error in fetching documents") from e
 
 
+@router.get("/get_audit_trail")
+def get_audit_trail(uid: str):
+  """ Returns the system and HITL status history of a document
+        Args : uid - Unique ID for every document
+        Returns:
+          200 : statuses of the document, oldest first, with their kind
+          500 : If any error occurs
+    """
+  try:
+    doc = Document.find_by_uid(uid)
+    if not doc:
+      response = {"status": STATUS_ERROR}
+      response["detail"] = "No Document found with the given uid"
+      return response
+    return {"status": STATUS_SUCCESS, "data": doc.audit_trail()}
+
+  except Exception as e:
+    Logger.error(e)
+    err = traceback.format_exc().replace("\n", " ")
+    Logger.error(err)
+    raise HTTPException(
+        status_code=500, detail="Error in fetching audit trail") from e
+
+
 @router.post("/get_queue")
-async def get_queue(hitl_status: str):
+def get_queue(hitl_status: str,
+              page_size: Optional[int] = None,
+              cursor: Optional[str] = None):
   """
   Fetches a queue of all documents with the same hitl status
-  (approved,rejected,review or pending) from firestore
+  (approved,rejected,review or pending) from firestore, a page at a time
   Args: hitl_queue - status of the required queue
+    page_size - documents of the page, HITL_PAGE_SIZE by default
+    cursor - next_cursor of the previous page
   Returns:
-    200 : Fetches a list of documents with the same status from Firestore
-    400 : If hitl_status is invalid
+    200 : Fetches a page of documents with the same status from Firestore
+      and the next_cursor, None on the last page
+    400 : If hitl_status, the page size or the cursor is invalid
     500 : If there is any error during fetching from firestore
   """
-
-  #Filter function to filter based on current document status
-  def filter_status(item):
-    return item["current_status"] == hitl_status
-
   if hitl_status.lower() not in [
       STATUS_APPROVED.lower(),
       STATUS_REJECTED.lower(),
@@ -227,22 +272,15 @@ async def get_queue(hitl_status: str):
       STATUS_REVIEW.lower()
   ]:
     raise HTTPException(status_code=400, detail="Invalid Parameter")
+  page_size = page_params(page_size, cursor)
   try:
-    #Fetching documents and converting to list of dictionaries
-    docs = list(
-        map(lambda x: x.to_dict(),
-            Document.collection.filter(active="active").fetch()))
-
-    #Adding keys like process_status, current_status filtering on current_status
-    #And sorting by upload_timestamp in descending order
-    result_queue = get_doc_list_data(docs)
-    result_queue = filter(filter_status, result_queue)
-    result_queue = sorted(
-        result_queue, key=lambda i: i["upload_timestamp"], reverse=True)
-    response = {"status": STATUS_SUCCESS}
-    response["len"] = len(result_queue)
-    response["data"] = result_queue
-    return response
+    #Fetching a page of documents with the current_status, newest upload
+    #first, and adding keys like audit_trail
+    query = active_documents_query().where("current_status", "==",
+                                           hitl_status)
+    result_queue, next_cursor = fetch_page(query, page_size, cursor)
+    result_queue = list_documents(result_queue)
+    return page_response(result_queue, next_cursor)
 
   except Exception as e:
     print(e)
@@ -254,7 +292,7 @@ async def get_queue(hitl_status: str):
 
 
 @router.post("/update_entity")
-async def update_entity(uid: str, updated_doc: dict):
+def update_entity(uid: str, updated_doc: dict):
   """
     Updates the entity values
     Args : uid - unique id,
@@ -269,6 +307,8 @@ async def update_entity(uid: str, updated_doc: dict):
       response["detail"] = "No Document found with the given uid"
       return response
     doc.entities = updated_doc["entities"]
+    doc.refresh_status_fields()
+    doc.refresh_search_terms()
     doc.update()
     return {"status": STATUS_SUCCESS}
 
@@ -282,10 +322,10 @@ async def update_entity(uid: str, updated_doc: dict):
 
 
 @router.post("/update_hitl_status")
-async def update_hitl_status(uid: str,
-                             status: str,
-                             user: str,
-                             comment: Optional[str] = ""):
+def update_hitl_status(uid: str,
+                       status: str,
+                       user: str,
+                       comment: Optional[str] = ""):
   """
     Updates the HITL status
     Args : uid - unique id,status - hitl status,
@@ -316,10 +356,12 @@ async def update_hitl_status(uid: str,
       response["detail"] = "No Document found with the given uid"
       return response
     if doc:
-      # create a list push the latest status and update doc
-      doc.hitl_status = fireo.ListUnion([hitl_status])
+      # record the latest status in the history and update doc
+      batch = fireo.batch()
+      doc.add_status(STATUS_KIND_HITL, hitl_status, batch=batch)
       doc.is_autoapproved = "no"
-      doc.update()
+      doc.update(batch=batch)
+      batch.commit()
     return {"status": STATUS_SUCCESS}
 
   except Exception as e:
@@ -331,51 +373,82 @@ async def update_hitl_status(uid: str,
         status_code=500, detail="STATUS_ERROR to update hitl status") from e
 
 
-def get_file_from_bucket(case_id: str,
-                         uid: str,
-                         download: Optional[bool] = False):
-  storage_client = storage.Client()
-  #listing out all blobs with case_id and uid
-  blobs = storage_client.list_blobs(
-      BUCKET_NAME, prefix=case_id + "/" + uid + "/", delimiter="/")
-
-  target_blob = None
-  #Selecting the last blob which would be the pdf file
-  for blob in blobs:
-    target_blob = blob
-
-  #If file is not found raise 404
-  if target_blob is None:
-    return None, None
-
-  filename = target_blob.name.split("/")[-1]
-  #Downloading the pdf file into a byte string
-  return_data = target_blob.download_as_bytes()
-
-  #Checking for download flag and setting headers
-  headers = None
+def content_disposition(filename: str, download: Optional[bool]) -> str:
   if download:
-    headers = {"Content-Disposition": "attachment;filename=" + filename}
-  else:
-    headers = {"Content-Disposition": "inline;filename=" + filename}
-  return (return_data, headers)
+    return "attachment;filename=" + filename
+  return "inline;filename=" + filename
 
 
 @router.get("/fetch_file")
-async def fetch_file(case_id: str, uid: str, download: Optional[bool] = False):
+async def fetch_file(request: Request,
+                     case_id: str,
+                     uid: str,
+                     download: Optional[bool] = False,
+                     redirect: Optional[bool] = FETCH_FILE_REDIRECT):
   """
-  Fetches and returns the file from GCS bucket
-  Args : case_id : str, uid : str
+  Fetches and returns the file of the document from GCS bucket, found
+  from the url of the document. The file is streamed in chunks of
+  FETCH_FILE_CHUNK_SIZE, a single byte range of a Range header is
+  honoured so viewers load large PDFs incrementally.
+  Args : case_id : str, uid : str, download : bool, send the file as an
+    attachment, redirect : bool, redirect to a signed URL of the file
+    instead of sending it, FETCH_FILE_REDIRECT by default
   Returns 200: returns the file and displays it
-  Returns 404: Document not found
+  Returns 206: returns the requested range of the file
+  Returns 304: the file has the ETag of If-None-Match
+  Returns 307: redirects to a signed URL of the file
+  Returns 404: Document not found, or without a file of its own
+  Returns 416: the range is not satisfiable
   Returns 500: If something fails
   """
   try:
-    return_data, headers = get_file_from_bucket(case_id, uid, download)
-    if return_data is None and headers is None:
-      raise FileNotFoundError
-    return Response(
-        content=return_data, headers=headers, media_type="application/pdf")
+    doc = await run_in_threadpool(Document.find_by_uid, uid)
+    blob = None
+    # The part object of a bulk import holds the records of other
+    # documents, of other cases too
+    if doc and doc.case_id == case_id and not is_shared(doc.url):
+      blob = await run_in_threadpool(get_blob, doc.url)
+    if blob is None:
+      raise FileNotFoundError(f"No file for case_id {case_id} and uid {uid}")
+
+    disposition = content_disposition(blob.name.split("/")[-1], download)
+    if redirect:
+      url = await run_in_threadpool(signed_url, blob, disposition)
+      return RedirectResponse(
+          url, headers={"Cache-Control": "private, no-store"})
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"private, max-age={FETCH_FILE_MAX_AGE_SECONDS}",
+        "Content-Disposition": disposition,
+        "ETag": etag(blob)
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag(blob) in [
+        tag.strip() for tag in if_none_match.split(",")
+    ]:
+      return Response(status_code=304, headers=headers)
+
+    status_code = 200
+    start, end = 0, blob.size - 1
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range == etag(blob):
+      try:
+        byte_range = parse_range(request.headers.get("range"), blob.size)
+      except ValueError:
+        return Response(
+            status_code=416,
+            headers=dict(headers, **{"Content-Range": f"bytes */{blob.size}"}))
+      if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{blob.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_range(blob, start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=blob.content_type or "application/pdf")
 
   except FileNotFoundError as e:
     print(e)
@@ -397,30 +470,24 @@ async def fetch_file(case_id: str, uid: str, download: Optional[bool] = False):
 
 
 @router.get("/get_unclassified")
-async def get_unclassified():
+def get_unclassified(page_size: Optional[int] = None,
+                     cursor: Optional[str] = None):
   """
-  Fetches a queue of all unclassified documents
+  Fetches a queue of all unclassified documents, a page at a time
+  Args: page_size - documents of the page, HITL_PAGE_SIZE by default
+    cursor - next_cursor of the previous page
   Returns:
-    200 : Fetches a list of documents with the same status from Firestore
+    200 : Fetches a page of unclassified documents from Firestore and the
+      next_cursor, None on the last page
+    400 : If the page size or the cursor is invalid
     500 : If there is any error during fetching from firestore
   """
+  page_size = page_params(page_size, cursor)
   try:
-    docs = list(
-        map(lambda x: x.to_dict(),
-            Document.collection.filter(active="active").fetch()))
-    result_queue = []
-    for doc_dict in docs:
-      system_trail = doc_dict.get("system_status")
-      if system_trail and system_trail[-1]["stage"].lower() == "classification":
-        if system_trail[-1]["status"] != STATUS_SUCCESS:
-          result_queue.append(doc_dict)
-    response = {"status": STATUS_SUCCESS}
-    result_queue = get_doc_list_data(result_queue)
-    result_queue = sorted(
-        result_queue, key=lambda i: i["upload_timestamp"], reverse=True)
-    response["len"] = len(result_queue)
-    response["data"] = result_queue
-    return response
+    query = active_documents_query().where("is_unclassified", "==", True)
+    result_queue, next_cursor = fetch_page(query, page_size, cursor)
+    result_queue = list_documents(result_queue)
+    return page_response(result_queue, next_cursor)
   except Exception as e:
     print(e)
     Logger.error(e)
@@ -443,21 +510,18 @@ def update_classification_status(case_id: str,
      status (str): status success/failure depending on the validation_score
 
     """
-  base_url = "http://document-status-service/document_status_service" \
-  "/v1/update_classification_status"
-
   if status == STATUS_SUCCESS:
-    req_url = f"{base_url}?case_id={case_id}&uid={uid}" \
-    f"&status={status}&is_hitl={True}&document_class={document_class}"\
-      f"&document_type={document_type}"
-    response = requests.post(req_url)
-    return response
+    return get_service_client().update_classification_status(
+        case_id,
+        uid,
+        status,
+        is_hitl=True,
+        document_class=document_class,
+        document_type=document_type)
 
   else:
-    req_url = f"{base_url}?case_id={case_id}&uid={uid}" \
-    f"&status={status}"
-    response = requests.post(req_url)
-    return response
+    return get_service_client().update_classification_status(
+        case_id, uid, status)
 
 
 def call_process_task(case_id: str, uid: str, document_class: str,
@@ -475,17 +539,17 @@ def call_process_task(case_id: str, uid: str, document_class: str,
       "context": context
   }
   payload = {"configs": [data]}
-  base_url = f"http://upload-service/upload_service/v1/process_task"\
-    f"?is_hitl={True}"
-  print("params for process task", base_url, payload)
   Logger.info(f"Params for process task {payload}")
-  response = requests.post(base_url, json=payload)
+  # A caseworker waits for the result, run it before the uploads
+  response = get_service_client().process_task(payload["configs"],
+                                               is_hitl=True,
+                                               priority=PRIORITY_INTERACTIVE)
   return response
 
 
 @router.post("/update_hitl_classification")
-async def update_hitl_classification(case_id: str, uid: str,
-                                     document_class: str):
+def update_hitl_classification(case_id: str, uid: str,
+                               document_class: str):
   """
   Updates the hitl classification status flag and doc type and doc class in DB
   and starts the process task
@@ -598,13 +662,42 @@ def compare_value(entity, term, entity_key):
     return False
 
 
+def matches_term(doc: dict, term) -> bool:
+  """True when one of the DB_KEYS of the document or one of its ENTITY_KEYS
+  entities contains the term, or equals it for a term that is not a
+  string"""
+  for db_key in DB_KEYS:
+    if doc[db_key] is not None:
+      if isinstance(term, str) and isinstance(doc[db_key], str):
+        if term.lower() in doc[db_key].lower():
+          return True
+      elif term == doc[db_key]:
+        return True
+
+  entities = doc.get("entities", None)
+  if entities is None:
+    return False
+  for entity_key in ENTITY_KEYS:
+    if any(compare_value(entity, term, entity_key) for entity in entities):
+      return True
+  return False
+
+
 @router.post("/search")
-async def search(search_term: SearchPayload):
+def search(search_term: SearchPayload):
   """
   Searches for documents that include the search term in the keys
-  present in config
-  Args :search_term : SearchPayload
-  Returns 200: searches and returns the list of documents
+  present in config, a page at a time. The documents with a value or a
+  word equal to the term come first, newest upload first, then the others
+  containing it. Only the documents holding the terms indexed for the
+  search term are read, see Document.refresh_search_terms, except for a
+  term shorter than 3 characters: its matches inside a word are found by
+  a scan, a page may then be short and still have a next_cursor.
+  Args :search_term : SearchPayload, page_size and cursor select the page,
+    limit_start and limit_end a slice of the first HITL_MAX_PAGE_SIZE
+    results
+  Returns 200: searches and returns a page of documents and the
+    next_cursor, None on the last page
   Returns 400: Invalid Parameters
   Returns 422: Filter key is not filterable(Not present in Config)
   Returns 500: If something fails
@@ -616,9 +709,10 @@ async def search(search_term: SearchPayload):
     term = search_term.term
     limit_start = search_term.limit_start
     limit_end = search_term.limit_end
+    page_size = search_term.page_size
+    cursor = search_term.cursor
 
-    docs_list = []
-
+    query = active_documents_query()
     if filter_key is not None and filter_value is not None:
       if not isinstance(filter_key, str):
         raise HTTPException(
@@ -626,28 +720,7 @@ async def search(search_term: SearchPayload):
             detail="Invalid Parameter type.\
               Filter key should be of type string")
       if filter_key in DB_KEYS:
-        docs_list = list(
-            map(
-                lambda x: x.to_dict(),
-                Document.collection.filter(active="active").filter(
-                    filter_key, "==", filter_value).fetch()))
-        docs_list = sorted(
-            docs_list, key=lambda i: i["upload_timestamp"], reverse=True)
-        if term is None:
-          if limit_start is not None and limit_end is not None:
-            if not isinstance(limit_start, int) or not isinstance(
-                limit_end, int):
-              raise HTTPException(
-                  status_code=400,
-                  detail="Invalid Parameter type.\
-                    Limit start and end should be of type int")
-            docs_list = docs_list[limit_start:limit_end]
-          docs_list = get_doc_list_data(docs_list)
-          return {
-              "status": STATUS_SUCCESS,
-              "len": len(docs_list),
-              "data": docs_list
-          }
+        query = query.where(filter_key, "==", filter_value)
       else:
         raise HTTPException(
             status_code=422, detail="Entered key is not filterable")
@@ -655,45 +728,33 @@ async def search(search_term: SearchPayload):
     elif term is None:
       raise HTTPException(status_code=400, detail="Search term not found")
 
+    sliced = limit_start is not None and limit_end is not None
+    if sliced:
+      if not isinstance(limit_start, int) or not isinstance(limit_end, int):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid Parameter type.\
+              Limit start and end should be of type int")
+      if page_size is None and cursor is None:
+        # The slice was taken from every result, it is now taken from the
+        # first page, as large as allowed
+        page_size = min(max(limit_end, 1), HITL_MAX_PAGE_SIZE)
+
+    if term is None:
+      page_size = page_params(page_size, cursor)
+      resultset, next_cursor = fetch_page(query, page_size, cursor)
     else:
-      docs_list = list(
-          map(lambda x: x.to_dict(),
-              Document.collection.filter(active="active").fetch()))
-      docs_list = sorted(
-          docs_list, key=lambda i: i["upload_timestamp"], reverse=True)
-    resultset = []
-
-    for doc in docs_list:
-      for db_key in DB_KEYS:
-        if doc in resultset:
-          break
-        if doc[db_key] is not None:
-          if isinstance(term, str) and isinstance(doc[db_key], str):
-            if term.lower() in doc[db_key].lower():
-              resultset.append(doc)
-              break
-          else:
-            if term == doc[db_key]:
-              resultset.append(doc)
-              break
-
-      entities = doc.get("entities", None)
-      if doc in resultset or entities is None:
-        continue
-      for entity_key in ENTITY_KEYS:
-        temp = [
-            doc for entity in entities
-            if compare_value(entity, term, entity_key)
-        ]
-        if len(temp) > 0:
-          resultset.extend(temp)
-          temp.clear()
-          break
-
-    if limit_start is not None and limit_end is not None:
+      page_size = page_params(page_size, cursor, decode=decode_search_cursor)
+
+      def has_term(doc):
+        return matches_term(doc, term)
+
+      resultset, next_cursor = search_page(
+          query, term, page_size, cursor, keep=has_term)
+    if sliced:
       resultset = resultset[limit_start:limit_end]
-    resultset = get_doc_list_data(resultset)
-    return {"status": STATUS_SUCCESS, "len": len(resultset), "data": resultset}
+    resultset = list_documents(resultset)
+    return page_response(resultset, next_cursor)
 
   except HTTPException as e:
     print(e)
@@ -21,10 +21,12 @@ limitations under the License.
 # pylint: disable=unused-argument,redefined-outer-name,unused-import
 import os
 import json
+import datetime
 from unittest.mock import Mock, patch
 from testing.fastapi_fixtures import client_with_emulator
 from common.testing.firestore_emulator import firestore_emulator, clean_firestore
 from common.models.document import Document
+from common.config import STATUS_APPROVED, STATUS_REVIEW
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
 
 # assigning url
@@ -124,6 +126,29 @@ def test_update_hitl_status_api(client_with_emulator):
     assert response.status_code == 200
 
 
+def test_get_audit_trail_api(client_with_emulator):
+  """Test case to check the get_audit_trail hitl endpoint"""
+
+  d = Document()
+  d.active = "active"
+  d.uid = "u123"
+  d.hitl_status = [{
+      "status": STATUS_REVIEW,
+      "user": "Jon",
+      "timestamp": datetime.datetime(2022, 1, 1)
+  }]
+  d.save()
+  with patch("routes.hitl.Logger"):
+    client_with_emulator.post(
+        f"{api_url}update_hitl_status?uid=u123&status=approved&user=Jon")
+    response = client_with_emulator.get(f"{api_url}get_audit_trail?uid=u123")
+  assert response.status_code == 200
+  trail = response.json()["data"]
+  assert [entry["status"] for entry in trail] == [STATUS_REVIEW, "approved"]
+  assert [entry["kind"] for entry in trail] == ["hitl", "hitl"]
+  assert len(Document.find_by_uid("u123").hitl_status) == 1
+
+
 def test_update_hitl_status_api_invalid_uid(client_with_emulator):
   """Test case to check the update_hitl_status hitl endpoint"""
   d = Document()
@@ -200,23 +225,46 @@ def test_update_entity_api_invalid_uid(client_with_emulator):
     assert json_response["status"] == STATUS_ERROR
 
 
+def save_file_document():
+  d = Document()
+  d.uid = "dummy_uid"
+  d.case_id = "dummy_caseid"
+  d.url = "gs://dummy_bucket/dummy_caseid/dummy_uid/arkansas.pdf"
+  d.active = "active"
+  d.save()
+
+
+def file_blob(data=b"test data"):
+  blob = Mock()
+  blob.name = "dummy_caseid/dummy_uid/arkansas.pdf"
+  blob.size = len(data)
+  blob.generation = 1
+  blob.content_type = "application/pdf"
+  blob.download_as_bytes.side_effect = \
+    lambda start, end, **kwargs: data[start:end + 1]
+  return blob
+
+
 def test_fetch_api(client_with_emulator):
   """Test case to check the fetch_file hitl endpoint"""
-  data = "test data"
-  header = {"Content-Disposition": "inline;filename=" + "arkansas.pdf"}
-  with patch("routes.hitl.get_file_from_bucket", return_value=(data, header)):
+  save_file_document()
+  with patch("routes.hitl.get_blob", return_value=file_blob()):
     with patch("routes.hitl.Logger"):
       response = client_with_emulator.get(
         f"{api_url}fetch_file?case_id=dummy_caseid"\
           f"&uid=dummy_uid")
       assert response.status_code == 200
+      assert response.content == b"test data"
+      assert response.headers["Content-Disposition"] == \
+        "inline;filename=arkansas.pdf"
+      assert response.headers["ETag"] == "\"1\""
+      assert response.headers["Accept-Ranges"] == "bytes"
 
 
 def test_fetch_api_download(client_with_emulator):
   """Test case to check the fetch_file hitl endpoint"""
-  data = "test data"
-  header = {"Content-Disposition": "attachment;filename=" + "arkansas.pdf"}
-  with patch("routes.hitl.get_file_from_bucket", return_value=(data, header)):
+  save_file_document()
+  with patch("routes.hitl.get_blob", return_value=file_blob()):
     with patch("routes.hitl.Logger"):
       response = client_with_emulator.get(
         f"{api_url}fetch_file?"\
@@ -224,21 +272,79 @@ def test_fetch_api_download(client_with_emulator):
             f"&uid=dummy_uid&download=true"
       )
       assert response.status_code == 200
+      assert response.headers["Content-Disposition"] == \
+        "attachment;filename=arkansas.pdf"
+
+
+def test_fetch_api_range(client_with_emulator):
+  """Test case to check the byte ranges of the fetch_file hitl endpoint"""
+  save_file_document()
+  url = f"{api_url}fetch_file?case_id=dummy_caseid&uid=dummy_uid"
+  with patch("routes.hitl.get_blob", return_value=file_blob()):
+    with patch("routes.hitl.Logger"):
+      response = client_with_emulator.get(
+          url, headers={"Range": "bytes=5-"})
+      assert response.status_code == 206
+      assert response.content == b"data"
+      assert response.headers["Content-Range"] == "bytes 5-8/9"
+
+      response = client_with_emulator.get(
+          url, headers={"Range": "bytes=20-"})
+      assert response.status_code == 416
+      assert response.headers["Content-Range"] == "bytes */9"
+
+      response = client_with_emulator.get(
+          url, headers={"If-None-Match": "\"1\""})
+      assert response.status_code == 304
+
+      # The file changed since the range was started, all of it is sent
+      response = client_with_emulator.get(
+          url, headers={"Range": "bytes=5-", "If-Range": "\"0\""})
+      assert response.status_code == 200
+      assert response.content == b"test data"
+
+
+def test_fetch_api_redirect(client_with_emulator):
+  """Test case to check the signed URL redirect of fetch_file"""
+  save_file_document()
+  with patch("routes.hitl.get_blob", return_value=file_blob()):
+    with patch("routes.hitl.signed_url", return_value="https://signed"):
+      with patch("routes.hitl.Logger"):
+        response = client_with_emulator.get(
+            f"{api_url}fetch_file?case_id=dummy_caseid"
+            f"&uid=dummy_uid&redirect=true",
+            allow_redirects=False)
+        assert response.status_code == 307
+        assert response.headers["Location"] == "https://signed"
 
 
 def test_fetch_api_invalid_case_id(client_with_emulator):
   """Test case to check the fetch_file hitl endpoint"""
-
-  with patch("routes.hitl.get_file_from_bucket", return_value=(None, None)):
+  save_file_document()
+  with patch("routes.hitl.get_blob", return_value=file_blob()):
     with patch("routes.hitl.Logger"):
       response = client_with_emulator.get(
           f"{api_url}fetch_file?case_id=invalid_caseid&uid=dummy_uid")
       assert response.status_code == 404
 
 
+def test_fetch_api_bulk_import_record(client_with_emulator):
+  """Test case to check fetch_file refuses the shared bulk import parts"""
+  save_file_document()
+  d = Document.find_by_uid("dummy_uid")
+  d.url = "gs://dummy_bucket/bulk_import/1234/part-00001.ndjson"
+  d.update()
+  with patch("routes.hitl.get_blob", return_value=file_blob()) as get_blob:
+    with patch("routes.hitl.Logger"):
+      response = client_with_emulator.get(
+          f"{api_url}fetch_file?case_id=dummy_caseid&uid=dummy_uid")
+      assert response.status_code == 404
+      get_blob.assert_not_called()
+
+
 def test_fetch_api_invalid_uid(client_with_emulator):
   """Test case to check the fetch_file hitl endpoint"""
-  with patch("routes.hitl.get_file_from_bucket", return_value=(None, None)):
+  with patch("routes.hitl.get_blob", return_value=None):
     with patch("routes.hitl.Logger"):
       response = client_with_emulator.get(
           f"{api_url}fetch_file?case_id=dummy_caseid&uid=invalid_uid")
@@ -340,6 +446,18 @@ def test_search_db_key(client_with_emulator):
   assert response.status_code == 200
 
 
+def test_search_limit_end_over_page_size(client_with_emulator):
+  d = Document()
+  d.case_id = "case_arkansas_1"
+  d.active = "active"
+  d.save()
+
+  search_term = {"term": "case_", "limit_start": 0, "limit_end": 10000}
+  with patch("routes.hitl.Logger"):
+    response = client_with_emulator.post(f"{api_url}search", json=search_term)
+  assert response.status_code == 200
+
+
 def test_search_entity_key(client_with_emulator):
   d = Document()
   d.case_id = "case_arkansas_1"
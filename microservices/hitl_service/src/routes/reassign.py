@@ -17,21 +17,21 @@ limitations under the License.
 """ reassign endpoints """
 from fastapi import APIRouter, Response, status, HTTPException
 from typing import List, Dict
-from common.models import Document
+from common.models import Document, STATUS_KIND_HITL
 from common.db_client import bq_client
 from common.utils.format_data_for_bq import format_data_for_bq
 from common.utils.stream_to_bq import stream_document_to_bigquery
 # from common.utils.copy_gcs_documents import copy_blob
 from common.utils.logging_handler import Logger
+from common.utils.service_client import get_service_client
 from common.config import BUCKET_NAME
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
-from common.config import PROCESS_TASK_API_PATH
+from common.config import PROCESS_TASK_API_PATH, PRIORITY_INTERACTIVE
 from google.cloud import storage
 # disabling for linting to pass
 # pylint: disable = broad-except
 import re
 import datetime
-import requests
 from models.reassign import Reassign
 import fireo
 import traceback
@@ -160,8 +160,10 @@ async def reassign_case_id(reassign: Reassign, response: Response):
         "new_case_id": new_case_id,
         "action": f"reassigned from {old_case_id} to {new_case_id}"
     }
-    document.hitl_status = fireo.ListUnion([hitl_audit_trail])
-    document.update()
+    batch = fireo.batch()
+    document.add_status(STATUS_KIND_HITL, hitl_audit_trail, batch=batch)
+    document.update(batch=batch)
+    batch.commit()
     #Update Bigquery database
     entities_for_bq = format_data_for_bq(entities)
     update_bq = stream_document_to_bigquery(client, new_case_id, uid,
@@ -225,7 +227,10 @@ def call_process_task(case_id: str, uid: str, document_class: str,
       "extraction_entities": entities
   }
   payload = {"configs": [data]}
-  base_url = f"http://upload-service/{PROCESS_TASK_API_PATH}?is_reassign=true"
   Logger.info(f"Params for process task {payload}")
-  response = requests.post(base_url, json=payload)
+  response = get_service_client().process_task(
+      payload["configs"],
+      is_reassign=True,
+      url=f"http://upload-service/{PROCESS_TASK_API_PATH}",
+      priority=PRIORITY_INTERACTIVE)
   return response
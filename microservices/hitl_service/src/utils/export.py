@@ -0,0 +1,149 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Export of the documents as NDJSON or CSV rows, streamed batch by batch
+from an ordered Firestore query"""
+
+import csv
+import datetime
+import io
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+from google.cloud import firestore
+from common.models import Document
+from common.utils.search_terms import entity_value
+from config import EXPORT_FIELDS, EXPORT_BATCH_SIZE
+from utils.pagination import encode_cursor, decode_cursor
+
+EXPORT_FORMATS = ["ndjson", "csv"]
+# Prefix of the fields holding the value of an entity, entity.name
+ENTITY_PREFIX = "entity."
+# Column of every row with the cursor to resume the export after the row
+CURSOR_FIELD = "export_cursor"
+# Internal fields of the documents that are not exported
+HIDDEN_FIELDS = ["search_terms"]
+# Fields of the documents, as to_dict returns them with the key of the
+# document left out
+DOCUMENT_FIELDS = [name for name in Document().to_dict() if name != "key"]
+
+
+def export_fields(fields: Optional[str]) -> List[str]:
+  """Parses the comma separated fields of an export, EXPORT_FIELDS when
+  not given. A field is a field of the document or entity.<name> for the
+  value of an entity, its correction when there is one.
+
+  Raises:
+    ValueError: when a field is unknown
+  """
+  if not fields:
+    return list(EXPORT_FIELDS)
+  names = [name.strip() for name in fields.split(",") if name.strip()]
+  for name in names:
+    if name.startswith(ENTITY_PREFIX) and len(name) > len(ENTITY_PREFIX):
+      continue
+    if name not in DOCUMENT_FIELDS or name in HIDDEN_FIELDS:
+      raise ValueError(f"Unknown field {name}")
+  return names
+
+
+def projection(fields: List[str]) -> List[str]:
+  """Document fields read for the export fields, the order of the query
+  is always read since the cursors are made from it"""
+  selected = {"upload_timestamp"}
+  for name in fields:
+    selected.add("entities" if name.startswith(ENTITY_PREFIX) else name)
+  return sorted(selected)
+
+
+def export_row(data: Dict, fields: List[str]) -> Dict:
+  entities = {}
+  for entity in data.get("entities") or []:
+    entities.setdefault(entity.get("entity"), entity_value(entity))
+  row = {}
+  for name in fields:
+    if name.startswith(ENTITY_PREFIX):
+      row[name] = entities.get(name[len(ENTITY_PREFIX):])
+    else:
+      row[name] = data.get(name)
+  return row
+
+
+def export_documents(query,
+                     fields: List[str],
+                     cursor: Optional[str] = None,
+                     batch_size: int = EXPORT_BATCH_SIZE
+                    ) -> Iterator[Tuple[Dict, str]]:
+  """Yields the rows of the documents of the query with the cursor after
+  each of them, newest upload first as the list pages. Only batch_size
+  documents are held at a time, each batch is a query starting after the
+  last document of the previous one.
+
+  Raises:
+    ValueError: when the cursor is invalid
+  """
+  query = query.select(projection(fields)).order_by(
+      "upload_timestamp", direction=firestore.Query.DESCENDING).order_by(
+          "__name__", direction=firestore.Query.DESCENDING)
+  start = decode_cursor(cursor) if cursor else None
+  while True:
+    batch = query.start_after(start) if start is not None else query
+    count = 0
+    for snapshot in batch.limit(batch_size).stream():
+      count += 1
+      start = snapshot
+      yield export_row(snapshot.to_dict(), fields), encode_cursor(snapshot)
+    if count < batch_size:
+      return
+
+
+def json_value(value):
+  if isinstance(value, datetime.datetime):
+    return value.isoformat()
+  return str(value)
+
+
+def ndjson_lines(rows: Iterator[Tuple[Dict, str]]) -> Iterator[str]:
+  for row, cursor in rows:
+    row[CURSOR_FIELD] = cursor
+    yield json.dumps(row, default=json_value) + "\n"
+
+
+def csv_lines(rows: Iterator[Tuple[Dict, str]],
+              fields: List[str],
+              header: bool = True) -> Iterator[str]:
+  """Lists and maps are written as JSON in their cell"""
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+
+  def line(values):
+    writer.writerow(values)
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return text
+
+  if header:
+    yield line(fields + [CURSOR_FIELD])
+  for row, cursor in rows:
+    values = []
+    for name in fields:
+      value = row[name]
+      if isinstance(value, (list, dict)):
+        value = json.dumps(value, default=json_value)
+      elif isinstance(value, datetime.datetime):
+        value = value.isoformat()
+      values.append("" if value is None else value)
+    yield line(values + [cursor])
@@ -0,0 +1,122 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the streamed export
+"""
+import csv
+import datetime
+import io
+import json
+from unittest import mock
+# disabling pylint rules that conflict with pytest fixtures
+# pylint: disable=redefined-outer-name
+import pytest
+from utils.export import export_fields, export_documents, ndjson_lines, \
+  csv_lines
+
+
+class FakeQuery:
+  """Documents ordered newest first, as the ordered Firestore query"""
+
+  def __init__(self, snapshots, start=None, size=None):
+    self.snapshots = snapshots
+    self.start = start
+    self.size = size
+    self.selected = None
+
+  def select(self, fields):
+    self.selected = fields
+    return self
+
+  def order_by(self, *_args, **_kwargs):
+    return self
+
+  def start_after(self, start):
+    return FakeQuery(self.snapshots, start, self.size)
+
+  def limit(self, size):
+    return FakeQuery(self.snapshots, self.start, size)
+
+  def stream(self):
+    snapshots = self.snapshots
+    if isinstance(self.start, dict):
+      snapshots = [s for s in snapshots if s.id < self.start["__name__"]]
+    elif self.start is not None:
+      snapshots = [s for s in snapshots if s.id < self.start.id]
+    return iter(snapshots[:self.size])
+
+
+def make_snapshot(index):
+  timestamp = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc
+                               ) + datetime.timedelta(minutes=index)
+  data = {
+      "uid": f"doc{index:02d}",
+      "upload_timestamp": timestamp,
+      "entities": [{
+          "entity": "name",
+          "value": f"Name {index}",
+          "corrected_value": None,
+          "value_coordinates": [0.1, 0.2]
+      }]
+  }
+  snapshot = mock.Mock()
+  snapshot.id = data["uid"]
+  snapshot.get.side_effect = data.get
+  snapshot.to_dict.return_value = data
+  return snapshot
+
+
+@pytest.fixture
+def query():
+  return FakeQuery([make_snapshot(index) for index in reversed(range(5))])
+
+
+def test_export_fields():
+  assert "uid" in export_fields(None)
+  assert export_fields("uid, entity.name") == ["uid", "entity.name"]
+  with pytest.raises(ValueError):
+    export_fields("uid,password")
+  with pytest.raises(ValueError):
+    export_fields("search_terms")
+  with pytest.raises(ValueError):
+    export_fields("key")
+
+
+def test_ndjson_export_resumes_from_a_cursor(query):
+  fields = ["uid", "upload_timestamp", "entity.name"]
+  lines = list(ndjson_lines(export_documents(query, fields, batch_size=2)))
+  rows = [json.loads(line) for line in lines]
+  assert [row["uid"] for row in rows
+         ] == [f"doc{i:02d}" for i in (4, 3, 2, 1, 0)]
+  assert rows[0]["entity.name"] == "Name 4"
+  assert rows[0]["upload_timestamp"] == "2022-01-01T00:04:00+00:00"
+  assert query.selected == ["entities", "uid", "upload_timestamp"]
+
+  resumed = ndjson_lines(
+      export_documents(query, fields, rows[1]["export_cursor"], batch_size=2))
+  assert [json.loads(line)["uid"] for line in resumed
+         ] == ["doc02", "doc01", "doc00"]
+
+
+def test_csv_export(query):
+  text = "".join(
+      csv_lines(export_documents(query, ["uid", "entity.name"]),
+                ["uid", "entity.name"]))
+  rows = list(csv.reader(io.StringIO(text)))
+  assert rows[0] == ["uid", "entity.name", "export_cursor"]
+  assert rows[1][:2] == ["doc04", "Name 4"]
+  assert len(rows) == 6
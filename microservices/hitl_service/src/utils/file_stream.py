@@ -0,0 +1,147 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Files of the documents read from GCS in byte ranges, or handed out as
+signed URLs"""
+
+import datetime
+import re
+from typing import Iterator, Optional, Tuple
+import google.auth
+import google.auth.credentials
+import google.auth.transport.requests
+from google.cloud import storage
+from common.config import BULK_IMPORT_PREFIX
+from config import FETCH_FILE_CHUNK_SIZE, FETCH_FILE_SIGNED_URL_SECONDS
+
+GCS_URL = re.compile(r"^gs://([^/]+)/(.+)$")
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+_storage_client = None
+_signing_credentials = None
+
+
+def get_storage_client():
+  """Returns the storage client of the process, created once"""
+  global _storage_client
+  if _storage_client is None:
+    _storage_client = storage.Client()
+  return _storage_client
+
+
+def get_signing_credentials():
+  """Returns the default credentials of the process, loaded once"""
+  global _signing_credentials
+  if _signing_credentials is None:
+    _signing_credentials, _ = google.auth.default(
+        scopes=["https://www.googleapis.com/auth/cloud-platform"])
+  return _signing_credentials
+
+
+def get_blob(url: str) -> Optional[storage.Blob]:
+  """Returns the object of a gs:// URL with its metadata, size,
+  generation and content type, None when there is no such object"""
+  match = GCS_URL.match(url or "")
+  if match is None:
+    return None
+  client = get_storage_client()
+  return client.bucket(match.group(1)).get_blob(match.group(2))
+
+
+def is_shared(url: str) -> bool:
+  """True for the objects holding the records of many documents, the
+  parts of the bulk JSON imports"""
+  match = GCS_URL.match(url or "")
+  return match is not None and \
+    match.group(2).startswith(BULK_IMPORT_PREFIX + "/")
+
+
+def etag(blob: storage.Blob) -> str:
+  """Strong validator of the file, the generation changes whenever the
+  object is written"""
+  return f"\"{blob.generation}\""
+
+
+def parse_range(header: Optional[str],
+                size: int) -> Optional[Tuple[int, int]]:
+  """First and last byte of a single range of a Range header, None when
+  the whole file is sent: no header, a header of another unit or several
+  ranges, which may be answered with the whole file
+
+  Raises:
+    ValueError: when the range is not satisfiable
+  """
+  match = BYTE_RANGE.match((header or "").strip())
+  if match is None:
+    return None
+  first, last = match.groups()
+  if not first and not last:
+    return None
+  if not first:
+    # Suffix range, the last bytes of the file
+    length = int(last)
+    if length == 0:
+      raise ValueError("Range not satisfiable")
+    return max(0, size - length), size - 1
+  start = int(first)
+  end = min(int(last), size - 1) if last else size - 1
+  if start >= size or end < start:
+    raise ValueError("Range not satisfiable")
+  return start, end
+
+
+def iter_range(blob: storage.Blob,
+               start: int,
+               end: int,
+               chunk_size: int = FETCH_FILE_CHUNK_SIZE) -> Iterator[bytes]:
+  """Reads the bytes start to end, both included, chunk_size at a time.
+  Every read asks for the generation of the metadata so a file replaced
+  meanwhile fails the response instead of mixing two versions."""
+  position = start
+  while position <= end:
+    last = min(position + chunk_size, end + 1) - 1
+    # The hash sent by GCS is the one of the whole object, a range cannot
+    # be checked against it
+    yield blob.download_as_bytes(
+        start=position,
+        end=last,
+        if_generation_match=blob.generation,
+        checksum=None)
+    position = last + 1
+
+
+def signed_url(blob: storage.Blob, disposition: str) -> str:
+  """V4 signed URL of the file, valid FETCH_FILE_SIGNED_URL_SECONDS.
+
+  Credentials without a private key, those of Cloud Run and GKE, sign
+  through the IAM signBlob API with their access token."""
+  credentials = get_signing_credentials()
+  if isinstance(credentials, google.auth.credentials.Signing):
+    kwargs = {"credentials": credentials}
+  else:
+    if not credentials.valid:
+      credentials.refresh(google.auth.transport.requests.Request())
+    kwargs = {
+        "service_account_email": credentials.service_account_email,
+        "access_token": credentials.token
+    }
+  return blob.generate_signed_url(
+      version="v4",
+      expiration=datetime.timedelta(seconds=FETCH_FILE_SIGNED_URL_SECONDS),
+      method="GET",
+      response_disposition=disposition,
+      response_type=blob.content_type or "application/pdf",
+      **kwargs)
@@ -0,0 +1,83 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the byte ranges of the files
+"""
+from unittest import mock
+import google.auth.credentials
+import pytest
+from utils.file_stream import parse_range, iter_range, is_shared, signed_url
+
+
+def test_parse_range():
+  assert parse_range(None, 100) is None
+  assert parse_range("bytes=0-9", 100) == (0, 9)
+  assert parse_range("bytes=90-", 100) == (90, 99)
+  assert parse_range("bytes=90-200", 100) == (90, 99)
+  assert parse_range("bytes=-10", 100) == (90, 99)
+  assert parse_range("bytes=-200", 100) == (0, 99)
+  # Several ranges are answered with the whole file
+  assert parse_range("bytes=0-9,20-29", 100) is None
+  assert parse_range("items=0-9", 100) is None
+  for header in ["bytes=100-", "bytes=9-5", "bytes=-0"]:
+    with pytest.raises(ValueError):
+      parse_range(header, 100)
+
+
+def test_bulk_import_parts_are_shared():
+  assert is_shared("gs://bucket/bulk_import/1234/part-00001.ndjson")
+  assert not is_shared("gs://bucket/case/uid/bulk_import.pdf")
+  assert not is_shared(None)
+
+
+def test_iter_range_reads_chunks():
+  data = bytes(range(10))
+  blob = mock.Mock(generation=7)
+  blob.download_as_bytes.side_effect = \
+    lambda start, end, **kwargs: data[start:end + 1]
+  chunks = list(iter_range(blob, 2, 8, chunk_size=3))
+  assert chunks == [data[2:5], data[5:8], data[8:9]]
+  for call in blob.download_as_bytes.call_args_list:
+    assert call[1]["if_generation_match"] == 7
+
+
+def test_signed_url_with_iam_signing():
+  credentials = mock.Mock(
+      spec=["valid", "token", "service_account_email", "refresh"],
+      valid=False,
+      token="token",
+      service_account_email="hitl@project.iam.gserviceaccount.com")
+  blob = mock.Mock(content_type=None)
+  with mock.patch("utils.file_stream.get_signing_credentials",
+                  return_value=credentials):
+    signed_url(blob, "inline;filename=form.pdf")
+  credentials.refresh.assert_called_once()
+  kwargs = blob.generate_signed_url.call_args[1]
+  assert kwargs["service_account_email"] == credentials.service_account_email
+  assert kwargs["access_token"] == "token"
+  assert kwargs["response_type"] == "application/pdf"
+
+
+def test_signed_url_with_private_key():
+  credentials = mock.Mock(spec=google.auth.credentials.Signing)
+  blob = mock.Mock(content_type="application/pdf")
+  with mock.patch("utils.file_stream.get_signing_credentials",
+                  return_value=credentials):
+    signed_url(blob, "attachment;filename=form.pdf")
+  kwargs = blob.generate_signed_url.call_args[1]
+  assert kwargs["credentials"] is credentials
+  assert "access_token" not in kwargs
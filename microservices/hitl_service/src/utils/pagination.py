@@ -0,0 +1,198 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Cursor pagination of the document lists and of the search results,
+newest upload first"""
+
+import base64
+import datetime
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+from fireo.queries.query_wrapper import ModelWrapper
+from google.cloud import firestore
+from common.models import Document
+from common.utils.search_terms import query_terms
+from config import HITL_PAGE_SIZE, HITL_MAX_PAGE_SIZE, HITL_PAGE_SCAN_FACTOR
+
+
+def encode_token(data: Dict) -> str:
+  return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode()
+
+
+def decode_token(cursor: str) -> Dict:
+  data = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+  if not isinstance(data, dict):
+    raise ValueError("Invalid cursor")
+  return data
+
+
+def encode_cursor(snapshot) -> str:
+  """Opaque token of the position after the document"""
+  return encode_token({
+      "t": snapshot.get("upload_timestamp").isoformat(),
+      "id": snapshot.id
+  })
+
+
+def decode_cursor(cursor: str) -> Dict:
+  """Returns the values of the ordered fields at the cursor
+
+  Raises:
+    ValueError: when the cursor was not returned by a page
+  """
+  try:
+    data = decode_token(cursor)
+    return {
+        "upload_timestamp": datetime.datetime.fromisoformat(data["t"]),
+        "__name__": data["id"]
+    }
+  except (ValueError, KeyError, TypeError) as e:
+    raise ValueError("Invalid cursor") from e
+
+
+def decode_search_cursor(cursor: str) -> Tuple[int, Optional[str]]:
+  """Returns the tier of the search and the cursor in the tier
+
+  Raises:
+    ValueError: when the cursor was not returned by a search page
+  """
+  try:
+    data = decode_token(cursor)
+    tier, inner = int(data["tier"]), data["cursor"]
+    if inner is not None:
+      decode_cursor(inner)
+    return tier, inner
+  except (ValueError, KeyError, TypeError) as e:
+    raise ValueError("Invalid cursor") from e
+
+
+def page_size_or_default(page_size: Optional[int]) -> int:
+  """Raises:
+    ValueError: when the page size is out of the allowed range
+  """
+  if page_size is None:
+    return HITL_PAGE_SIZE
+  if not 0 < page_size <= HITL_MAX_PAGE_SIZE:
+    raise ValueError(f"Page size should be between 1 and {HITL_MAX_PAGE_SIZE}")
+  return page_size
+
+
+def fetch_page(query,
+               page_size: int,
+               cursor: Optional[str] = None,
+               keep: Optional[Callable[[Dict], bool]] = None
+              ) -> Tuple[List[Dict], Optional[str]]:
+  """Reads a page of documents of the query, ordered by upload_timestamp
+  then id, newest first.
+
+  The documents are read page_size at a time. With a keep function the
+  documents it rejects are skipped, at most HITL_PAGE_SCAN_FACTOR page
+  sizes of documents are read for a page so a rare match does not read
+  the whole collection: the page may then be short and still have a
+  cursor.
+
+  Args:
+    query: Firestore query of the documents, without order
+    page_size: documents of the page
+    cursor: cursor returned with the previous page
+    keep: filter of the document dicts read
+  Returns:
+    the document dicts of the page and the cursor of the next page, None
+    after the last document
+  Raises:
+    ValueError: when the cursor is invalid
+  """
+  query = query.order_by(
+      "upload_timestamp", direction=firestore.Query.DESCENDING).order_by(
+          "__name__", direction=firestore.Query.DESCENDING)
+  start = decode_cursor(cursor) if cursor else None
+  page = []
+  scanned = 0
+  while True:
+    batch = query.start_after(start) if start is not None else query
+    snapshots = list(batch.limit(page_size).stream())
+    for snapshot in snapshots:
+      start = snapshot
+      scanned += 1
+      doc = ModelWrapper.from_query_result(Document(), snapshot).to_dict()
+      if keep is None or keep(doc):
+        page.append(doc)
+        if len(page) == page_size:
+          return page, encode_cursor(snapshot)
+    if len(snapshots) < page_size:
+      return page, None
+    if scanned >= page_size * HITL_PAGE_SCAN_FACTOR:
+      return page, encode_cursor(start)
+
+
+def search_page(query,
+                term,
+                page_size: int,
+                cursor: Optional[str] = None,
+                keep: Optional[Callable[[Dict], bool]] = None
+               ) -> Tuple[List[Dict], Optional[str]]:
+  """Reads a page of the documents of the query matching the search term,
+  ranked in the tiers of common.utils.search_terms.query_terms: the
+  documents holding the exact term, a value or a word equal to the search
+  term, then the other documents holding the partial terms. Each tier is
+  read newest first with fetch_page. Only the documents holding the first
+  term of the tier are read, except for the tier without terms of a short
+  search term: it scans every document, at most HITL_PAGE_SCAN_FACTOR page
+  sizes for a page.
+
+  Args:
+    query: Firestore query of the documents, without order
+    term: search term
+    page_size: documents of the page
+    cursor: cursor returned with the previous page
+    keep: check of the candidate document dicts against the search term
+  Returns:
+    the document dicts of the page and the cursor of the next page, None
+    after the last tier
+  Raises:
+    ValueError: when the cursor is invalid
+  """
+  # A blank term has no terms to look up, every document is a candidate
+  tiers = query_terms(term) or [[]]
+  tier, inner = decode_search_cursor(cursor) if cursor else (0, None)
+  page = []
+  while tier < len(tiers):
+
+    def keep_in_tier(doc, tier=tier):
+      terms = set(doc.get("search_terms") or [])
+      if not terms.issuperset(tiers[tier]):
+        return False
+      # The candidates of the previous tiers were returned or rejected
+      # by them
+      if any(earlier and terms.issuperset(earlier)
+             for earlier in tiers[:tier]):
+        return False
+      return keep is None or keep(doc)
+
+    tier_query = query
+    if tiers[tier]:
+      tier_query = query.where("search_terms", "array_contains",
+                               tiers[tier][0])
+    docs, inner = fetch_page(
+        tier_query, page_size - len(page), inner, keep=keep_in_tier)
+    page.extend(docs)
+    if inner is None:
+      tier += 1
+    if inner is not None or len(page) == page_size:
+      break
+  if tier >= len(tiers):
+    return page, None
+  return page, encode_token({"tier": tier, "cursor": inner})
@@ -0,0 +1,179 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the cursor pagination
+"""
+import datetime
+from unittest import mock
+# disabling pylint rules that conflict with pytest fixtures
+# pylint: disable=redefined-outer-name
+import pytest
+from utils.pagination import fetch_page, search_page, decode_cursor, \
+  page_size_or_default
+from common.utils.search_terms import search_terms
+
+
+class FakeQuery:
+  """Documents ordered newest first, as the ordered Firestore query"""
+
+  def __init__(self, snapshots, start=None, size=None):
+    self.snapshots = snapshots
+    self.start = start
+    self.size = size
+
+  def order_by(self, *_args, **_kwargs):
+    return self
+
+  def where(self, field, op, value):
+    assert op == "array_contains"
+    return FakeQuery([
+        s for s in self.snapshots if value in s.to_dict().get(field, [])
+    ], self.start, self.size)
+
+  def start_after(self, start):
+    return FakeQuery(self.snapshots, start, self.size)
+
+  def limit(self, size):
+    return FakeQuery(self.snapshots, self.start, size)
+
+  def stream(self):
+    snapshots = self.snapshots
+    if isinstance(self.start, dict):
+      snapshots = [
+          s for s in snapshots if s.id < self.start["__name__"]
+      ]
+    elif self.start is not None:
+      snapshots = [s for s in snapshots if s.id < self.start.id]
+    return iter(snapshots[:self.size])
+
+
+def make_snapshot(index, terms=()):
+  snapshot = mock.Mock()
+  snapshot.id = f"doc{index:02d}"
+  timestamp = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc
+                               ) + datetime.timedelta(minutes=index)
+  snapshot.get.return_value = timestamp
+  snapshot.to_dict.return_value = {
+      "uid": snapshot.id,
+      "index": index,
+      "search_terms": list(terms)
+  }
+  return snapshot
+
+
+def make_query(snapshots):
+  with mock.patch("utils.pagination.ModelWrapper") as wrapper:
+    wrapper.from_query_result.side_effect = lambda model, snapshot: mock.Mock(
+        to_dict=snapshot.to_dict)
+    yield FakeQuery(snapshots)
+
+
+@pytest.fixture
+def query():
+  yield from make_query(
+      [make_snapshot(index) for index in reversed(range(10))])
+
+
+def case_terms(case_id):
+  return search_terms({"case_id": case_id}, None)
+
+
+@pytest.fixture
+def search_query():
+  # Even documents hold the word "smith", the others a longer word
+  yield from make_query([
+      make_snapshot(index, case_terms("smith" if index %
+                                      2 == 0 else "smithson"))
+      for index in reversed(range(6))
+  ])
+
+
+def test_pages_follow_the_cursor(query):
+  uids = []
+  cursor = None
+  while True:
+    page, cursor = fetch_page(query, 4, cursor)
+    uids.extend(doc["uid"] for doc in page)
+    if cursor is None:
+      break
+  assert uids == [f"doc{index:02d}" for index in reversed(range(10))]
+  assert decode_cursor(fetch_page(query, 4)[1])["__name__"] == "doc06"
+
+
+def test_filtered_page(query):
+  page, cursor = fetch_page(query, 2, keep=lambda doc: doc["index"] % 3 == 0)
+  assert [doc["index"] for doc in page] == [9, 6]
+  page, cursor = fetch_page(query, 2, cursor,
+                            keep=lambda doc: doc["index"] % 3 == 0)
+  assert [doc["index"] for doc in page] == [3, 0]
+
+
+def test_filtered_page_stops_scanning(query):
+  with mock.patch("utils.pagination.HITL_PAGE_SCAN_FACTOR", 2):
+    page, cursor = fetch_page(query, 2, keep=lambda doc: False)
+  assert not page
+  assert decode_cursor(cursor)["__name__"] == "doc06"
+
+
+def test_invalid_parameters():
+  with pytest.raises(ValueError):
+    decode_cursor("not a cursor")
+  with pytest.raises(ValueError):
+    page_size_or_default(0)
+  with mock.patch("utils.pagination.HITL_MAX_PAGE_SIZE", 10):
+    with pytest.raises(ValueError):
+      page_size_or_default(11)
+
+
+def test_search_ranks_exact_matches_first(search_query):
+  indexes = []
+  cursor = None
+  while True:
+    page, cursor = search_page(search_query, "Smith", 2, cursor)
+    indexes.extend(doc["index"] for doc in page)
+    if cursor is None:
+      break
+  assert indexes == [4, 2, 0, 5, 3, 1]
+  with pytest.raises(ValueError):
+    search_page(search_query, "smith", 2, "not a cursor")
+
+
+def test_search_checks_every_trigram():
+  candidates = make_query([
+      make_snapshot(2, case_terms("jonathan")),
+      make_snapshot(1, case_terms("thanks")),
+      make_snapshot(0, case_terms("nathan"))
+  ])
+  for candidates_query in candidates:
+    page, cursor = search_page(candidates_query, "athan", 10)
+  assert [doc["index"] for doc in page] == [2, 0]
+  assert cursor is None
+
+
+def test_short_term_scans_after_word_prefixes():
+  candidates = make_query([
+      make_snapshot(3, case_terms("jonathan")),
+      make_snapshot(2, case_terms("an")),
+      make_snapshot(1, case_terms("smith")),
+      make_snapshot(0, case_terms("anna"))
+  ])
+  # The scan reads every document, only "smith" does not contain the term
+  for candidates_query in candidates:
+    page, cursor = search_page(
+        candidates_query, "AN", 10, keep=lambda doc: doc["index"] != 1)
+  assert [doc["index"] for doc in page] == [2, 0, 3]
+  assert cursor is None
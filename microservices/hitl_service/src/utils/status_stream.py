@@ -0,0 +1,151 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Changes of the active documents pushed to the dashboards, from a
+Firestore snapshot listener shared by the clients of the pod"""
+
+import asyncio
+import threading
+from typing import Callable, Dict, List, Optional
+from fastapi.encoders import jsonable_encoder
+from fireo.database import db
+from fireo.queries.query_wrapper import ModelWrapper
+from common.models import Document
+from common.utils.logging_handler import Logger
+from common.utils.status_fields import list_documents
+from config import STATUS_STREAM_QUEUE_SIZE
+
+# pylint: disable = broad-except
+
+
+def active_documents_query():
+  return db.conn.collection(Document.collection_name).where(
+      "active", "==", "active")
+
+
+class DocumentStream:
+  """Listens to the active documents while at least one client is
+  subscribed and hands every change to each subscriber queue.
+
+  The first snapshot of a listener holds every active document, it is
+  not forwarded: clients load the current state from the list endpoints
+  and then only receive the changes. Each event is a dict with the type
+  "changed" and the document with its derived fields, or "removed" and
+  the uid of a document that is no longer active.
+
+  A subscriber whose queue is full gets None and is expected to close,
+  it missed changes and has to reload.
+
+  Args:
+    transform: computes the derived fields of a list of document dicts
+    query_factory: returns the query to listen to
+    queue_size: events kept for a subscriber
+  """
+
+  def __init__(self,
+               transform: Callable[[List[Dict]], List[Dict]] = list_documents,
+               query_factory: Callable = active_documents_query,
+               queue_size: int = STATUS_STREAM_QUEUE_SIZE):
+    self.transform = transform
+    self.query_factory = query_factory
+    self.queue_size = queue_size
+    self.subscribers = {}
+    self._watch = None
+    self._initial = True
+    self._lock = threading.Lock()
+
+  def subscribe(self) -> asyncio.Queue:
+    """Returns the queue of the events for a new client, starts listening
+    for the first one"""
+    queue = asyncio.Queue(maxsize=self.queue_size)
+    with self._lock:
+      self.subscribers[queue] = asyncio.get_running_loop()
+      if self._watch is None:
+        self._initial = True
+        self._watch = self.query_factory().on_snapshot(self._on_snapshot)
+        Logger.info("Listening to the active documents")
+    return queue
+
+  def unsubscribe(self, queue: asyncio.Queue):
+    """Removes the queue of a client, stops listening after the last one"""
+    with self._lock:
+      self.subscribers.pop(queue, None)
+      if self.subscribers or self._watch is None:
+        return
+      watch, self._watch = self._watch, None
+    watch.unsubscribe()
+    Logger.info("Stopped listening to the active documents")
+
+  def _on_snapshot(self, _snapshot, changes, _read_time):
+    """Called by the listener thread with the changes of a snapshot"""
+    with self._lock:
+      if self._initial:
+        self._initial = False
+        return
+      subscribers = list(self.subscribers.items())
+    if not subscribers:
+      return
+    try:
+      events = self._events(changes)
+    except Exception as e:
+      Logger.error(f"Error in reading the document changes: {e}")
+      return
+    for queue, loop in subscribers:
+      loop.call_soon_threadsafe(self._publish, queue, events)
+
+  def _events(self, changes) -> List[Dict]:
+    events = []
+    changed = []
+    for change in changes:
+      if change.type.name == "REMOVED":
+        events.append({
+            "type": "removed",
+            "data": {
+                "uid": change.document.id
+            }
+        })
+      else:
+        # Same fields as the documents of the list endpoints
+        document = ModelWrapper.from_query_result(Document(), change.document)
+        if document is not None:
+          changed.append(document.to_dict())
+    for doc in self.transform(changed):
+      events.append({"type": "changed", "data": jsonable_encoder(doc)})
+    return events
+
+  def _publish(self, queue: asyncio.Queue, events: List[Dict]):
+    """Runs on the loop of the subscriber"""
+    for event in events:
+      with self._lock:
+        if queue not in self.subscribers:
+          return
+        if queue.qsize() >= self.queue_size - 1:
+          # Too far behind, the None tells the client to reload
+          self.subscribers.pop(queue)
+          queue.put_nowait(None)
+          return
+      queue.put_nowait(event)
+
+
+_stream: Optional[DocumentStream] = None
+
+
+def get_document_stream() -> DocumentStream:
+  """Returns the document stream of the process, created on first use"""
+  global _stream
+  if _stream is None:
+    _stream = DocumentStream()
+  return _stream
@@ -0,0 +1,89 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the document stream
+"""
+import asyncio
+from unittest import mock
+from utils.status_stream import DocumentStream
+
+
+def make_change(change_type, uid, **fields):
+  snapshot = mock.Mock()
+  snapshot.id = uid
+  snapshot.reference.path = f"document/{uid}"
+  snapshot.to_dict.return_value = dict(fields, uid=uid)
+  change = mock.Mock()
+  change.type.name = change_type
+  change.document = snapshot
+  return change
+
+
+def make_stream(queue_size=10):
+  query = mock.Mock()
+  transform = mock.Mock(side_effect=lambda docs: [
+      dict(doc, current_status="Processing") for doc in docs
+  ])
+  stream = DocumentStream(transform, lambda: query, queue_size=queue_size)
+  return stream, query
+
+
+def test_changes_after_first_snapshot():
+  """The initial snapshot is skipped, the changes are pushed"""
+
+  async def run():
+    stream, query = make_stream()
+    queue = stream.subscribe()
+    callback = query.on_snapshot.call_args[0][0]
+    callback(None, [make_change("ADDED", "uid_0")], None)
+    callback(None, [
+        make_change("MODIFIED", "uid_1", case_id="case_1"),
+        make_change("REMOVED", "uid_2")
+    ], None)
+    await asyncio.sleep(0)
+    events = [queue.get_nowait() for _ in range(queue.qsize())]
+    stream.unsubscribe(queue)
+    return events, query
+
+  events, query = asyncio.run(run())
+  assert events[0] == {"type": "removed", "data": {"uid": "uid_2"}}
+  assert events[1]["type"] == "changed"
+  assert events[1]["data"]["uid"] == "uid_1"
+  assert events[1]["data"]["case_id"] == "case_1"
+  assert events[1]["data"]["current_status"] == "Processing"
+  assert len(events) == 2
+  query.on_snapshot.return_value.unsubscribe.assert_called_once()
+
+
+def test_slow_subscriber_dropped():
+  """A subscriber that falls behind gets None and no more events"""
+
+  async def run():
+    stream, query = make_stream(queue_size=3)
+    queue = stream.subscribe()
+    callback = query.on_snapshot.call_args[0][0]
+    callback(None, [], None)
+    callback(None, [make_change("REMOVED", f"uid_{i}") for i in range(5)],
+             None)
+    await asyncio.sleep(0)
+    events = [queue.get_nowait() for _ in range(queue.qsize())]
+    return events, stream
+
+  events, stream = asyncio.run(run())
+  assert events[-1] is None
+  assert len(events) == 3
+  assert not stream.subscribers
@@ -16,9 +16,10 @@ limitations under the License.
 
 """ Matching endpoints"""
 from fastapi import APIRouter, HTTPException, status
-import requests
 from common.models import Document
 from common.utils.logging_handler import Logger
+from common.utils.metrics import track_stage
+from common.utils.service_client import get_service_client
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
 
 from typing import Optional, List
@@ -64,18 +65,11 @@ def update_matching_status(case_id: str,
   """
   Logger.info(f"Updating Matching status for case_id {case_id} and uid {uid}")
   if status == STATUS_SUCCESS:
-    base_url = "http://document-status-service/document_status_service/"\
-      "v1/update_matching_status"
-    req_url = f"{base_url}?case_id={case_id}&uid={uid}&status={status}"\
-    f"&entity={entity}&matching_score={matching_score}"
-
-    return requests.post(req_url, json=entity)
+    return get_service_client().update_matching_status(
+        case_id, uid, status, entities=entity, matching_score=matching_score)
 
   else:
-    base_url = "http://document-status-service/document_status_service/"\
-      "v1/update_matching_status"
-    req_url = f"{base_url}?case_id={case_id}&uid={uid}&status={status}"
-    return requests.post(req_url)
+    return get_service_client().update_matching_status(case_id, uid, status)
 
 
 @router.post("/match_document")
@@ -108,7 +102,8 @@ async def match_document(case_id: str, uid: str):
       af_dict = copy.deepcopy(af_doc.to_dict())
 
       #getting json matching result
-      matching_result = get_matching_score(af_dict, sd_dict)
+      with track_stage("matching"):
+        matching_result = get_matching_score(af_dict, sd_dict)
       Logger.info(matching_result)
       print("matching_result:")
       print(matching_result)
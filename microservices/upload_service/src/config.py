@@ -38,3 +38,75 @@ COLLECTION = os.getenv("COLLECTION")
 API_BASE_URL = os.getenv("API_BASE_URL")
 
 SERVICE_NAME = os.getenv("SERVICE_NAME")
+
+# Maximum number of files of a batch ingested at the same time
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "10"))
+
+# Uploads of at least this many files are processed in the bulk lane
+BULK_UPLOAD_MIN_FILES = int(os.getenv("BULK_UPLOAD_MIN_FILES", "20"))
+
+# Size of the resumable upload chunks sent to GCS, a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+
+# Pipelines run at the same time on a pod, and pipelines accepted and
+# waiting for a worker before /process_task answers 429
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "10"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))
+
+# Budgets of the priority lanes. The interactive lane has workers of its
+# own on top of PIPELINE_WORKERS and may also use the shared ones, the
+# bulk lane runs at most PIPELINE_BULK_MAX_RUNNING pipelines so normal
+# uploads keep the rest. PIPELINE_QUEUE_SIZE is the queue of the normal
+# lane.
+PIPELINE_INTERACTIVE_WORKERS = int(
+    os.getenv("PIPELINE_INTERACTIVE_WORKERS", "2"))
+PIPELINE_INTERACTIVE_QUEUE_SIZE = int(
+    os.getenv("PIPELINE_INTERACTIVE_QUEUE_SIZE", "20"))
+PIPELINE_BULK_MAX_RUNNING = int(
+    os.getenv("PIPELINE_BULK_MAX_RUNNING", str(max(1, PIPELINE_WORKERS // 2))))
+PIPELINE_BULK_QUEUE_SIZE = int(
+    os.getenv("PIPELINE_BULK_QUEUE_SIZE", str(PIPELINE_QUEUE_SIZE)))
+# A task waiting longer than this is picked before the tasks of the
+# higher lanes, so a steady flow of interactive work cannot starve them
+PIPELINE_STARVATION_SECONDS = float(
+    os.getenv("PIPELINE_STARVATION_SECONDS", "60"))
+
+# "firestore" persists the pipeline tasks so they are resumed after a
+# restart, "memory" keeps them in the process for local runs
+PIPELINE_TASK_STORE = os.getenv("PIPELINE_TASK_STORE", "firestore")
+
+# A task in progress longer than the lease is considered lost and resumed
+PIPELINE_TASK_LEASE_SECONDS = int(
+    os.getenv("PIPELINE_TASK_LEASE_SECONDS", "3600"))
+PIPELINE_TASK_MAX_ATTEMPTS = int(os.getenv("PIPELINE_TASK_MAX_ATTEMPTS", "3"))
+PIPELINE_RESUME_INTERVAL_SECONDS = int(
+    os.getenv("PIPELINE_RESUME_INTERVAL_SECONDS", "60"))
+# Failed tasks are kept this long for inspection, then removed by the TTL
+# policy of the pipeline_task collection. Completed tasks are deleted.
+PIPELINE_FAILED_TASK_RETENTION_SECONDS = int(
+    os.getenv("PIPELINE_FAILED_TASK_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# Stages of one pipeline, like the extraction of different documents,
+# running at the same time
+PIPELINE_STAGE_CONCURRENCY = int(os.getenv("PIPELINE_STAGE_CONCURRENCY", "8"))
+
+# Records of a bulk JSON ingestion written per Firestore batch and per
+# combined GCS object, and the longest accepted line
+BULK_IMPORT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", "500"))
+BULK_IMPORT_MAX_LINE_BYTES = int(
+    os.getenv("BULK_IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+# Line errors returned in the response, all are written to GCS
+BULK_IMPORT_MAX_REPORTED_ERRORS = int(
+    os.getenv("BULK_IMPORT_MAX_REPORTED_ERRORS", "100"))
+
+# Uploaded PDFs over these limits are rejected before being published for
+# processing
+PDF_MAX_SIZE_BYTES = int(
+    os.getenv("PDF_MAX_SIZE_BYTES", str(100 * 1024 * 1024)))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "500"))
+# Pages looked at for fonts to tell a text PDF from a scanned one
+PDF_TEXT_LAYER_PAGES = int(os.getenv("PDF_TEXT_LAYER_PAGES", "3"))
+# Ranged reads of an uploaded PDF, the inspection only reads the trailer,
+# the cross reference table and the page tree
+PDF_PREFLIGHT_CHUNK_SIZE = int(
+    os.getenv("PDF_PREFLIGHT_CHUNK_SIZE", str(256 * 1024)))
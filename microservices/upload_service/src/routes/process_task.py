@@ -15,12 +15,15 @@ limitations under the License.
 """
 
 """ Process task api endpoint """
-from fastapi import APIRouter, BackgroundTasks, status
+from typing import Optional
+from fastapi import APIRouter, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from models.process_task import ProcessTask
-from utils.process_task_helpers import run_pipeline
+from utils.pipeline_engine import get_pipeline_engine, EngineBusy
 # pylint: disable = ungrouped-imports
 from common.utils.logging_handler import Logger
-from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
+from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR, \
+  PRIORITIES, PRIORITY_INTERACTIVE, PRIORITY_NORMAL
 
 router = APIRouter()
 SUCCESS_RESPONSE = {"status": STATUS_SUCCESS}
@@ -29,25 +32,44 @@ FAILED_RESPONSE = {"status": STATUS_ERROR}
 
 @router.post("/process_task", status_code=status.HTTP_202_ACCEPTED)
 async def process_task(payload: ProcessTask,
-                       background_task: BackgroundTasks,
                        is_hitl: bool = False,
-                       is_reassign: bool = False):
+                       is_reassign: bool = False,
+                       priority: Optional[str] = None):
   """Process task runs the ML pipeline
 
   Args:
     payload (ProcessTask): Consist of configs required to run the pipeline
-    background_task : It is used to run the ML tasks in the background
     is_hitl : It is used to run the pipeline for unclassifed documents
     is_reassign : It is used to run the pipeline for reassigned document
+    priority : lane of the task, interactive, normal or bulk. HITL and
+      reassign runs are interactive by default, other runs normal
   Returns:
     202 : Documents are being processed
-    422 : Invalid json provided
+    422 : Invalid json or priority provided
+    429 : Pipeline queue of the lane is full, retry later
     """
 
+  if priority is None:
+    priority = PRIORITY_INTERACTIVE if is_hitl or is_reassign \
+      else PRIORITY_NORMAL
+  elif priority not in PRIORITIES:
+    raise HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail=f"Priority should be one of {PRIORITIES}")
+
   payload = payload.dict()
   Logger.info(f"Processing the documents : {payload}")
   print(f"Processing the documents : {payload}")
 
-  # Run the pipeline in the background
-  background_task.add_task(run_pipeline, payload, is_hitl, is_reassign)
-  return {"message": "Processing your document"}
+  # Persist the task and queue it for the pipeline workers
+  try:
+    task_id = await run_in_threadpool(get_pipeline_engine().submit,
+                                      payload["configs"], is_hitl,
+                                      is_reassign, priority)
+  except EngineBusy as e:
+    Logger.warning(f"Rejecting the documents, {e}")
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=str(e),
+        headers={"Retry-After": "30"}) from e
+  return {"message": "Processing your document", "task_id": task_id}
@@ -23,8 +23,12 @@ import os
 from unittest import mock
 from testing.fastapi_fixtures import client_with_emulator
 from common.testing.firestore_emulator import firestore_emulator, clean_firestore
-from common.models import Document
-from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
+from common.models import Document, ContentIndex
+from utils.pipeline_engine import get_pipeline_engine, set_pipeline_engine,\
+  PipelineEngine, InMemoryTaskStore
+from utils.process_task_helpers import run_pipeline
+from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR, \
+  PRIORITY_NORMAL
 
 # assigning url
 API_URL = "http://localhost:8889/upload_service/v1/process_task"
@@ -69,6 +73,7 @@ def test_process_task_api(client_with_emulator):
               "utils.process_task_helpers.update_autoapproval_status"):
             with mock.patch("routes.process_task.Logger"):
               response = client_with_emulator.post(API_URL, json=data)
+              get_pipeline_engine().join()
   assert response.status_code == 202, "Status 202"
 
 
@@ -100,6 +105,7 @@ def test_process_task_api_is_hitl(client_with_emulator):
               "utils.process_task_helpers.update_autoapproval_status"):
             with mock.patch("routes.process_task.Logger"):
               response = client_with_emulator.post(url, json=data)
+              get_pipeline_engine().join()
   assert response.status_code == 202, "Status 202"
 
 
@@ -129,4 +135,93 @@ def test_process_task_api_is_reassign(client_with_emulator):
               "utils.process_task_helpers.update_autoapproval_status"):
             with mock.patch("routes.process_task.Logger"):
               response = client_with_emulator.post(url, json=data)
+              get_pipeline_engine().join()
   assert response.status_code == 202, "Status 202"
+
+
+def test_process_task_api_reuses_identical_content(client_with_emulator):
+  """Test that a byte identical document skips classification and
+  extraction"""
+  doc = Document()
+  doc.case_id = "case_arkansas_2002"
+  doc.uid = "dupl1cateUid0000001"
+  doc.save()
+  entry = ContentIndex()
+  entry.content_hash = "f" * 64
+  entry.uid = "orig1nalUid00000001"
+  entry.document_class = "driver_license"
+  entry.document_type = "supporting_documents"
+  entry.context = "arkansas"
+  entry.entities = [{"entity": "name", "value": "Jon"}]
+  entry.extraction_score = 0.9
+  entry.extraction_status = "single_key_extraction"
+  entry.save()
+  data = {
+      "configs": [{
+          "case_id": "case_arkansas_2002",
+          "uid": "dupl1cateUid0000001",
+          "gcs_url": "gs://document-upload-test/case_arkansas_2002/"\
+          "dupl1cateUid0000001/DL-arkansas-1.pdf",
+          "context": "arkansas",
+          "content_hash": "f" * 64
+      }]
+  }
+  status_response = mock.Mock(status_code=200)
+  with mock.patch("utils.process_task_helpers.get_classification") as cl, \
+    mock.patch("utils.process_task_helpers.get_extraction_score") as ex, \
+    mock.patch("utils.process_task_helpers.update_classification_status",
+               return_value=status_response), \
+    mock.patch("utils.process_task_helpers.update_extraction_status",
+               return_value=status_response), \
+    mock.patch("utils.process_task_helpers.stream_document_to_bigquery",
+               return_value=[]), \
+    mock.patch("utils.process_task_helpers.get_validation_score"), \
+    mock.patch("utils.process_task_helpers.get_matching_score"), \
+    mock.patch("utils.process_task_helpers.update_autoapproval_status"), \
+    mock.patch("routes.process_task.Logger"):
+    response = client_with_emulator.post(API_URL, json=data)
+    get_pipeline_engine().join()
+    cl.assert_not_called()
+    ex.assert_not_called()
+  assert response.status_code == 202, "Status 202"
+
+
+def test_process_task_api_queue_full(client_with_emulator):
+  """Test that process_task answers 429 once the workers and the queue are
+  full"""
+  data = {"configs": [{"case_id": "case_arkansas_2003", "uid": "uid"}]}
+  engine = PipelineEngine(
+      mock.Mock(), InMemoryTaskStore(), workers=1, queue_size=0)
+  engine.slots[PRIORITY_NORMAL].acquire()
+  set_pipeline_engine(engine)
+  try:
+    with mock.patch("routes.process_task.Logger"):
+      response = client_with_emulator.post(API_URL, json=data)
+  finally:
+    set_pipeline_engine(None)
+  assert response.status_code == 429, "Status 429"
+  assert response.headers["Retry-After"] == "30"
+
+
+def test_process_task_api_invalid_priority(client_with_emulator):
+  """Test that an unknown priority is rejected"""
+  data = {"configs": [{"case_id": "case_arkansas_2003", "uid": "uid"}]}
+  response = client_with_emulator.post(f"{API_URL}?priority=urgent", json=data)
+  assert response.status_code == 422, "Status 422"
+
+
+def test_failed_stages_recorded_on_task():
+  """Test that the failed stages of a pipeline are recorded on its task"""
+  engine = PipelineEngine(
+      run_pipeline,
+      InMemoryTaskStore(retention_seconds=3600),
+      resume_interval=0)
+  graph = mock.Mock(errors={"classification:uid"})
+  with mock.patch("utils.process_task_helpers.build_pipeline_graph",
+                  return_value=graph):
+    with mock.patch("utils.pipeline_engine.Logger"):
+      task_id = engine.submit([{"case_id": "case_arkansas_2004", "uid": "uid"}])
+      engine.join()
+  engine.stop()
+  assert engine.store.get(task_id)["error"] == \
+    "Pipeline stages failed: ['classification:uid']"
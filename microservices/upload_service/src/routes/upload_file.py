@@ -16,19 +16,29 @@ limitations under the License.
 
 """ Upload and process task api endpoints """
 
+import asyncio
+import json
+import os
 import uuid
-import requests
+import fireo
 import traceback
 import datetime
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from fastapi.concurrency import run_in_threadpool
-from typing import Optional, List
+from typing import Optional, List, Dict, Callable
 from schemas.input_data import InputData
+from config import UPLOAD_CONCURRENCY, BULK_IMPORT_BATCH_SIZE, \
+  BULK_IMPORT_MAX_LINE_BYTES, BULK_IMPORT_MAX_REPORTED_ERRORS, \
+  BULK_UPLOAD_MIN_FILES
 import utils.upload_file_gcs_bucket as ug
+from utils.pdf_preflight import inspect_pdf, preflight_error
 from common.utils.logging_handler import Logger
-from common.models import Document
-from common.utils.publisher import publish_document
-from common.config import BUCKET_NAME
+from common.utils.metrics import track_stage
+from common.models import Document, BulkImport, STATUS_KIND_SYSTEM
+from common.utils.publisher import publish_document_async
+from common.utils.service_client import get_service_client
+from common.config import BUCKET_NAME, FIRESTORE_BATCH_LIMIT, \
+  PRIORITY_NORMAL, PRIORITY_BULK, BULK_IMPORT_PREFIX
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
 
 # pylint: disable = broad-except ,literal-comparison
@@ -45,14 +55,18 @@ async def upload_file(
 ):
   """Uploads files to the GCS bucket and Save the record in the database
 
+  Files of a batch are ingested concurrently, bounded by
+  UPLOAD_CONCURRENCY. The status of every file is reported in the
+  response, a failure in one file does not fail the whole batch.
+
   Args:
     case_id (str): Case id of the files it's optionl ,
     state (str) : state for which the application will be used
     list of files : to get the list of documents from user
   Returns:
-    200 : PDF files are successfully uploaded
+    200 : PDF files are uploaded, per file status in results
     422 : If file other than pdf is uploaded by user
-    500 :Error in uploading documents
+    500 :Error in uploading all the documents
     """
   #checking if all uploaded files are pdf documents
   for file in files:
@@ -64,69 +78,59 @@ async def upload_file(
     #generate a case_id if not provided by the user
   if case_id is None:
     case_id = str(uuid.uuid1())
-  uid_list = []
-  message_list = []
   try:
-    for file in files:
-      #create a record in database for uploaded document
-      output = create_document(case_id, file.filename, context, user=user)
-      uid = output
-      uid_list.append(uid)
-      #Upload document in GCS bucket
-      status = await run_in_threadpool(ug.upload_file, case_id, uid, file)
-      #check the uploaded document status
-      if status != STATUS_SUCCESS:
-
-        #Update the document upload in GCS as failed
-        document = Document.find_by_uid(uid)
-        system_status = {
-            "stage": "upload",
-            "status": STATUS_ERROR,
-            "timestamp": datetime.datetime.utcnow(),
-            "comment": comment
-        }
-        document.system_status = [system_status]
-        document.update()
-
-        raise HTTPException(
-            status_code=500,
-            detail="Error "
-            "in uploading document in gcs bucket")
-      Logger.info(f"File with case_id {case_id} and uid {uid}"
-                  f" uploaded successfullly in GCS bucket")
-      #Update the document upload as success in DB
-      document = Document.find_by_uid(uid)
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    results = await asyncio.gather(*[
+        ingest_file(semaphore, case_id, file.filename, context, user,
+                    upload_from_file(case_id, file)) for file in files
+    ])
+    return await complete_upload(case_id, context, comment, results)
+  except HTTPException as e:
+    raise e
+  except Exception as e:
+    Logger.error(e)
+    err = traceback.format_exc().replace("\n", " ")
+    Logger.error(err)
+    raise HTTPException(
+        status_code=500, detail="Error "
+        "in uploading document") from e
 
-      gcs_base_url = f"gs://{BUCKET_NAME}"
-      document.url = f"{gcs_base_url}/{case_id}/{uid}/{file.filename}"
-      system_status = {
-          "stage": "uploaded",
-          "status": STATUS_SUCCESS,
-          "timestamp": datetime.datetime.utcnow(),
-          "comment": comment
-      }
-      document.system_status = [system_status]
-      document.update()
-      message_list.append({
-          "case_id": case_id,
-          "uid": uid,
-          "gcs_url": document.url,
-          "context": context
-      })
-    # Pushing Message To Pubsub
-    pubsub_msg = f"batch for {case_id} moved to bucket"
-    message_dict = {"message": pubsub_msg, "message_list": message_list}
-    publish_document(message_dict)
-    Logger.info(f"Files with case id {case_id} uploaded"
-                f" successfully")
-    return {
-        "status": f"Files with case id {case_id} uploaded"
-                  f"successfully, the document"
-                  f" will be processed in sometime ",
-        "case_id": case_id,
-        "uid_list": uid_list,
-        "configs": message_list
-    }
+
+@router.post("/upload_file_stream")
+async def upload_file_stream(
+    request: Request,
+    context: str,
+    filename: str,
+    case_id: Optional[str] = None,
+    comment: Optional[str] = None,
+    user: Optional[str] = None,
+):
+  """Streams a single pdf sent as the raw request body straight to the
+  GCS bucket and Save the record in the database. The file is not
+  buffered on local disk, which suits large scanned documents.
+
+  Args:
+    context (str) : state for which the application will be used
+    filename (str) : name of the uploaded pdf file
+    case_id (str): Case id of the file it's optionl
+  Returns:
+    200 : PDF file is uploaded, file status in results
+    422 : If file other than pdf is uploaded by user
+    500 :Error in uploading the document
+    """
+  if not filename.lower().endswith(".pdf"):
+    Logger.error("Uploaded file is not a pdf document")
+    raise HTTPException(status_code=422, detail="Please upload a pdf file")
+  if case_id is None:
+    case_id = str(uuid.uuid1())
+  try:
+    semaphore = asyncio.Semaphore(1)
+    result = await ingest_file(
+        semaphore, case_id, filename, context, user,
+        upload_from_stream(case_id, filename, request.stream()))
+    return await complete_upload(case_id, context, comment, [result])
+  except HTTPException as e:
+    raise e
   except Exception as e:
     Logger.error(e)
     err = traceback.format_exc().replace("\n", " ")
@@ -136,6 +140,215 @@ async def upload_file(
         "in uploading document") from e
 
 
+def upload_from_file(case_id: str, file: UploadFile):
+  """Returns the upload function for a multipart file, the file is
+  inspected on local disk and only uploaded when it passes"""
+
+  async def upload(uid):
+    pdf_metadata = await run_in_threadpool(inspect_local_file, file)
+    error = preflight_error(pdf_metadata)
+    if error:
+      return {
+          "status": STATUS_ERROR,
+          "detail": error,
+          "pdf_metadata": pdf_metadata
+      }
+    upload_result = await run_in_threadpool(ug.upload_file, case_id, uid,
+                                            file)
+    upload_result["pdf_metadata"] = pdf_metadata
+    return upload_result
+
+  return upload
+
+
+def upload_from_stream(case_id: str, filename: str, chunks):
+  """Returns the upload function for a streamed request body, the
+  uploaded object is inspected with ranged reads and deleted when it does
+  not pass"""
+
+  async def upload(uid):
+    upload_result = await ug.upload_stream(case_id, uid, filename, chunks)
+    if upload_result["status"] != STATUS_SUCCESS:
+      return upload_result
+    pdf_metadata = await run_in_threadpool(inspect_uploaded_file, case_id,
+                                           uid, filename,
+                                           upload_result["size"])
+    upload_result["pdf_metadata"] = pdf_metadata
+    error = preflight_error(pdf_metadata)
+    if error:
+      await run_in_threadpool(ug.delete_blob, case_id, uid, filename)
+      upload_result["status"] = STATUS_ERROR
+      upload_result["detail"] = error
+    return upload_result
+
+  return upload
+
+
+def inspect_local_file(file: UploadFile):
+  with track_stage("pdf_preflight"):
+    file.file.seek(0, os.SEEK_END)
+    return inspect_pdf(file.file, file.file.tell())
+
+
+def inspect_uploaded_file(case_id: str, uid: str, filename: str, size: int):
+  with track_stage("pdf_preflight"):
+    reader = ug.open_blob_reader(case_id, uid, filename)
+    try:
+      return inspect_pdf(reader, size)
+    finally:
+      reader.close()
+
+
+async def ingest_file(semaphore: asyncio.Semaphore, case_id: str,
+                      filename: str, context: str, user: Optional[str],
+                      upload: Callable):
+  """Creates the document record and uploads one file to the GCS bucket
+
+  Args:
+    semaphore: bounds the number of files ingested at the same time
+    case_id (str): Case id of the file
+    filename (str): name of the file to upload
+    context (str): state for which the application will be used
+    user (str): user uploading the file
+    upload: async function uploading the file content for a uid
+  Returns:
+    dict with filename, uid, gcs_url, size, sha256, status, detail, the
+    pdf_metadata of the pre-flight inspection and the loaded document to
+    update
+  """
+  result = {
+      "filename": filename,
+      "uid": None,
+      "gcs_url": None,
+      "size": None,
+      "sha256": None,
+      "status": STATUS_ERROR,
+      "detail": None,
+      "pdf_metadata": None,
+      "document": None
+  }
+  async with semaphore:
+    try:
+      #create a record in database for uploaded document
+      uid = await run_in_threadpool(
+          create_document, case_id, filename, context, user=user)
+      result["uid"] = uid
+      #Upload document in GCS bucket
+      upload_result = await upload(uid)
+      result["pdf_metadata"] = upload_result.get("pdf_metadata")
+      result["document"] = await run_in_threadpool(Document.find_by_uid, uid)
+      #check the uploaded document status
+      if upload_result["status"] != STATUS_SUCCESS:
+        Logger.error(f"File {filename} with case_id {case_id} and uid "
+                     f"{uid} failed to upload in GCS bucket")
+        result["detail"] = upload_result.get(
+            "detail", "Error in uploading document in gcs bucket")
+        return result
+      Logger.info(f"File with case_id {case_id} and uid {uid}"
+                  f" uploaded successfullly in GCS bucket")
+      gcs_base_url = f"gs://{BUCKET_NAME}"
+      result["gcs_url"] = f"{gcs_base_url}/{case_id}/{uid}/{filename}"
+      result["size"] = upload_result.get("size")
+      result["sha256"] = upload_result.get("sha256")
+      result["status"] = STATUS_SUCCESS
+    except Exception as e:
+      Logger.error(f"Error in uploading {filename} with case_id "
+                   f"{case_id}: {e}")
+      err = traceback.format_exc().replace("\n", " ")
+      Logger.error(err)
+      result["detail"] = "Error in uploading document"
+  return result
+
+
+async def complete_upload(case_id: str, context: str, comment: Optional[str],
+                          results: List[Dict]):
+  """Commits the upload status of the files in batched writes, publishes
+  the uploaded files for processing and builds the response
+
+  Args:
+    case_id (str): Case id of the files
+    context (str): state for which the application will be used
+    comment (str): comment stored with the upload status
+    results: per file results returned by ingest_file
+  Returns:
+    response of the upload endpoints
+  Raises:
+    HTTPException 500 when none of the files was uploaded
+  """
+  # Collapse the per file status writes into batched commits
+  timestamp = datetime.datetime.utcnow()
+  batch = fireo.batch()
+  write_count = 0
+  for result in results:
+    document = result.pop("document", None)
+    if document is None:
+      continue
+    system_status = {
+        "stage": "upload",
+        "status": result["status"],
+        "timestamp": timestamp,
+        "comment": comment
+    }
+    if result["status"] == STATUS_SUCCESS:
+      document.url = result["gcs_url"]
+      document.content_hash = result["sha256"]
+      # Published below, counted in flight by the queue once dispatched
+      system_status["stage"] = "uploaded"
+    else:
+      document.error_detail = result["detail"]
+    document.pdf_metadata = result["pdf_metadata"]
+    document.add_status(STATUS_KIND_SYSTEM, system_status, batch=batch)
+    document.update(batch=batch)
+    # The document and its status event
+    write_count += 2
+    if write_count + 2 > FIRESTORE_BATCH_LIMIT:
+      await run_in_threadpool(commit_batch, batch)
+      batch = fireo.batch()
+      write_count = 0
+  if write_count:
+    await run_in_threadpool(commit_batch, batch)
+
+  uid_list = [result["uid"] for result in results if result["uid"]]
+  message_list = [{
+      "case_id": case_id,
+      "uid": result["uid"],
+      "gcs_url": result["gcs_url"],
+      "context": context,
+      "content_hash": result["sha256"]
+  } for result in results if result["status"] == STATUS_SUCCESS]
+  if not message_list:
+    Logger.error(f"All files with case_id {case_id} failed to upload")
+    raise HTTPException(
+        status_code=500,
+        detail={
+            "message": "Error in uploading documents",
+            "case_id": case_id,
+            "results": results
+        })
+
+  # Pushing Message To Pubsub
+  pubsub_msg = f"batch for {case_id} moved to bucket"
+  priority = PRIORITY_BULK if len(message_list) >= BULK_UPLOAD_MIN_FILES \
+    else PRIORITY_NORMAL
+  message_dict = {
+      "message": pubsub_msg,
+      "message_list": message_list,
+      "priority": priority
+  }
+  await publish_document_async(message_dict)
+  Logger.info(f"{len(message_list)} of {len(results)} files with case id "
+              f"{case_id} uploaded successfully")
+  return {
+      "status": f"Files with case id {case_id} uploaded"
+                f"successfully, the document"
+                f" will be processed in sometime ",
+      "case_id": case_id,
+      "uid_list": uid_list,
+      "configs": message_list,
+      "results": results
+  }
+
+
 @router.post("/upload_json")
 async def upload_data_json(input_data: InputData):
   """Uploads input  to the GCS bucket and Save the record in the database
@@ -148,7 +361,6 @@ async def upload_data_json(input_data: InputData):
      """
   try:
     input_data = dict(input_data)
-    entity = []
     document_class = input_data.pop("document_class")
     document_type = input_data.pop("document_type")
     context = input_data.pop("context")
@@ -156,14 +368,7 @@ async def upload_data_json(input_data: InputData):
     #If case-id is none generate a new case_id
     if case_id is None:
       case_id = str(uuid.uuid1())
-    #Converting Json to required format
-    for key, value in input_data.items():
-      entity.append({
-          "entity": key,
-          "value": value,
-          "extraction_confidence": 1,
-          "corrected_value": None
-      })
+    entity = json_input_entities(input_data)
     uid = create_document_from_data(case_id, document_type, document_class,
                                     context, entity)
 
@@ -176,25 +381,230 @@ async def upload_data_json(input_data: InputData):
         "in uploading document") from e
 
 
+@router.post("/upload_json_bulk")
+async def upload_data_json_bulk(request: Request):
+  """Ingests newline delimited JSON, one InputData record per line. The
+  body is read as a stream and written every BULK_IMPORT_BATCH_SIZE
+  records, as one Firestore batch and one combined GCS object.
+
+  The progress is kept in the bulk_import collection under the returned
+  import_id. Lines that fail are skipped and written to an errors object.
+    Args:
+       request: body of newline delimited InputData JSON records
+    Returns:
+       200 : counts of the lines read and documents created, and the
+             first line errors
+       500 : if writing a batch fails, the records of the batches already
+             written are kept
+     """
+  import_id = uuid.uuid4().hex
+  gcs_prefix = f"{BULK_IMPORT_PREFIX}/{import_id}"
+  bulk_import = BulkImport()
+  bulk_import.import_id = import_id
+  bulk_import.status = STATUS_IN_PROGRESS
+  bulk_import.lines_read = 0
+  bulk_import.documents_created = 0
+  bulk_import.error_count = 0
+  bulk_import.gcs_prefix = f"gs://{BUCKET_NAME}/{gcs_prefix}"
+  bulk_import.updated_timestamp = datetime.datetime.utcnow()
+  await run_in_threadpool(bulk_import.save)
+
+  # Each record writes its document and its first status event
+  batch_size = min(BULK_IMPORT_BATCH_SIZE, FIRESTORE_BATCH_LIMIT // 2)
+  errors = []
+  error_writer = None
+  records = []
+  part = 0
+
+  async def flush():
+    nonlocal records, part
+    part += 1
+    await run_in_threadpool(write_json_records, records,
+                            f"{gcs_prefix}/part-{part:05d}.ndjson")
+    bulk_import.documents_created += len(records)
+    records = []
+
+  async def line_error(line_number, error):
+    nonlocal error_writer
+    error_line = {"line": line_number, "error": error}
+    if len(errors) < BULK_IMPORT_MAX_REPORTED_ERRORS:
+      errors.append(error_line)
+    if error_writer is None:
+      error_writer = await run_in_threadpool(ug.open_ndjson_writer,
+                                             f"{gcs_prefix}/errors.ndjson")
+      bulk_import.errors_url = \
+        f"gs://{BUCKET_NAME}/{gcs_prefix}/errors.ndjson"
+    await run_in_threadpool(error_writer.write,
+                            json.dumps(error_line) + "\n")
+    bulk_import.error_count += 1
+
+  try:
+    async for line_number, line in read_ndjson_lines(request.stream()):
+      bulk_import.lines_read = line_number
+      if isinstance(line, Exception):
+        await line_error(line_number, str(line))
+        continue
+      if not line.strip():
+        continue
+      try:
+        records.append(json_input_record(line))
+      except Exception as e:
+        await line_error(line_number, str(e))
+        continue
+      if len(records) >= batch_size:
+        await flush()
+        bulk_import.updated_timestamp = datetime.datetime.utcnow()
+        await run_in_threadpool(bulk_import.update)
+    if records:
+      await flush()
+    bulk_import.status = STATUS_SUCCESS
+  except Exception as e:
+    Logger.error(traceback.format_exc().replace("\n", " "))
+    bulk_import.status = STATUS_ERROR
+    raise HTTPException(
+        status_code=500,
+        detail={
+            "message": "Error in bulk uploading documents",
+            "import_id": import_id,
+            "lines_read": bulk_import.lines_read,
+            "documents_created": bulk_import.documents_created
+        }) from e
+  finally:
+    if error_writer is not None:
+      await run_in_threadpool(error_writer.close)
+    bulk_import.updated_timestamp = datetime.datetime.utcnow()
+    await run_in_threadpool(bulk_import.update)
+
+  Logger.info(f"Bulk import {import_id} created "
+              f"{bulk_import.documents_created} documents from "
+              f"{bulk_import.lines_read} lines with "
+              f"{bulk_import.error_count} errors")
+  return {
+      "status": STATUS_SUCCESS,
+      "import_id": import_id,
+      "lines_read": bulk_import.lines_read,
+      "documents_created": bulk_import.documents_created,
+      "error_count": bulk_import.error_count,
+      "errors_url": bulk_import.errors_url,
+      "errors": errors
+  }
+
+
+@router.get("/upload_json_bulk/{import_id}")
+async def get_upload_json_bulk(import_id: str):
+  """Returns the progress of a bulk JSON ingestion
+    Args:
+       import_id: id returned by /upload_json_bulk
+    Returns:
+       200 : progress of the ingestion
+       404 : if the import_id is not found
+     """
+  bulk_import = await run_in_threadpool(BulkImport.find_by_id, import_id)
+  if bulk_import is None:
+    raise HTTPException(
+        status_code=404, detail=f"Bulk import {import_id} not found")
+  return {"status": STATUS_SUCCESS, "data": bulk_import.to_dict()}
+
+
+def json_input_entities(input_data: Dict):
+  """Converts the fields of an InputData record to entities"""
+  return [{
+      "entity": key,
+      "value": value,
+      "extraction_confidence": 1,
+      "corrected_value": None
+  } for key, value in input_data.items()]
+
+
+def json_input_record(line: bytes):
+  """Validates one NDJSON line and builds its document
+
+  Raises:
+    ValueError or ValidationError: when the line is not an InputData record
+  """
+  input_data = dict(InputData(**json.loads(line)))
+  case_id = input_data.pop("case_id") or str(uuid.uuid1())
+  timestamp = datetime.datetime.utcnow()
+  document = Document()
+  # Ids are set here so the batched writes do not need a read back
+  document.id = uuid.uuid4().hex
+  document.uid = document.id
+  document.case_id = case_id
+  document.document_class = input_data.pop("document_class")
+  document.document_type = input_data.pop("document_type")
+  document.context = input_data.pop("context")
+  document.entities = json_input_entities(input_data)
+  document.upload_timestamp = timestamp
+  document.active = "active"
+  return document
+
+
+def write_json_records(documents: List[Document], blob_name: str):
+  """Writes the input data of the documents as one GCS object, then the
+  documents in one Firestore batch pointing at it"""
+  url = ug.upload_ndjson_file(blob_name, [{
+      "case_id": document.case_id,
+      "uid": document.uid,
+      "entities": document.entities
+  } for document in documents])
+  batch = fireo.batch()
+  for document in documents:
+    document.url = url
+    document.add_status(
+        STATUS_KIND_SYSTEM, {
+            "stage": "uploaded",
+            "status": STATUS_SUCCESS,
+            "timestamp": document.upload_timestamp
+        },
+        batch=batch)
+    document.save(batch=batch)
+  commit_batch(batch)
+
+
+async def read_ndjson_lines(chunks):
+  """Splits a stream of bytes into numbered lines without reading it all.
+  A line longer than BULK_IMPORT_MAX_LINE_BYTES is returned as a
+  ValueError instead of its content."""
+  buffer = b""
+  line_number = 0
+  too_long = False
+  async for chunk in chunks:
+    buffer += chunk
+    *lines, buffer = buffer.split(b"\n")
+    for line in lines:
+      line_number += 1
+      # A chunk may hold whole lines longer than the limit
+      if too_long or len(line) > BULK_IMPORT_MAX_LINE_BYTES:
+        too_long = False
+        yield line_number, ValueError("Line is too long")
+      else:
+        yield line_number, line
+    if len(buffer) > BULK_IMPORT_MAX_LINE_BYTES:
+      too_long = True
+      buffer = b""
+  if too_long:
+    yield line_number + 1, ValueError("Line is too long")
+  elif buffer:
+    yield line_number + 1, buffer
+
+
+def commit_batch(batch):
+  with track_stage("firestore_write"):
+    batch.commit()
+
+
 def create_document_from_data(case_id, document_type, document_class, context,
                               entity):
-  base_url = "http://document-status-service/document_status_service/v1/"
-  req_url = f"{base_url}create_documet_json_input"
-  response = requests.post(
-      f"{req_url}?case_id={case_id}&document_class={document_class}"
-      f"&document_type={document_type}&context={context}",
-      json=entity)
+  response = get_service_client().create_document_json_input(
+      case_id, document_class, document_type, context, entity)
   response = response.json()
   uid = response["uid"]
   return uid
 
 
 def create_document(case_id, filename, context, user=None):
-  base_url = "http://document-status-service/document_status_service/v1/"
-  req_url = f"{base_url}create_document"
-  response = requests.post(
-      f"{req_url}?case_id={case_id}&filename={filename}&context={context}&user={user}"
-  )
+  response = get_service_client().create_document(case_id, filename, context,
+                                                  user)
   response = response.json()
   uid = response["uid"]
   return uid
@@ -17,7 +17,10 @@ limitations under the License.
 """
   Tests for Upload endpoints
 """
+import asyncio
+import io
 import os
+import json
 from unittest import mock
 # disabling pylint rules that conflict with pytest fixtures
 # pylint: disable=unused-argument,redefined-outer-name,unused-import,consider-using-with
@@ -25,6 +28,7 @@ from testing.fastapi_fixtures import client_with_emulator
 from common.testing.firestore_emulator import firestore_emulator, clean_firestore
 from common.models import Document
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
+from routes.upload_file import read_ndjson_lines
 
 # assigning url
 api_url = "http://localhost:8080/upload_service/v1/"
@@ -130,7 +134,7 @@ def test_upload_one_pdf_positive(client_with_emulator):
   with mock.patch("routes.upload_file.Logger"):
     with mock.patch(
         "routes.upload_file.create_document", return_value=mock_uid):
-      with mock.patch("routes.upload_file.publish_document"):
+      with mock.patch("routes.upload_file.publish_document_async"):
         response = client_with_emulator.post(
             f"{api_url}upload_files"
             f"?context=arkansas&case_id=test123",
@@ -147,7 +151,7 @@ def test_upload_files_not_pdf_file(client_with_emulator):
 
   with mock.patch("routes.upload_file.Logger"):
     with mock.patch("routes.upload_file.create_document"):
-      with mock.patch("routes.upload_file.publish_document"):
+      with mock.patch("routes.upload_file.publish_document_async"):
         response = client_with_emulator.post(
             f"{api_url}upload_files"
             f"?context=arkansas&case_id=test123",
@@ -165,7 +169,7 @@ def test_upload_one_pdf_without_case_id_positive(client_with_emulator):
   with mock.patch("routes.upload_file.Logger"):
     with mock.patch(
         "routes.upload_file.create_document", return_value=mock_uid):
-      with mock.patch("routes.upload_file.publish_document"):
+      with mock.patch("routes.upload_file.publish_document_async"):
         response = client_with_emulator.post(
             f"{api_url}upload_files"
             f"?context=arkansas",
@@ -186,7 +190,7 @@ def test_upload_multiple_pdf_without_case_id_positive(client_with_emulator):
   with mock.patch("routes.upload_file.Logger"):
     with mock.patch(
         "routes.upload_file.create_document", return_value=mock_uid):
-      with mock.patch("routes.upload_file.publish_document"):
+      with mock.patch("routes.upload_file.publish_document_async"):
         response = client_with_emulator.post(
             f"{api_url}upload_files"
             f"?context=arkansas",
@@ -207,7 +211,7 @@ def test_upload_multiple_pdf_with_case_id_positive(client_with_emulator):
   with mock.patch("routes.upload_file.Logger"):
     with mock.patch(
         "routes.upload_file.create_document", return_value=mock_uid):
-      with mock.patch("routes.upload_file.publish_document"):
+      with mock.patch("routes.upload_file.publish_document_async"):
         response = client_with_emulator.post(
             f"{api_url}upload_files"
             f"?context=arkansas&case_id=test123",
@@ -228,9 +232,10 @@ def test_upload_multiple_pdf_negative(client_with_emulator):
   with mock.patch("routes.upload_file.Logger"):
     with mock.patch(
         "routes.upload_file.create_document", return_value=mock_uid):
-      with mock.patch("routes.upload_file.publish_document"):
+      with mock.patch("routes.upload_file.publish_document_async"):
         with mock.patch(
-            "routes.upload_file.ug.upload_file", return_value=STATUS_ERROR):
+            "routes.upload_file.ug.upload_file",
+            return_value={"status": STATUS_ERROR}):
           response = client_with_emulator.post(
               f"{api_url}upload_files"
               f"?context=arkansas&case_id=test123",
@@ -238,3 +243,165 @@ def test_upload_multiple_pdf_negative(client_with_emulator):
               data=payload)
           print(response.text)
   assert response.status_code == 500
+
+
+def test_upload_multiple_pdf_partial_failure(client_with_emulator):
+  payload = {}
+  mock_uid = creat_mock_data()
+  files = [("files", ("Arkansa-claim-2.pdf", open(TESTDATA_FILENAME2,
+                                                  "rb"), "application/pdf")),
+           ("files", ("Arkansas-form-1.pdf", open(TESTDATA_FILENAME3,
+                                                  "rb"), "application/pdf"))]
+
+  with mock.patch("routes.upload_file.Logger"):
+    with mock.patch(
+        "routes.upload_file.create_document", return_value=mock_uid):
+      with mock.patch("routes.upload_file.publish_document_async"):
+        with mock.patch(
+            "routes.upload_file.ug.upload_file",
+            side_effect=[{
+                "status": STATUS_SUCCESS,
+                "size": 10,
+                "sha256": "abc"
+            }, {
+                "status": STATUS_ERROR
+            }]):
+          response = client_with_emulator.post(
+              f"{api_url}upload_files"
+              f"?context=arkansas&case_id=test123",
+              files=files,
+              data=payload)
+          print(response.text)
+  assert response.status_code == 200
+  results = response.json()["results"]
+  assert len(results) == 2
+  assert sorted(result["status"] for result in results) == sorted(
+      [STATUS_SUCCESS, STATUS_ERROR])
+  assert len(response.json()["configs"]) == 1
+
+
+async def fake_upload_stream(case_id, uid, filename, chunks):
+  size = 0
+  async for chunk in chunks:
+    size += len(chunk)
+  return {"status": STATUS_SUCCESS, "size": size, "sha256": "abc"}
+
+
+def test_upload_file_stream_positive(client_with_emulator):
+  mock_uid = creat_mock_data()
+  with open(TESTDATA_FILENAME2, "rb") as f:
+    content = f.read()
+  with mock.patch("routes.upload_file.Logger"):
+    with mock.patch(
+        "routes.upload_file.create_document", return_value=mock_uid):
+      with mock.patch("routes.upload_file.publish_document_async"):
+        with mock.patch(
+            "routes.upload_file.ug.upload_stream",
+            side_effect=fake_upload_stream):
+          with mock.patch(
+              "routes.upload_file.ug.open_blob_reader",
+              side_effect=lambda *args: io.BytesIO(content)):
+            with mock.patch("routes.upload_file.ug.delete_blob") as delete:
+              response = client_with_emulator.post(
+                  f"{api_url}upload_file_stream"
+                  f"?context=arkansas&case_id=test123"
+                  f"&filename=Arkansas-form-1.pdf",
+                  data=content,
+                  headers={"Content-Type": "application/pdf"})
+              print(response.text)
+  assert response.status_code == 200
+  assert not delete.called
+  assert response.json()["results"][0]["size"] == len(content)
+  assert response.json()["results"][0]["pdf_metadata"]["valid"]
+
+
+def test_upload_file_stream_invalid_pdf(client_with_emulator):
+  mock_uid = creat_mock_data()
+  content = b"%PDF-1.4 truncated"
+  with mock.patch("routes.upload_file.Logger"):
+    with mock.patch(
+        "routes.upload_file.create_document", return_value=mock_uid):
+      with mock.patch(
+          "routes.upload_file.publish_document_async") as publish:
+        with mock.patch(
+            "routes.upload_file.ug.upload_stream",
+            side_effect=fake_upload_stream):
+          with mock.patch(
+              "routes.upload_file.ug.open_blob_reader",
+              side_effect=lambda *args: io.BytesIO(content)):
+            with mock.patch("routes.upload_file.ug.delete_blob") as delete:
+              response = client_with_emulator.post(
+                  f"{api_url}upload_file_stream"
+                  f"?context=arkansas&case_id=test123"
+                  f"&filename=Arkansas-form-1.pdf",
+                  data=content)
+  assert response.status_code == 500
+  assert not publish.called
+  delete.assert_called_once_with("test123", mock_uid, "Arkansas-form-1.pdf")
+  document = Document.find_by_uid(mock_uid)
+  assert document.pdf_metadata["valid"] is False
+  assert document.error_detail.startswith("PDF could not be read")
+
+
+def test_upload_file_stream_not_pdf_file(client_with_emulator):
+  with mock.patch("routes.upload_file.Logger"):
+    response = client_with_emulator.post(
+        f"{api_url}upload_file_stream"
+        f"?context=arkansas&filename=arkansas-driver-form-5.png",
+        data=b"not a pdf")
+  assert response.status_code == 422
+
+
+def test_upload_json_bulk_positive(client_with_emulator):
+  record = {
+      "name": "Jon",
+      "employer_name": "Quantiphi",
+      "employer_phone_no": "9282112222",
+      "context": "Callifornia",
+      "dob": "7 Feb 1997",
+      "document_type": "application_form",
+      "document_class": "unemployment",
+      "ssn": "1234567",
+      "phone_no": "9730388333",
+      "application_apply_date": "2022/03/16",
+      "mailing_address": "Arizona USA",
+      "mailing_city": "Phoniex",
+      "mailing_zip": "123-33-22",
+      "residential_address": "Phoniex , USA",
+      "work_end_date": "2022/03",
+      "sex": "Female"
+  }
+  content = "\n".join([json.dumps(record), "{not json", json.dumps(record)])
+  with mock.patch("routes.upload_file.Logger"):
+    with mock.patch("routes.upload_file.ug") as ug:
+      ug.upload_ndjson_file.return_value = "gs://bucket/part-00001.ndjson"
+      response = client_with_emulator.post(
+          f"{api_url}upload_json_bulk", data=content)
+      print(response.text)
+  assert response.status_code == 200
+  assert response.json()["lines_read"] == 3
+  assert response.json()["documents_created"] == 2
+  assert response.json()["errors"][0]["line"] == 2
+  import_id = response.json()["import_id"]
+  response = client_with_emulator.get(f"{api_url}upload_json_bulk/{import_id}")
+  assert response.json()["data"]["status"] == STATUS_SUCCESS
+  assert response.json()["data"]["error_count"] == 1
+
+
+
+def test_read_ndjson_lines_too_long():
+  """Lines over the limit are errors, whole in a chunk or split across"""
+
+  async def read(chunks):
+
+    async def stream():
+      for chunk in chunks:
+        yield chunk
+
+    return [(number, line if isinstance(line, bytes) else str(line))
+            async for number, line in read_ndjson_lines(stream())]
+
+  with mock.patch("routes.upload_file.BULK_IMPORT_MAX_LINE_BYTES", 4):
+    lines = asyncio.run(read([b"ab\nabcdefgh\nc", b"d\nabc", b"defg\nx"]))
+  assert lines == [(1, b"ab"), (2, "Line is too long"), (3, b"cd"),
+                   (4, "Line is too long"), (5, b"x")]
@@ -0,0 +1,111 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Pre-flight inspection of the uploaded PDFs, before they are published
+for processing"""
+
+from typing import Dict, Optional
+from PyPDF2 import PdfFileReader
+from common.utils.logging_handler import Logger
+from config import PDF_MAX_PAGES, PDF_MAX_SIZE_BYTES, PDF_TEXT_LAYER_PAGES
+
+# pylint: disable = broad-except
+
+PDF_HEADER = b"%PDF-"
+# The header may follow some garbage, readers look in the first KiB
+HEADER_SEARCH_BYTES = 1024
+
+
+def _resolve(obj):
+  return obj.getObject() if obj is not None else None
+
+
+def _first_pages(pages, limit):
+  """Yields the resources of the first pages of the page tree, only the
+  nodes on the way to these pages are read"""
+  stack = [(pages, _resolve(pages.get("/Resources")))]
+  while stack and limit > 0:
+    node, resources = stack.pop()
+    resources = _resolve(node.get("/Resources")) or resources
+    if node.get("/Type") == "/Page" or "/Kids" not in node:
+      limit -= 1
+      yield resources
+      continue
+    kids = _resolve(node["/Kids"])
+    stack.extend((_resolve(kid), resources) for kid in reversed(kids))
+
+
+def _has_fonts(resources):
+  fonts = _resolve(resources.get("/Font")) if resources else None
+  return bool(fonts)
+
+
+def inspect_pdf(stream, size: int) -> Dict:
+  """Reads the trailer, the cross reference table and the page tree of a
+  PDF. The stream is only read where these objects are, so a reader doing
+  ranged reads does not download the whole file.
+
+  Args:
+    stream: seekable binary file of the PDF
+    size (int): size of the file in bytes
+  Returns:
+    dict with valid, encrypted, page_count, has_text_layer, size and the
+    error when the file could not be read. has_text_layer is True when
+    one of the first PDF_TEXT_LAYER_PAGES pages uses fonts, scanned
+    documents only have images.
+  """
+  metadata = {
+      "valid": False,
+      "encrypted": None,
+      "page_count": None,
+      "has_text_layer": None,
+      "size": size,
+      "error": None
+  }
+  try:
+    stream.seek(0)
+    if PDF_HEADER not in stream.read(HEADER_SEARCH_BYTES):
+      metadata["error"] = "Not a PDF file"
+      return metadata
+    reader = PdfFileReader(stream, strict=False)
+    metadata["encrypted"] = bool(reader.isEncrypted)
+    # Files with only an owner password open with an empty user password
+    if reader.isEncrypted and not reader.decrypt(""):
+      metadata["error"] = "PDF is password protected"
+      return metadata
+    pages = reader.trailer["/Root"]["/Pages"]
+    metadata["page_count"] = int(pages.get("/Count", 0))
+    metadata["has_text_layer"] = any(
+        _has_fonts(resources)
+        for resources in _first_pages(pages, PDF_TEXT_LAYER_PAGES))
+    metadata["valid"] = True
+  except Exception as e:
+    Logger.error(f"Error in inspecting PDF: {e}")
+    metadata["error"] = f"PDF could not be read: {e}"
+  return metadata
+
+
+def preflight_error(metadata: Dict) -> Optional[str]:
+  """Reason the inspected PDF is rejected, None when it can be processed"""
+  if metadata["size"] is not None and metadata["size"] > PDF_MAX_SIZE_BYTES:
+    return f"PDF is larger than {PDF_MAX_SIZE_BYTES} bytes"
+  if not metadata["valid"]:
+    return metadata["error"]
+  if metadata["page_count"] == 0:
+    return "PDF has no pages"
+  if metadata["page_count"] > PDF_MAX_PAGES:
+    return f"PDF has more than {PDF_MAX_PAGES} pages"
+  return None
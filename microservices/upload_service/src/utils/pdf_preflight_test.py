@@ -0,0 +1,89 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the PDF pre-flight inspection
+"""
+import io
+import os
+from unittest import mock
+from PyPDF2 import PdfFileWriter
+from PyPDF2.generic import DictionaryObject, NameObject
+from utils.pdf_preflight import inspect_pdf, preflight_error
+
+TESTDATA_FILENAME = os.path.join(
+    os.path.dirname(__file__), "..", "testing", "Arkansas-form-1.pdf")
+
+
+def make_pdf(pages=1, fonts=False, password=None):
+  writer = PdfFileWriter()
+  for _ in range(pages):
+    page = writer.addBlankPage(612, 792)
+    if fonts:
+      font = DictionaryObject({
+          NameObject("/Type"): NameObject("/Font"),
+          NameObject("/Subtype"): NameObject("/Type1"),
+          NameObject("/BaseFont"): NameObject("/Helvetica")
+      })
+      page[NameObject("/Resources")] = DictionaryObject({
+          NameObject("/Font"):
+              DictionaryObject({NameObject("/F1"): font})
+      })
+  if password:
+    writer.encrypt(password)
+  stream = io.BytesIO()
+  writer.write(stream)
+  return stream
+
+
+def inspect(stream):
+  return inspect_pdf(stream, len(stream.getvalue()))
+
+
+def test_scanned_pdf():
+  with open(TESTDATA_FILENAME, "rb") as f:
+    metadata = inspect(io.BytesIO(f.read()))
+  assert metadata["valid"]
+  assert not metadata["encrypted"]
+  assert metadata["page_count"] >= 1
+  assert metadata["has_text_layer"] is False
+  assert preflight_error(metadata) is None
+
+
+def test_text_layer_and_page_count():
+  metadata = inspect(make_pdf(pages=3, fonts=True))
+  assert metadata["page_count"] == 3
+  assert metadata["has_text_layer"] is True
+
+
+def test_password_protected_pdf_rejected():
+  metadata = inspect(make_pdf(password="secret"))
+  assert metadata["encrypted"] is True
+  assert not metadata["valid"]
+  assert preflight_error(metadata) == "PDF is password protected"
+
+
+def test_not_a_pdf_rejected():
+  metadata = inspect(io.BytesIO(b"not a pdf"))
+  assert preflight_error(metadata) == "Not a PDF file"
+
+
+def test_limits():
+  metadata = inspect(make_pdf(pages=3))
+  with mock.patch("utils.pdf_preflight.PDF_MAX_PAGES", 2):
+    assert preflight_error(metadata) == "PDF has more than 2 pages"
+  with mock.patch("utils.pdf_preflight.PDF_MAX_SIZE_BYTES", 10):
+    assert preflight_error(metadata) == "PDF is larger than 10 bytes"
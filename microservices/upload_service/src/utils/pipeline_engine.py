@@ -0,0 +1,642 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Bounded worker pool running the pipeline for accepted process tasks"""
+
+import collections
+import copy
+import datetime
+import socket
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+import fireo
+from common.models import PipelineTask
+from common.utils.logging_handler import Logger
+from common.config import STATUS_PENDING, STATUS_IN_PROGRESS, \
+  STATUS_ERROR, PRIORITIES, PRIORITY_INTERACTIVE, \
+  PRIORITY_NORMAL, PRIORITY_BULK
+from config import PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE, \
+  PIPELINE_TASK_STORE, PIPELINE_TASK_LEASE_SECONDS, \
+  PIPELINE_TASK_MAX_ATTEMPTS, PIPELINE_RESUME_INTERVAL_SECONDS, \
+  PIPELINE_INTERACTIVE_WORKERS, PIPELINE_INTERACTIVE_QUEUE_SIZE, \
+  PIPELINE_BULK_MAX_RUNNING, PIPELINE_BULK_QUEUE_SIZE, \
+  PIPELINE_STARVATION_SECONDS, PIPELINE_FAILED_TASK_RETENTION_SECONDS
+
+# pylint: disable = broad-except
+
+
+class EngineBusy(Exception):
+  """Raised when the lane of a task and its queue are full"""
+
+
+def utc_now():
+  return datetime.datetime.now(datetime.timezone.utc)
+
+
+def claim_state(task: Dict, worker_id: str, now: datetime.datetime,
+                lease_seconds: int, max_attempts: int,
+                retention_seconds: int) -> Optional[Dict]:
+  """Returns the fields to update to claim the task for a worker, or None
+  when the task is finished or leased by another worker"""
+  status = task.get("status")
+  if status not in (STATUS_PENDING, STATUS_IN_PROGRESS):
+    return None
+  available_at = task.get("available_at")
+  if available_at is None or (available_at > now and
+                              task.get("worker") != worker_id):
+    return None
+  attempts = task.get("attempts") or 0
+  if attempts >= max_attempts:
+    Logger.error(f"Pipeline task {task.get('task_id')} given up after "
+                 f"{attempts} attempts")
+    return failed_state(f"Gave up after {attempts} attempts", now,
+                        retention_seconds)
+  return {
+      "status": STATUS_IN_PROGRESS,
+      "worker": worker_id,
+      "attempts": attempts + 1,
+      "available_at": now + datetime.timedelta(seconds=lease_seconds),
+      "updated_timestamp": now
+  }
+
+
+def renew_state(task: Dict, worker_id: str, now: datetime.datetime,
+                lease_seconds: int) -> Optional[Dict]:
+  """Returns the fields to update to extend the lease of the worker on the
+  task, or None when the task is finished or leased by another worker"""
+  if task.get("status") not in (STATUS_PENDING, STATUS_IN_PROGRESS):
+    return None
+  if task.get("worker") != worker_id:
+    return None
+  return {
+      "available_at": now + datetime.timedelta(seconds=lease_seconds),
+      "updated_timestamp": now
+  }
+
+
+def failed_state(error: str, now: datetime.datetime,
+                 retention_seconds: int) -> Dict:
+  """Returns the fields of a failed task, kept retention_seconds"""
+  return {
+      "status": STATUS_ERROR,
+      "error": error,
+      "available_at": None,
+      "expire_at": now + datetime.timedelta(seconds=retention_seconds),
+      "updated_timestamp": now
+  }
+
+
+def lease_start(worker_id: Optional[str], now: datetime.datetime,
+                lease_seconds: int) -> datetime.datetime:
+  """Returns when a new task may be claimed by another worker, at once
+  unless it is leased to the worker queuing it"""
+  if worker_id is None:
+    return now
+  return now + datetime.timedelta(seconds=lease_seconds)
+
+
+class InMemoryTaskStore:
+  """Task store kept in the process, for local runs and tests"""
+
+  def __init__(self,
+               retention_seconds: int = PIPELINE_FAILED_TASK_RETENTION_SECONDS):
+    self.tasks = {}
+    self.lock = threading.Lock()
+    self.retention_seconds = retention_seconds
+
+  def create(self,
+             configs: List[Dict],
+             is_hitl: bool,
+             is_reassign: bool,
+             priority: str = PRIORITY_NORMAL,
+             worker_id: Optional[str] = None,
+             lease_seconds: int = 0) -> str:
+    task_id = uuid.uuid4().hex
+    now = utc_now()
+    with self.lock:
+      self.tasks[task_id] = {
+          "task_id": task_id,
+          "configs": copy.deepcopy(configs),
+          "is_hitl": is_hitl,
+          "is_reassign": is_reassign,
+          "priority": priority,
+          "status": STATUS_PENDING,
+          "attempts": 0,
+          "worker": worker_id,
+          "error": None,
+          "available_at": lease_start(worker_id, now, lease_seconds),
+          "expire_at": None,
+          "created_timestamp": now,
+          "updated_timestamp": now
+      }
+    return task_id
+
+  def get(self, task_id: str) -> Optional[Dict]:
+    with self.lock:
+      task = self.tasks.get(task_id)
+      return copy.deepcopy(task) if task else None
+
+  def claim(self, task_id: str, worker_id: str, lease_seconds: int,
+            max_attempts: int) -> Optional[Dict]:
+    with self.lock:
+      task = self.tasks.get(task_id)
+      if task is None:
+        return None
+      changes = claim_state(task, worker_id, utc_now(), lease_seconds,
+                            max_attempts, self.retention_seconds)
+      if changes is None:
+        return None
+      task.update(changes)
+      if task["status"] != STATUS_IN_PROGRESS:
+        return None
+      return copy.deepcopy(task)
+
+  def renew(self, task_id: str, worker_id: str, lease_seconds: int) -> bool:
+    with self.lock:
+      task = self.tasks.get(task_id)
+      if task is None:
+        return False
+      changes = renew_state(task, worker_id, utc_now(), lease_seconds)
+      if changes is None:
+        return False
+      task.update(changes)
+      return True
+
+  def delete(self, task_id: str):
+    with self.lock:
+      self.tasks.pop(task_id, None)
+
+  def fail(self, task_id: str, error: str):
+    with self.lock:
+      self.tasks[task_id].update(
+          failed_state(error, utc_now(), self.retention_seconds))
+
+  def resumable(self, limit: int) -> List[Tuple[str, str]]:
+    now = utc_now()
+    with self.lock:
+      # Firestore drops the expired tasks with its TTL policy
+      for task_id in [
+          task_id for task_id, task in self.tasks.items()
+          if task["expire_at"] is not None and task["expire_at"] <= now
+      ]:
+        del self.tasks[task_id]
+      available = [
+          task for task in self.tasks.values()
+          if task["available_at"] is not None and task["available_at"] <= now
+      ]
+    available.sort(key=lambda task: task["available_at"])
+    return [(task["task_id"], task["priority"]) for task in available[:limit]]
+
+
+class FirestoreTaskStore:
+  """Task store persisted in the pipeline_task collection. Failed tasks
+  are removed by the TTL policy on their expire_at field."""
+
+  def __init__(self,
+               retention_seconds: int = PIPELINE_FAILED_TASK_RETENTION_SECONDS):
+    self.retention_seconds = retention_seconds
+
+  def create(self,
+             configs: List[Dict],
+             is_hitl: bool,
+             is_reassign: bool,
+             priority: str = PRIORITY_NORMAL,
+             worker_id: Optional[str] = None,
+             lease_seconds: int = 0) -> str:
+    now = utc_now()
+    task = PipelineTask()
+    task.task_id = uuid.uuid4().hex
+    task.configs = configs
+    task.is_hitl = is_hitl
+    task.is_reassign = is_reassign
+    task.priority = priority
+    task.status = STATUS_PENDING
+    task.attempts = 0
+    task.worker = worker_id
+    task.available_at = lease_start(worker_id, now, lease_seconds)
+    task.updated_timestamp = now
+    task.save()
+    return task.task_id
+
+  def get(self, task_id: str) -> Optional[Dict]:
+    task = PipelineTask.find_by_id(task_id)
+    return task.to_dict() if task else None
+
+  def claim(self, task_id: str, worker_id: str, lease_seconds: int,
+            max_attempts: int) -> Optional[Dict]:
+    key = fireo.utils.utils.generateKeyFromId(PipelineTask, task_id)
+    return claim_task(fireo.transaction(), key, worker_id, lease_seconds,
+                      max_attempts, self.retention_seconds)
+
+  def renew(self, task_id: str, worker_id: str, lease_seconds: int) -> bool:
+    key = fireo.utils.utils.generateKeyFromId(PipelineTask, task_id)
+    return renew_task(fireo.transaction(), key, worker_id, lease_seconds)
+
+  def delete(self, task_id: str):
+    PipelineTask.delete_by_id(task_id)
+
+  def fail(self, task_id: str, error: str):
+    task = PipelineTask.find_by_id(task_id)
+    for field, value in failed_state(error, utc_now(),
+                                     self.retention_seconds).items():
+      setattr(task, field, value)
+    task.update()
+
+  def resumable(self, limit: int) -> List[Tuple[str, str]]:
+    tasks = PipelineTask.collection.filter(
+        "available_at", "<=", utc_now()).order("available_at").fetch(limit)
+    # Tasks persisted before the priority lanes run in the normal lane
+    return [(task.task_id, task.priority or PRIORITY_NORMAL) for task in tasks]
+
+
+@fireo.transactional
+def claim_task(transaction, key, worker_id, lease_seconds, max_attempts,
+               retention_seconds):
+  """Claims the task in a transaction so a task resumed by several pods
+  runs on only one of them"""
+  task = PipelineTask.collection.get(key, transaction=transaction)
+  if task is None:
+    return None
+  changes = claim_state(task.to_dict(), worker_id, utc_now(), lease_seconds,
+                        max_attempts, retention_seconds)
+  if changes is None:
+    return None
+  for field, value in changes.items():
+    setattr(task, field, value)
+  task.update(transaction=transaction)
+  if task.status != STATUS_IN_PROGRESS:
+    return None
+  return task.to_dict()
+
+
+@fireo.transactional
+def renew_task(transaction, key, worker_id, lease_seconds):
+  """Extends the lease in a transaction so a lease that expired and was
+  claimed by another worker stays with it"""
+  task = PipelineTask.collection.get(key, transaction=transaction)
+  if task is None:
+    return False
+  changes = renew_state(task.to_dict(), worker_id, utc_now(), lease_seconds)
+  if changes is None:
+    return False
+  for field, value in changes.items():
+    setattr(task, field, value)
+  task.update(transaction=transaction)
+  return True
+
+
+class LaneScheduler:
+  """Tasks waiting for a worker, one FIFO per priority lane.
+
+  A worker takes the head of the highest lane that is below its limit of
+  running pipelines. The head of a lane that waited starvation_seconds or
+  more is taken first whatever its lane, the oldest of them when several
+  waited that long.
+
+  Args:
+    max_running: pipelines each lane may run at the same time
+    starvation_seconds: wait after which a task jumps the higher lanes
+  """
+
+  def __init__(self, max_running: Dict[str, int], starvation_seconds: float,
+               clock: Callable[[], float] = time.monotonic):
+    self.max_running = max_running
+    self.starvation_seconds = starvation_seconds
+    self.clock = clock
+    self.lanes = {priority: collections.deque() for priority in PRIORITIES}
+    self.running = {priority: 0 for priority in PRIORITIES}
+    self.unfinished = 0
+    self.closed = False
+    self.condition = threading.Condition()
+
+  def put(self, task_id: str, priority: str):
+    with self.condition:
+      self.lanes[priority].append((self.clock(), task_id))
+      self.unfinished += 1
+      self.condition.notify_all()
+
+  def get(self, priorities: List[str]) -> Optional[Tuple[str, str]]:
+    """Blocks until a task of one of the lanes can run and returns it with
+    its lane, or returns None once closed and these lanes are empty"""
+    with self.condition:
+      while True:
+        priority = self._pick(priorities)
+        if priority is not None:
+          _, task_id = self.lanes[priority].popleft()
+          self.running[priority] += 1
+          return task_id, priority
+        if self.closed and not any(self.lanes[p] for p in priorities):
+          return None
+        self.condition.wait()
+
+  def task_done(self, priority: str):
+    with self.condition:
+      self.running[priority] -= 1
+      self.unfinished -= 1
+      self.condition.notify_all()
+
+  def join(self):
+    """Blocks until every task put is done"""
+    with self.condition:
+      while self.unfinished:
+        self.condition.wait()
+
+  def empty(self) -> bool:
+    with self.condition:
+      return not any(self.lanes.values())
+
+  def close(self):
+    """Wakes up the workers so they leave once the lanes drained"""
+    with self.condition:
+      self.closed = True
+      self.condition.notify_all()
+
+  def reopen(self):
+    with self.condition:
+      self.closed = False
+
+  def _pick(self, priorities: List[str]) -> Optional[str]:
+    ready = [
+        priority for priority in PRIORITIES
+        if priority in priorities and self.lanes[priority] and
+        self.running[priority] < self.max_running[priority]
+    ]
+    if not ready:
+      return None
+    now = self.clock()
+    starved = [
+        priority for priority in ready
+        if now - self.lanes[priority][0][0] >= self.starvation_seconds
+    ]
+    if starved:
+      return min(starved, key=lambda priority: self.lanes[priority][0][0])
+    return ready[0]
+
+
+class PipelineEngine:
+  """Runs pipelines on a fixed number of worker threads fed by bounded
+  priority lanes. Every accepted task is persisted in the store first,
+  leased to this engine while it waits and runs, and deleted once done or
+  marked as error when it failed. The leases of the tasks held are renewed
+  every third of lease_seconds, so the tasks lost with a pod are resumed
+  by the periodic resume pass of another once their lease expired.
+
+  Interactive tasks have interactive_workers of their own and take the
+  shared workers before the other lanes, bulk tasks never hold more than
+  bulk_max_running shared workers. Each lane accepts its running limit
+  plus its queue size of tasks, so a full bulk lane does not reject
+  interactive or normal tasks.
+
+  Args:
+    handler: called with (payload, is_hitl, is_reassign) for each task
+    store: InMemoryTaskStore or FirestoreTaskStore
+    workers: number of shared workers, the pipelines of the normal lane
+      running at the same time
+    queue_size: number of accepted normal tasks waiting for a worker
+    interactive_workers: workers only running interactive tasks
+    interactive_queue_size: accepted interactive tasks waiting
+    bulk_max_running: bulk pipelines running at the same time
+    bulk_queue_size: accepted bulk tasks waiting
+    starvation_seconds: wait after which a task jumps the higher lanes
+  """
+
+  def __init__(self,
+               handler: Callable,
+               store,
+               workers: int = PIPELINE_WORKERS,
+               queue_size: int = PIPELINE_QUEUE_SIZE,
+               lease_seconds: int = PIPELINE_TASK_LEASE_SECONDS,
+               max_attempts: int = PIPELINE_TASK_MAX_ATTEMPTS,
+               resume_interval: int = PIPELINE_RESUME_INTERVAL_SECONDS,
+               interactive_workers: int = PIPELINE_INTERACTIVE_WORKERS,
+               interactive_queue_size: int = PIPELINE_INTERACTIVE_QUEUE_SIZE,
+               bulk_max_running: int = PIPELINE_BULK_MAX_RUNNING,
+               bulk_queue_size: int = PIPELINE_BULK_QUEUE_SIZE,
+               starvation_seconds: float = PIPELINE_STARVATION_SECONDS):
+    self.handler = handler
+    self.store = store
+    self.workers = workers
+    self.interactive_workers = interactive_workers
+    self.lease_seconds = lease_seconds
+    self.max_attempts = max_attempts
+    self.resume_interval = resume_interval
+    self.worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+    max_running = {
+        PRIORITY_INTERACTIVE: interactive_workers + workers,
+        PRIORITY_NORMAL: workers,
+        PRIORITY_BULK: min(bulk_max_running, workers)
+    }
+    queue_sizes = {
+        PRIORITY_INTERACTIVE: interactive_queue_size,
+        PRIORITY_NORMAL: queue_size,
+        PRIORITY_BULK: bulk_queue_size
+    }
+    # A slot of the lane is held from acceptance until the pipeline
+    # finishes
+    self.slots = {
+        priority: threading.BoundedSemaphore(max_running[priority] +
+                                             queue_sizes[priority])
+        for priority in PRIORITIES
+    }
+    self.scheduler = LaneScheduler(max_running, starvation_seconds)
+    self.threads = []
+    self.lock = threading.Lock()
+    self.stopped = threading.Event()
+    # Tasks queued or run by this engine, whose leases are renewed
+    self.held = set()
+    self.held_lock = threading.Lock()
+
+  def start(self):
+    """Starts the workers, the renewal of the leases and, when
+    resume_interval is set, the periodic resume of the tasks left in the
+    store"""
+    with self.lock:
+      if self.threads:
+        return
+      self.stopped.clear()
+      self.scheduler.reopen()
+      for i in range(self.interactive_workers):
+        thread = threading.Thread(
+            target=self._work,
+            args=([PRIORITY_INTERACTIVE],),
+            name=f"pipeline-interactive-worker-{i}",
+            daemon=True)
+        thread.start()
+        self.threads.append(thread)
+      for i in range(self.workers):
+        thread = threading.Thread(
+            target=self._work,
+            args=(PRIORITIES,),
+            name=f"pipeline-worker-{i}",
+            daemon=True)
+        thread.start()
+        self.threads.append(thread)
+      if self.lease_seconds:
+        thread = threading.Thread(
+            target=self._renew_periodically,
+            name="pipeline-renew",
+            daemon=True)
+        thread.start()
+        self.threads.append(thread)
+      if self.resume_interval:
+        thread = threading.Thread(
+            target=self._resume_periodically,
+            name="pipeline-resume",
+            daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+  def stop(self):
+    """Stops the workers once the queued tasks are done"""
+    self.stopped.set()
+    self.scheduler.close()
+    for thread in self.threads:
+      thread.join()
+    self.threads = []
+
+  def join(self):
+    """Blocks until every queued task is done"""
+    self.scheduler.join()
+
+  def submit(self, configs: List[Dict], is_hitl: bool = False,
+             is_reassign: bool = False,
+             priority: str = PRIORITY_NORMAL) -> str:
+    """Persists and queues a task in the lane of its priority
+
+    Raises:
+      EngineBusy: when the lane and its queue are full
+    """
+    if not self.slots[priority].acquire(blocking=False):
+      raise EngineBusy(f"Pipeline queue of the {priority} lane is full")
+    try:
+      self.start()
+      task_id = self.store.create(configs, is_hitl, is_reassign, priority,
+                                  self.worker_id, self.lease_seconds)
+    except Exception:
+      self.slots[priority].release()
+      raise
+    with self.held_lock:
+      self.held.add(task_id)
+    self.scheduler.put(task_id, priority)
+    return task_id
+
+  def resume(self) -> int:
+    """Queues the tasks whose lease expired, pending or in progress, as
+    many as there are free slots in their lanes. Returns the number of
+    tasks queued."""
+    try:
+      tasks = self.store.resumable(self.workers)
+    except Exception:
+      Logger.error(traceback.format_exc().replace("\n", " "))
+      tasks = []
+    # Tasks are claimed when a worker picks them up, a task another pod
+    # resumes at the same time is skipped by the worker that loses. A task
+    # whose lane is full is left for the next pass.
+    resumed = 0
+    for task_id, priority in tasks:
+      if not self.slots[priority].acquire(blocking=False):
+        continue
+      self.scheduler.put(task_id, priority)
+      resumed += 1
+    if resumed:
+      self.start()
+      Logger.info(f"Resumed {resumed} pipeline tasks")
+    return resumed
+
+  def _resume_periodically(self):
+    while not self.stopped.is_set():
+      # Pending tasks of this pod are still in the lanes, only look for
+      # lost tasks once they drained
+      if self.scheduler.empty():
+        self.resume()
+      self.stopped.wait(self.resume_interval)
+
+  def renew(self) -> int:
+    """Extends the leases of the tasks held, returns the number renewed"""
+    with self.held_lock:
+      task_ids = list(self.held)
+    renewed = 0
+    for task_id in task_ids:
+      try:
+        if self.store.renew(task_id, self.worker_id, self.lease_seconds):
+          renewed += 1
+        else:
+          Logger.warning(f"Lost the lease of pipeline task {task_id}")
+      except Exception:
+        Logger.error(traceback.format_exc().replace("\n", " "))
+    return renewed
+
+  def _renew_periodically(self):
+    while not self.stopped.wait(self.lease_seconds / 3):
+      self.renew()
+
+  def _work(self, priorities: List[str]):
+    while True:
+      task = self.scheduler.get(priorities)
+      if task is None:
+        return
+      task_id, priority = task
+      try:
+        self._run(task_id)
+      finally:
+        with self.held_lock:
+          self.held.discard(task_id)
+        self.slots[priority].release()
+        self.scheduler.task_done(priority)
+
+  def _run(self, task_id: str):
+    try:
+      task = self.store.claim(task_id, self.worker_id, self.lease_seconds,
+                              self.max_attempts)
+    except Exception:
+      Logger.error(traceback.format_exc().replace("\n", " "))
+      return
+    if task is None:
+      return
+    with self.held_lock:
+      self.held.add(task_id)
+    try:
+      self.handler({"configs": task["configs"]}, task["is_hitl"],
+                   task["is_reassign"])
+      self.store.delete(task_id)
+    except Exception as e:
+      Logger.error(f"Pipeline task {task_id} failed: {e}")
+      self.store.fail(task_id, str(e))
+
+
+_engine = None
+
+
+def get_pipeline_engine() -> PipelineEngine:
+  """Returns the engine of the process, created on first use"""
+  global _engine
+  if _engine is None:
+    # pylint: disable = import-outside-toplevel
+    from utils.process_task_helpers import run_pipeline
+    store = InMemoryTaskStore() if PIPELINE_TASK_STORE == "memory" \
+      else FirestoreTaskStore()
+    _engine = PipelineEngine(run_pipeline, store)
+  return _engine
+
+
+def set_pipeline_engine(engine: Optional[PipelineEngine]):
+  """Replaces the engine of the process, used by the tests"""
+  global _engine
+  _engine = engine
@@ -0,0 +1,237 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the pipeline engine with the in memory task store
+"""
+import datetime
+import threading
+from unittest import mock
+import pytest
+from utils.pipeline_engine import PipelineEngine, InMemoryTaskStore, \
+  EngineBusy, LaneScheduler
+from common.config import STATUS_PENDING, STATUS_IN_PROGRESS, \
+  STATUS_ERROR, PRIORITIES, PRIORITY_INTERACTIVE, \
+  PRIORITY_NORMAL, PRIORITY_BULK
+
+CONFIGS = [{"case_id": "case_1", "uid": "uid_1", "context": "arkansas"}]
+
+
+def make_engine(handler, **kwargs):
+  kwargs.setdefault("resume_interval", 0)
+  return PipelineEngine(handler, InMemoryTaskStore(), **kwargs)
+
+
+def past_and_future():
+  past = datetime.datetime.now(datetime.timezone.utc) - \
+    datetime.timedelta(seconds=1)
+  return past, past + datetime.timedelta(hours=1)
+
+
+def test_submit_runs_pipeline():
+  """A submitted task runs and is deleted once complete"""
+  handler = mock.Mock()
+  engine = make_engine(handler, workers=2, queue_size=2)
+  task_id = engine.submit(CONFIGS, is_hitl=True)
+  engine.join()
+  handler.assert_called_once_with({"configs": CONFIGS}, True, False)
+  assert engine.store.get(task_id) is None
+  assert not engine.held
+  engine.stop()
+
+
+def test_failed_pipeline_is_recorded():
+  """A pipeline that raises is marked as error until it expires"""
+  engine = PipelineEngine(
+      mock.Mock(side_effect=ValueError("boom")),
+      InMemoryTaskStore(retention_seconds=3600),
+      resume_interval=0)
+  task_id = engine.submit(CONFIGS)
+  engine.join()
+  task = engine.store.get(task_id)
+  assert task["status"] == STATUS_ERROR
+  assert task["error"] == "boom"
+  assert task["available_at"] is None
+  engine.store.tasks[task_id]["expire_at"] = past_and_future()[0]
+  assert engine.resume() == 0
+  assert engine.store.get(task_id) is None
+  engine.stop()
+
+
+def test_submit_rejected_when_full():
+  """Tasks beyond the workers and the queue are rejected"""
+  release = threading.Event()
+  engine = make_engine(
+      lambda *args: release.wait(5), workers=1, queue_size=1)
+  engine.submit(CONFIGS)
+  engine.submit(CONFIGS)
+  with pytest.raises(EngineBusy):
+    engine.submit(CONFIGS)
+  release.set()
+  engine.join()
+  engine.submit(CONFIGS)
+  engine.join()
+  engine.stop()
+
+
+def test_resume_expired_tasks():
+  """Tasks whose lease expired are resumed, pending or in progress, tasks
+  leased by a live worker are not"""
+  handler = mock.Mock()
+  engine = make_engine(handler, workers=4, queue_size=0)
+  store = engine.store
+  pending = store.create(CONFIGS, False, False, worker_id="lost",
+                         lease_seconds=3600)
+  expired = store.create(CONFIGS, False, True)
+  queued = store.create(CONFIGS, False, False, worker_id="other",
+                        lease_seconds=3600)
+  leased = store.create(CONFIGS, False, False)
+  past, future = past_and_future()
+  store.tasks[pending]["available_at"] = past
+  store.tasks[expired].update({
+      "status": STATUS_IN_PROGRESS,
+      "attempts": 1,
+      "available_at": past
+  })
+  store.tasks[leased].update({
+      "status": STATUS_IN_PROGRESS,
+      "worker": "other",
+      "attempts": 1,
+      "available_at": future
+  })
+
+  assert engine.resume() == 2
+  engine.join()
+  assert store.get(pending) is None
+  assert store.get(expired) is None
+  assert store.get(queued)["status"] == STATUS_PENDING
+  assert store.get(leased)["status"] == STATUS_IN_PROGRESS
+  assert handler.call_args_list == [
+      mock.call({"configs": CONFIGS}, False, False),
+      mock.call({"configs": CONFIGS}, False, True)
+  ]
+  engine.stop()
+
+
+def test_leases_renewed_while_running():
+  """The lease of a running task is extended, a lease taken over by
+  another worker is not"""
+  release = threading.Event()
+  started = threading.Event()
+
+  def handler(*_):
+    started.set()
+    release.wait(5)
+
+  engine = make_engine(handler, lease_seconds=60)
+  task_id = engine.submit(CONFIGS)
+  assert started.wait(5)
+  store = engine.store
+  past, _ = past_and_future()
+  store.tasks[task_id]["available_at"] = past
+  with mock.patch("utils.pipeline_engine.Logger") as logger:
+    assert engine.renew() == 1
+    assert store.get(task_id)["available_at"] > past
+    assert store.get(task_id)["worker"] == engine.worker_id
+    store.tasks[task_id]["worker"] = "other"
+    assert engine.renew() == 0
+    logger.warning.assert_called_once()
+  release.set()
+  engine.join()
+  assert not engine.held
+  engine.stop()
+
+
+def test_task_given_up_after_max_attempts():
+  """A task lost too many times is marked as error instead of rerun"""
+  handler = mock.Mock()
+  engine = make_engine(handler, max_attempts=2)
+  task_id = engine.store.create(CONFIGS, False, False)
+  engine.store.tasks[task_id]["attempts"] = 2
+  assert engine.store.get(task_id)["status"] == STATUS_PENDING
+  with mock.patch("utils.pipeline_engine.Logger"):
+    engine.resume()
+    engine.join()
+  handler.assert_not_called()
+  task = engine.store.get(task_id)
+  assert task["status"] == STATUS_ERROR
+  assert task["expire_at"] is not None
+  engine.stop()
+
+
+def test_interactive_lane_not_blocked_by_full_lanes():
+  """An interactive task runs on its own workers while the shared workers
+  are busy and the normal lane is full"""
+  release = threading.Event()
+  ran = threading.Event()
+
+  def handler(_, is_hitl, *__):
+    if is_hitl:
+      ran.set()
+    release.wait(5)
+
+  engine = make_engine(handler, workers=1, queue_size=0,
+                       interactive_workers=1)
+  engine.submit(CONFIGS)
+  with pytest.raises(EngineBusy):
+    engine.submit(CONFIGS)
+  task_id = engine.submit(CONFIGS, is_hitl=True,
+                          priority=PRIORITY_INTERACTIVE)
+  assert ran.wait(5)
+  assert engine.store.get(task_id)["priority"] == PRIORITY_INTERACTIVE
+  release.set()
+  engine.join()
+  engine.stop()
+
+
+def test_scheduler_picks_highest_lane():
+  """The highest lane goes first and bulk stays under its running limit"""
+  scheduler = LaneScheduler({
+      PRIORITY_INTERACTIVE: 2,
+      PRIORITY_NORMAL: 2,
+      PRIORITY_BULK: 1
+  }, starvation_seconds=60)
+  scheduler.put("bulk_1", PRIORITY_BULK)
+  scheduler.put("bulk_2", PRIORITY_BULK)
+  scheduler.put("normal", PRIORITY_NORMAL)
+  scheduler.put("interactive", PRIORITY_INTERACTIVE)
+  assert scheduler.get(PRIORITIES) == ("interactive", PRIORITY_INTERACTIVE)
+  assert scheduler.get(PRIORITIES) == ("normal", PRIORITY_NORMAL)
+  assert scheduler.get(PRIORITIES) == ("bulk_1", PRIORITY_BULK)
+  scheduler.close()
+  # bulk_2 waits for bulk_1 to finish
+  picked = []
+  thread = threading.Thread(
+      target=lambda: picked.append(scheduler.get(PRIORITIES)))
+  thread.start()
+  thread.join(0.1)
+  assert not picked
+  scheduler.task_done(PRIORITY_BULK)
+  thread.join(5)
+  assert picked == [("bulk_2", PRIORITY_BULK)]
+
+
+def test_scheduler_starvation():
+  """A task waiting past the starvation delay jumps the higher lanes"""
+  now = [0]
+  scheduler = LaneScheduler({priority: 1 for priority in PRIORITIES},
+                            starvation_seconds=10,
+                            clock=lambda: now[0])
+  scheduler.put("bulk", PRIORITY_BULK)
+  now[0] = 11
+  scheduler.put("interactive", PRIORITY_INTERACTIVE)
+  assert scheduler.get(PRIORITIES) == ("bulk", PRIORITY_BULK)
+  assert scheduler.get(PRIORITIES) == ("interactive", PRIORITY_INTERACTIVE)
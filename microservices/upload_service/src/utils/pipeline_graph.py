@@ -0,0 +1,140 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Dependency graph of pipeline stages run on a thread pool"""
+
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, Optional
+
+from common.utils.logging_handler import Logger
+from common.utils.metrics import track_stage
+from config import PIPELINE_STAGE_CONCURRENCY
+
+# pylint: disable = broad-except
+
+
+class Stage:
+  """A stage of the graph
+
+  Args:
+    name: unique name of the stage
+    fn: called with the results of deps, in order
+    deps: stages whose results the stage needs, the stage is skipped when
+      one of them failed
+    after: stages that only have to be finished before the stage starts
+  """
+
+  def __init__(self, name: str, fn: Callable, deps: Iterable[str],
+               after: Iterable[str]):
+    self.name = name
+    self.fn = fn
+    self.deps = list(deps)
+    self.after = set(after)
+    self.started = False
+
+
+class PipelineGraph:
+  """Runs stages as soon as the stages they depend on are finished.
+
+  A stage fails when it raises or returns None. Stages may add stages
+  while the graph runs, and a new stage may be added to the after list of
+  a stage that has not started yet, which is how the stages of a document
+  are only known once it is classified.
+  """
+
+  def __init__(self, max_workers: int = PIPELINE_STAGE_CONCURRENCY):
+    self.max_workers = max_workers
+    self.stages = {}
+    self.results = {}
+    self.errors = {}
+    self.lock = threading.Lock()
+
+  def add(self,
+          name: str,
+          fn: Callable,
+          deps: Iterable[str] = (),
+          after: Iterable[str] = (),
+          before: Iterable[str] = ()):
+    """Adds a stage. before lists stages that must wait for this one."""
+    with self.lock:
+      if name in self.stages:
+        raise ValueError(f"Stage {name} already exists")
+      for later in before:
+        if self.stages[later].started:
+          raise ValueError(f"Stage {later} already started")
+        self.stages[later].after.add(name)
+      self.stages[name] = Stage(name, fn, deps, after)
+    return name
+
+  def failed(self, name: str) -> bool:
+    return name in self.results and self.results[name] is None
+
+  def run(self) -> Dict[str, Optional[object]]:
+    """Runs the graph to completion and returns the result of every stage,
+    None for the stages that failed or were skipped"""
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      running = {}
+      while True:
+        for stage in self._ready():
+          args = [self.results[dep] for dep in stage.deps]
+          running[executor.submit(self._run_stage, stage, args)] = stage.name
+        if not running:
+          break
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          name = running.pop(future)
+          try:
+            self.results[name] = future.result()
+          except Exception as e:
+            err = traceback.format_exc().replace("\n", " ")
+            Logger.error(f"Stage {name} failed: {err}")
+            self.errors[name] = e
+            self.results[name] = None
+    for stage in self.stages.values():
+      if not stage.started:
+        Logger.error(f"Stage {stage.name} waits for a missing stage")
+        self.results[stage.name] = None
+    return self.results
+
+  @staticmethod
+  def _run_stage(stage: Stage, args):
+    # Stages of a kind share a metric, named before the ":" of the stage
+    with track_stage(f"pipeline_{stage.name.split(':')[0]}"):
+      return stage.fn(*args)
+
+  def _ready(self):
+    """Marks as started and returns the stages whose dependencies are
+    finished. Loops as skipped stages can make more stages ready."""
+    ready = []
+    with self.lock:
+      while True:
+        batch = [
+            stage for stage in self.stages.values()
+            if not stage.started and all(
+                dep in self.results
+                for dep in stage.deps + list(stage.after))
+        ]
+        if not batch:
+          return ready
+        for stage in batch:
+          stage.started = True
+          if any(self.failed(dep) for dep in stage.deps):
+            Logger.info(f"Skipping stage {stage.name}")
+            self.results[stage.name] = None
+          else:
+            ready.append(stage)
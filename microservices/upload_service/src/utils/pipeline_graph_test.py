@@ -0,0 +1,75 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the pipeline stage graph
+"""
+import threading
+from utils.pipeline_graph import PipelineGraph
+
+
+def test_results_passed_to_dependants():
+  """A stage gets the results of its deps in order"""
+  graph = PipelineGraph(max_workers=2)
+  graph.add("a", lambda: 1)
+  graph.add("b", lambda: 2)
+  graph.add("sum", lambda a, b: a * 10 + b, deps=["a", "b"])
+  assert graph.run()["sum"] == 12
+
+
+def test_independent_stages_run_concurrently():
+  """Two independent stages are running at the same time"""
+  barrier = threading.Barrier(2, timeout=5)
+  graph = PipelineGraph(max_workers=2)
+  graph.add("a", barrier.wait)
+  graph.add("b", barrier.wait)
+  results = graph.run()
+  assert not graph.errors
+  assert sorted([results["a"], results["b"]]) == [0, 1]
+
+
+def test_failed_stage_skips_dependants_only():
+  """A stage that raises or returns None skips the stages depending on it,
+  stages only ordered after it still run"""
+  graph = PipelineGraph(max_workers=2)
+  graph.add("raises", lambda: 1 / 0)
+  graph.add("none", lambda: None)
+  graph.add("dep_raises", lambda x: x, deps=["raises"])
+  graph.add("dep_none", lambda x: x, deps=["none"])
+  graph.add("after", lambda: "ran", after=["raises", "none"])
+  results = graph.run()
+  assert results["dep_raises"] is None
+  assert results["dep_none"] is None
+  assert results["after"] == "ran"
+  assert list(graph.errors) == ["raises"]
+
+
+def test_stages_added_while_running():
+  """A stage can add stages that a later stage waits for"""
+  order = []
+  graph = PipelineGraph(max_workers=2)
+
+  def expand():
+    graph.add("added", lambda: order.append("added") or True,
+              before=["barrier"])
+    return True
+
+  graph.add("expand", expand)
+  graph.add(
+      "barrier", lambda: order.append("barrier") or True, after=["expand"])
+  results = graph.run()
+  assert results["added"] and results["barrier"]
+  assert order == ["added", "barrier"]
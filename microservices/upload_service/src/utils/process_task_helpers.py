@@ -15,14 +15,33 @@ limitations under the License.
 """
 
 """Helper functions to execute the pipeline"""
-import requests
 import traceback
-from fastapi import HTTPException
+from common.db_client import bq_client
+from common.models import ContentIndex
 from common.utils.logging_handler import Logger
+from common.utils.service_client import get_service_client
+from common.utils.format_data_for_bq import format_data_for_bq
+from common.utils.stream_to_bq import stream_document_to_bigquery
 from utils.autoapproval import get_autoapproval_status
-from typing import List, Dict
+from utils.pipeline_graph import PipelineGraph
+from typing import List, Dict, Optional
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
 
+# pylint: disable = broad-except
+
+# Finished once every application form of the case is extracted
+APPLICATIONS_STAGE = "applications"
+
+
+class PipelineFailed(Exception):
+  """Raised when stages of the pipeline of a task failed"""
+
+
+def applications_stage(case_id: str):
+  """Name of the applications stage of a case, a payload may hold the
+  documents of several cases"""
+  return f"{APPLICATIONS_STAGE}:{case_id}"
+
 
 def run_pipeline(payload: List[Dict], is_hitl: bool, is_reassign: bool):
   """Runs the entire pipeline
@@ -30,146 +49,269 @@ def run_pipeline(payload: List[Dict], is_hitl: bool, is_reassign: bool):
     payload (ProcessTask): Consist of configs required to run the pipeline
     is_hitl : It is used to run the pipeline for unclassifed documents
     is_reassign : It is used to run the pipeline for reassigned document
+  Raises:
+    PipelineFailed: when stages failed, the pipeline engine records the
+      message on the task
   """
   Logger.info(f"Processing the documents: {payload}")
-  print(f"Processing the documents: {payload}")
 
-  try:
-    extraction_score = None
-    applications = []
-    supporting_docs = []
-
-    # For unclassified or reassigned documents set the doc_class
-    if is_hitl or is_reassign:
-      result = get_documents(payload)
-      applications = result[0]
-      supporting_docs = result[1]
-    # for other cases like normal flow classify the documents
-    elif not is_reassign:
-      result = filter_documents(payload.get("configs"))
-      applications = result[0]
-      supporting_docs = result[1]
-
-    # for normal flow and for hitl run the extraction of documents
-    if is_hitl or applications or supporting_docs:
-      # extract the application first
-      if applications:
-        for doc in applications:
-          extraction_score = extract_documents(
-              doc, document_type="application_form")
-      # extract,validate and match supporting documents
-      if supporting_docs:
-        for doc in supporting_docs:
-          # In case of reassign extraction is not required
-          if not is_reassign:
-            extraction_output = extract_documents(
-                doc, document_type="supporting_documents")
-            extraction_score = extraction_output[0]
-            extraction_entities = extraction_output[1]
-            Logger.info(f" Executing pipeline for normal scenario {doc}")
-            if extraction_score is not None and extraction_entities:
-              Logger.info(f"extraction score is {extraction_score},{doc}")
-              validate_match_approve(doc, extraction_score, extraction_entities)
-          else:
-            Logger.info(f" Executing pipeline for reassign scenario "
-                        f"{doc}")
-            extraction_score = doc["extraction_score"]
-            extraction_entities = doc["extraction_entities"]
-            validate_match_approve(doc, extraction_score, extraction_entities)
-  except Exception as e:
-    err = traceback.format_exc().replace("\n", " ")
-    Logger.error(err)
-    raise HTTPException(status_code=500, detail=e) from e
+  graph = build_pipeline_graph(payload, is_hitl, is_reassign)
+  graph.run()
+  if graph.errors:
+    raise PipelineFailed(f"Pipeline stages failed: {sorted(graph.errors)}")
+
+
+def build_pipeline_graph(payload: Dict, is_hitl: bool, is_reassign: bool):
+  """Builds the stages of the pipeline of the cases of the payload.
+  Documents are processed independently, only the matching of a supporting
+  document waits for the extraction of the application forms of its case.
+
+  Validation and matching of a document stay in sequence, matching reads
+  and updates the entities written by validation.
+  """
+  graph = PipelineGraph()
+
+  # For unclassified or reassigned documents set the doc_class
+  if is_hitl or is_reassign:
+    applications, supporting_docs = get_documents(payload)
+    for case_id in {doc.get("case_id") for doc in payload.get("configs")}:
+      graph.add(applications_stage(case_id), lambda: True)
+    for doc in applications:
+      add_application_stages(graph, doc)
+    for doc in supporting_docs:
+      add_supporting_stages(graph, doc, is_reassign)
+  # for other cases like normal flow classify the documents, the
+  # extraction of the application forms found is added before the
+  # applications stage
+  else:
+    classify_stages = {}
+    for config in payload.get("configs"):
+      classify_stages.setdefault(config.get("case_id"), []).append(
+          add_classification_stage(graph, config))
+    for case_id, stages in classify_stages.items():
+      graph.add(applications_stage(case_id), lambda: True, after=stages)
+  return graph
+
+
+def add_classification_stage(graph: PipelineGraph, config: Dict):
+  """Classifies the document, then adds the stages for its type"""
+
+  def classify():
+    classification = classify_document(config)
+    if not classification:
+      return None
+    document_type, document_class = classification
+    config["document_class"] = document_class
+    if document_type == "application_form":
+      add_application_stages(graph, config)
+    elif document_type == "supporting_documents":
+      add_supporting_stages(graph, config, False)
+    return document_type
+
+  return graph.add(f"classify:{config.get('uid')}", classify)
+
+
+def add_application_stages(graph: PipelineGraph, doc: Dict):
+  uid = doc.get("uid")
+  graph.add(
+      f"extract:{uid}",
+      lambda: extract_documents(doc, document_type="application_form"),
+      before=[applications_stage(doc.get("case_id"))])
+
+
+def add_supporting_stages(graph: PipelineGraph, doc: Dict, is_reassign: bool):
+  """Extraction, validation, matching and autoapproval of a supporting
+  document"""
+  uid = doc.get("uid")
+
+  def extract():
+    # In case of reassign extraction is not required
+    if is_reassign:
+      Logger.info(f" Executing pipeline for reassign scenario {doc}")
+      extraction_output = (doc["extraction_score"], doc["extraction_entities"])
+    else:
+      Logger.info(f" Executing pipeline for normal scenario {doc}")
+      extraction_output = extract_documents(
+          doc, document_type="supporting_documents")
+    if extraction_output[0] is None or not extraction_output[1]:
+      return None
+    Logger.info(f"extraction score is {extraction_output[0]},{doc}")
+    return extraction_output
+
+  def validate(extraction_output):
+    return validate_document(doc, extraction_output[1])
+
+  def match(*_):
+    return match_document(doc)
+
+  def approve(extraction_output, validation_score, matching_score):
+    update_autoapproval(
+        doc.get("document_class"), "supporting_documents", doc.get("case_id"),
+        uid, validation_score, extraction_output[0], matching_score)
+    return True
+
+  graph.add(f"extract:{uid}", extract)
+  graph.add(f"validate:{uid}", validate, deps=[f"extract:{uid}"])
+  graph.add(
+      f"match:{uid}",
+      match,
+      deps=[f"extract:{uid}", f"validate:{uid}"],
+      after=[applications_stage(doc.get("case_id"))])
+  graph.add(
+      f"approve:{uid}",
+      approve,
+      deps=[f"extract:{uid}", f"validate:{uid}", f"match:{uid}"])
 
 
 def get_classification(case_id: str, uid: str, gcs_url: str):
   """Call the classification API and get the type and class of
   the document"""
-  base_url = "http://classification-service/classification_service/v1/"\
-    "classification/classification_api"
-  req_url = f"{base_url}?case_id={case_id}&uid={uid}" \
-    f"&gcs_url={gcs_url}"
-  response = requests.post(req_url)
-  return response
+  return get_service_client().classify(case_id, uid, gcs_url)
 
 
 def get_extraction_score(case_id: str, uid: str, document_class: str,
                          document_type: str, context: str, gcs_url: str):
   """Call the Extraction API and get the extraction score"""
-  base_url = "http://extraction-service/extraction_service/v1/extraction_api"
-  req_url = f"{base_url}?case_id={case_id}&uid={uid}" \
-    f"&doc_class={document_class}&document_type={document_type}" \
-            f"&context={context}&gcs_url={gcs_url}"
-  response = requests.post(req_url)
-  return response
+  return get_service_client().extract(case_id, uid, document_class,
+                                      document_type, context, gcs_url)
 
 
 def get_validation_score(case_id: str, uid: str, document_class: str,
                          extraction_entities: List[Dict]):
   """Call the validation API and get the validation score"""
-  base_url = "http://validation-service/validation_service/v1/validation/"\
-    "validation_api"
-  req_url = f"{base_url}?case_id={case_id}&uid={uid}" \
-    f"&doc_class={document_class}"
-  response = requests.post(req_url, json=extraction_entities)
-  return response
+  return get_service_client().validate(case_id, uid, document_class,
+                                       extraction_entities)
 
 
 def get_matching_score(case_id: str, uid: str):
   """Call the matching API and get the matching score"""
-  base_url = "http://matching-service/matching_service/v1/"\
-    "match_document"
-  req_url = f"{base_url}?case_id={case_id}&uid={uid}"
-  response = requests.post(req_url)
-  return response
+  return get_service_client().match(case_id, uid)
 
 
 def update_autoapproval_status(case_id: str, uid: str, a_status: str,
                                autoapproved_status: str, is_autoapproved: str):
   """Update auto approval status"""
-  base_url = "http://document-status-service/document_status_service" \
-    "/v1/update_autoapproved_status"
-  req_url = f"{base_url}?case_id={case_id}&uid={uid}" \
-    f"&status={a_status}&autoapproved_status={autoapproved_status}"\
-    f"&is_autoapproved={is_autoapproved}"
-  response = requests.post(req_url)
-  return response
+  return get_service_client().update_autoapproved_status(
+      case_id, uid, a_status, autoapproved_status, is_autoapproved)
+
+
+def update_classification_status(case_id: str, uid: str, status: str,
+                                 document_class: Optional[str] = None,
+                                 document_type: Optional[str] = None):
+  """Update classification status"""
+  return get_service_client().update_classification_status(
+      case_id,
+      uid,
+      status,
+      document_class=document_class,
+      document_type=document_type)
+
+
+def update_extraction_status(case_id: str, uid: str, status: str,
+                             entities: List[Dict], extraction_score: float,
+                             extraction_status: str):
+  """Update extraction status"""
+  return get_service_client().update_extraction_status(
+      case_id, uid, status, entities, extraction_score, extraction_status)
+
+
+def index_content(doc: Dict, **fields):
+  """Record the classification or extraction output of a document against
+  its content hash so byte identical uploads can reuse it"""
+  content_hash = doc.get("content_hash")
+  if not content_hash:
+    return
+  try:
+    entry = ContentIndex.find_by_hash(content_hash)
+    if entry is None:
+      entry = ContentIndex()
+      entry.content_hash = content_hash
+      entry.uid = doc.get("uid")
+    for key, value in fields.items():
+      setattr(entry, key, value)
+    entry.save()
+  except Exception:
+    err = traceback.format_exc().replace("\n", " ")
+    Logger.error(f"Content index update failed for {doc.get('uid')}: {err}")
 
 
-def filter_documents(configs: List[Dict]):
-  """Filter the supporting documents and application form"""
-  print("filter_documents")
-  print(configs)
+def reuse_classification(config: Dict):
+  """Reuse the classification of a byte identical document
 
-  supporting_docs = []
-  application_form = []
-  for config in configs:
-    case_id = config.get("case_id")
-    uid = config.get("uid")
-    gcs_url = config.get("gcs_url")
-    cl_result = get_classification(case_id, uid, gcs_url)
-    if cl_result.status_code == 200:
-      document_type = cl_result.json().get("doc_type")
-      document_class = cl_result.json().get("doc_class")
-      Logger.info(
-          f"Classification successful for {uid}:document_type:{document_type},\
-      document_class:{document_class}.")
-
-      if document_type == "application_form":
-        config["document_class"] = document_class
-        application_form.append(config)
-      elif document_type == "supporting_documents":
-        config["document_class"] = document_class
-        supporting_docs.append(config)
-    else:
-      Logger.error(f"Classification FAILED for {uid}")
-  print(
-      f"Application form:{application_form} and"\
-      f" supporting_docs:{supporting_docs}")
+  Returns:
+    document_type and document_class, or None if nothing to reuse
+  """
+  case_id = config.get("case_id")
+  uid = config.get("uid")
+  entry = ContentIndex.find_by_hash(config.get("content_hash"))
+  if entry is None or not entry.has_classification():
+    return None
+  response = update_classification_status(
+      case_id,
+      uid,
+      STATUS_SUCCESS,
+      document_class=entry.document_class,
+      document_type=entry.document_type)
+  if response.status_code != 200:
+    Logger.error(f"Reused classification status update failed for {uid}")
+    return None
+  Logger.info(f"Reused classification of {entry.uid} for {uid}")
+  return entry.document_type, entry.document_class
+
+
+def reuse_extraction(doc: Dict, document_type: str):
+  """Reuse the extraction output of a byte identical document. The
+  entities are streamed to BigQuery for the new case_id and uid as
+  validation reads them from there.
+
+  Returns:
+    extraction_score and extraction_entities, or None if nothing to reuse
+  """
+  case_id = doc.get("case_id")
+  uid = doc.get("uid")
+  document_class = doc.get("document_class")
+  entry = ContentIndex.find_by_hash(doc.get("content_hash"))
+  if entry is None or not entry.has_extraction(document_class,
+                                               doc.get("context")):
+    return None
+  errors = stream_document_to_bigquery(bq_client(), case_id, uid,
+                                       document_class, document_type,
+                                       format_data_for_bq(entry.entities))
+  if errors:
+    return None
+  response = update_extraction_status(case_id, uid, STATUS_SUCCESS,
+                                      entry.entities, entry.extraction_score,
+                                      entry.extraction_status)
+  if response.status_code != 200:
+    Logger.error(f"Reused extraction status update failed for {uid}")
+    return None
+  Logger.info(f"Reused extraction of {entry.uid} for {uid}")
+  return entry.extraction_score, entry.entities
+
+
+def classify_document(config: Dict):
+  """Classify the document, reusing the output for known content
+
+  Returns:
+    document_type and document_class, or None if classification failed
+  """
+  uid = config.get("uid")
+  reused = reuse_classification(config)
+  if reused:
+    return reused
+  cl_result = get_classification(
+      config.get("case_id"), uid, config.get("gcs_url"))
+  if cl_result.status_code != 200:
+    Logger.error(f"Classification FAILED for {uid}")
+    return None
+  document_type = cl_result.json().get("doc_type")
+  document_class = cl_result.json().get("doc_class")
   Logger.info(
-      f"Application form:{application_form} and "\
-        f"supporting_docs:{supporting_docs}")
-  return application_form, supporting_docs
+      f"Classification successful for {uid}:document_type:{document_type},\
+  document_class:{document_class}.")
+  index_content(
+      config, document_class=document_class, document_type=document_type)
+  return document_type, document_class
 
 
 def extract_documents(doc: Dict, document_type):
@@ -181,14 +323,29 @@ def extract_documents(doc: Dict, document_type):
   document_class = doc.get("document_class")
   context = doc.get("context")
   gcs_url = doc.get("gcs_url")
-  extract_res = get_extraction_score(case_id, uid, document_class,
-                                     document_type, context, gcs_url)
-
-  if extract_res.status_code == 200:
+  reused = reuse_extraction(doc, document_type)
+  if reused:
+    extraction_score, extraction_entities = reused
+    extracted = True
+  else:
+    extract_res = get_extraction_score(case_id, uid, document_class,
+                                       document_type, context, gcs_url)
+    extracted = extract_res.status_code == 200
+    if extracted:
+      extraction_score = extract_res.json().get("score")
+      extraction_entities = extract_res.json().get("entities")
+      index_content(
+          doc,
+          document_class=document_class,
+          document_type=document_type,
+          context=context,
+          entities=extraction_entities,
+          extraction_score=extraction_score,
+          extraction_status=extract_res.json().get("extraction_status"))
+
+  if extracted:
     Logger.info(f"Extraction successful for {document_type}\
        case_id: {case_id} uid:{uid}")
-    extraction_score = extract_res.json().get("score")
-    extraction_entities = extract_res.json().get("entities")
     # if document is application form then update autoapproval status
     if document_type == "application_form":
       autoapproval_status = get_autoapproval_status(None, extraction_score,
@@ -203,33 +360,38 @@ def extract_documents(doc: Dict, document_type):
   return extraction_score, extraction_entities
 
 
-def validate_match_approve(sup_doc: Dict, extraction_score,
-                           extraction_entities):
-  """Perform validation, matching and autoapproval for supporting documents"""
-  validation_score = None
-  matching_score = None
+def validate_document(sup_doc: Dict, extraction_entities):
+  """Perform validation of a supporting document
+
+  Returns:
+    validation score, or None if validation failed
+  """
   case_id = sup_doc.get("case_id")
   uid = sup_doc.get("uid")
-  document_class = sup_doc.get("document_class")
-  document_type = "supporting_documents"
-  validation_res = get_validation_score(case_id, uid, document_class,
+  validation_res = get_validation_score(case_id, uid,
+                                        sup_doc.get("document_class"),
                                         extraction_entities)
-  if validation_res.status_code == 200:
-    print("====Validation successful==========")
-    Logger.info(f"Validation successful for case_id: {case_id} uid:{uid}.")
-    validation_score = validation_res.json().get("score")
-    matching_res = get_matching_score(case_id, uid)
-    if matching_res.status_code == 200:
-      print("====Matching successful==========")
-      Logger.info(f"Matching successful for case_id: {case_id} uid:{uid}.")
-      matching_score = matching_res.json().get("score")
-      update_autoapproval(document_class, document_type, case_id, uid,
-                          validation_score, extraction_score, matching_score)
-    else:
-      Logger.error(f"Matching FAILED for case_id: {case_id} uid:{uid}")
-  else:
-    Logger.error(f"Extraction FAILED for case_id: {case_id} uid:{uid}")
-  return validation_score, matching_score
+  if validation_res.status_code != 200:
+    Logger.error(f"Validation FAILED for case_id: {case_id} uid:{uid}")
+    return None
+  Logger.info(f"Validation successful for case_id: {case_id} uid:{uid}.")
+  return validation_res.json().get("score")
+
+
+def match_document(sup_doc: Dict):
+  """Perform matching of a supporting document with the application form
+
+  Returns:
+    matching score, or None if matching failed
+  """
+  case_id = sup_doc.get("case_id")
+  uid = sup_doc.get("uid")
+  matching_res = get_matching_score(case_id, uid)
+  if matching_res.status_code != 200:
+    Logger.error(f"Matching FAILED for case_id: {case_id} uid:{uid}")
+    return None
+  Logger.info(f"Matching successful for case_id: {case_id} uid:{uid}.")
+  return matching_res.json().get("score")
 
 
 def update_autoapproval(document_class,
@@ -16,26 +16,136 @@ limitations under the License.
 
 """ Upload file to gcs bucket function """
 
+import hashlib
+import json
+from fastapi.concurrency import run_in_threadpool
 from common.config import BUCKET_NAME
-from google.cloud.storage import Blob
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
+from config import UPLOAD_CHUNK_SIZE, PDF_PREFLIGHT_CHUNK_SIZE
+
+_storage_client = None
+_bucket = None
+
+
+def get_bucket():
+  """Returns the upload bucket handle, the client is created once per
+  process and reused. No get_bucket metadata call is made."""
+  global _storage_client, _bucket
+  if _bucket is None:
+    _storage_client = storage.Client()
+    _bucket = _storage_client.bucket(BUCKET_NAME)
+  return _bucket
+
+
+def open_blob_writer(case_id, uid, filename):
+  """Opens a resumable upload writer for the given document"""
+  blob = get_bucket().blob(f"{case_id}/{uid}/{filename}")
+  return blob.open(
+      "wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type="application/pdf")
+
+
+def open_blob_reader(case_id, uid, filename):
+  """Opens a seekable reader of the given document, reading small ranges
+  of the object only where it is read"""
+  blob = get_bucket().blob(f"{case_id}/{uid}/{filename}")
+  return blob.open("rb", chunk_size=PDF_PREFLIGHT_CHUNK_SIZE)
+
+
+def delete_blob(case_id, uid, filename):
+  """Deletes the object of the given document, if it was created"""
+  blob = get_bucket().blob(f"{case_id}/{uid}/{filename}")
+  try:
+    blob.delete()
+  except NotFound:
+    pass
 
 
 def upload_file(case_id, uid, file):
-  client = storage.Client()
-  bucket = client.get_bucket(BUCKET_NAME)
-  blob_name = f"{case_id}/{uid}/{file.filename}"
-  blob = Blob(blob_name, bucket)
-  blob.upload_from_file(file.file)
-  return STATUS_SUCCESS
+  """Streams the uploaded file to the GCS bucket in resumable upload
+  chunks, computing the size and sha256 of the content on the way
+
+  Args:
+    case_id (str): Case id of the file
+    uid (str): uid of the document
+    file (UploadFile): file uploaded by the user
+  Returns:
+    dict with status, size and sha256 of the uploaded content
+  """
+  sha256 = hashlib.sha256()
+  size = 0
+  file.file.seek(0)
+  writer = open_blob_writer(case_id, uid, file.filename)
+  chunk = file.file.read(UPLOAD_CHUNK_SIZE)
+  while chunk:
+    sha256.update(chunk)
+    size += len(chunk)
+    writer.write(chunk)
+    chunk = file.file.read(UPLOAD_CHUNK_SIZE)
+  # Closing the writer uploads the last chunk and finalizes the object,
+  # on a failure the resumable session is left to expire
+  writer.close()
+  return {"status": STATUS_SUCCESS, "size": size, "sha256": sha256.hexdigest()}
+
+
+async def upload_stream(case_id, uid, filename, chunks):
+  """Streams chunks of a request body to the GCS bucket without
+  buffering the whole file on local disk
+
+  Args:
+    case_id (str): Case id of the file
+    uid (str): uid of the document
+    filename (str): name of the file in the bucket
+    chunks: async iterator over the bytes of the file
+  Returns:
+    dict with status, size and sha256 of the uploaded content
+  """
+  sha256 = hashlib.sha256()
+  size = 0
+  writer = await run_in_threadpool(open_blob_writer, case_id, uid, filename)
+  finalized = False
+  try:
+    async for chunk in chunks:
+      if not chunk:
+        continue
+      sha256.update(chunk)
+      size += len(chunk)
+      await run_in_threadpool(writer.write, chunk)
+    await run_in_threadpool(writer.close)
+    finalized = True
+  finally:
+    if not finalized:
+      # The writer is not closed, closing it would finalize a truncated
+      # object. Its resumable session is left to expire, an object
+      # finalized by a close that raised is deleted.
+      await run_in_threadpool(delete_blob, case_id, uid, filename)
+  return {"status": STATUS_SUCCESS, "size": size, "sha256": sha256.hexdigest()}
 
 
 def upload_json_file(case_id, uid, input_data):
   destination_blob_name = f"{case_id}/{uid}/input_data_{case_id}_{uid}.json"
-  storage_client = storage.Client()
-  bucket = storage_client.bucket(BUCKET_NAME)
-  blob = bucket.blob(destination_blob_name)
+  blob = get_bucket().blob(destination_blob_name)
   blob.upload_from_string(input_data)
-  print(case_id + uid + input_data)
   return STATUS_SUCCESS
+
+
+def upload_ndjson_file(blob_name, records):
+  """Writes the records as one newline delimited JSON object
+
+  Returns:
+    gcs url of the object
+  """
+  blob = get_bucket().blob(blob_name)
+  blob.upload_from_string(
+      "".join(json.dumps(record, default=str) + "\n" for record in records),
+      content_type="application/x-ndjson")
+  return f"gs://{BUCKET_NAME}/{blob_name}"
+
+
+def open_ndjson_writer(blob_name):
+  """Opens a resumable upload writer for a newline delimited JSON object
+  written line by line"""
+  blob = get_bucket().blob(blob_name)
+  return blob.open(
+      "w", chunk_size=UPLOAD_CHUNK_SIZE, content_type="application/x-ndjson")
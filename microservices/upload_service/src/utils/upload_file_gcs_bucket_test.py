@@ -0,0 +1,71 @@
+"""
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+  Tests for the streamed upload to the GCS bucket
+"""
+import asyncio
+import hashlib
+from unittest import mock
+import pytest
+from google.api_core.exceptions import NotFound
+from common.config import STATUS_SUCCESS
+from utils import upload_file_gcs_bucket as ug
+
+
+async def stream(chunks, error=None):
+  for chunk in chunks:
+    yield chunk
+  if error is not None:
+    raise error
+
+
+def test_upload_stream_finalizes_the_object():
+  with mock.patch("utils.upload_file_gcs_bucket.open_blob_writer") as opened, \
+    mock.patch("utils.upload_file_gcs_bucket.delete_blob") as delete:
+    result = asyncio.run(
+        ug.upload_stream("case", "uid", "form.pdf",
+                         stream([b"%PDF", b"", b"-1.4"])))
+  writer = opened.return_value
+  assert result == {
+      "status": STATUS_SUCCESS,
+      "size": 8,
+      "sha256": hashlib.sha256(b"%PDF-1.4").hexdigest()
+  }
+  assert writer.write.call_args_list == [mock.call(b"%PDF"),
+                                         mock.call(b"-1.4")]
+  writer.close.assert_called_once()
+  delete.assert_not_called()
+
+
+def test_upload_stream_aborted_on_error():
+  with mock.patch("utils.upload_file_gcs_bucket.open_blob_writer") as opened, \
+    mock.patch("utils.upload_file_gcs_bucket.delete_blob") as delete:
+    with pytest.raises(ConnectionResetError):
+      asyncio.run(
+          ug.upload_stream("case", "uid", "form.pdf",
+                           stream([b"%PDF"], ConnectionResetError())))
+  # A truncated object is not finalized
+  opened.return_value.close.assert_not_called()
+  delete.assert_called_once_with("case", "uid", "form.pdf")
+
+
+def test_delete_blob_not_created():
+  with mock.patch("utils.upload_file_gcs_bucket.get_bucket") as bucket:
+    blob = bucket.return_value.blob.return_value
+    blob.delete.side_effect = NotFound("gone")
+    ug.delete_blob("case", "uid", "form.pdf")
+  bucket.return_value.blob.assert_called_once_with("case/uid/form.pdf")
@@ -16,11 +16,11 @@ limitations under the License.
 
 """ Validation endpoints """
 import traceback
-import requests
 from fastapi import APIRouter, HTTPException, status, Response
 from typing import List, Dict
 from utils.validation import get_values
 from common.utils.logging_handler import Logger
+from common.utils.service_client import get_service_client
 from common.config import STATUS_IN_PROGRESS, STATUS_SUCCESS, STATUS_ERROR
 
 # disabling for linting to pass
@@ -89,13 +89,14 @@ def update_validation_status(case_id: str, uid: str, validation_score: float,
      validation_score (float): validation score calculated by validation api
      status (str): status success/failure depending on the validation_score
     """
-  base_url = "http://document-status-service/document_status_service" \
-    "/v1/update_validation_status"
   if validation_status == STATUS_SUCCESS:
-    req_url = f"{base_url}?case_id={case_id}&uid={uid}" \
-    f"&validation_score={validation_score}&status={validation_status}"
+    response = get_service_client().update_validation_status(
+        case_id,
+        uid,
+        validation_status,
+        entities=validation_entities,
+        validation_score=validation_score)
   else:
-    req_url = f"{base_url}?case_id={case_id}&uid={uid}&" \
-              f"status={validation_status}"
-  response = requests.post(req_url, json=validation_entities)
+    response = get_service_client().update_validation_status(
+        case_id, uid, validation_status, entities=validation_entities)
   return response
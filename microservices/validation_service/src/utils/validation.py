@@ -23,6 +23,7 @@ import pandas as pd
 from google.cloud import storage
 from common.config import PATH, VALIDATION_TABLE
 from common.utils.logging_handler import Logger
+from common.utils.metrics import track_stage
 from common.db_client import bq_client
 import traceback
 
@@ -134,8 +135,9 @@ def get_scoring(data, merge_query, documentlabel, entity):
     query = query.replace("project_table", VALIDATION_TABLE)
     dict1 = get_individual_dict(query)
     try:
-      query_results = bigquery_client.query((query))
-      df = query_results.to_dataframe()
+      with track_stage("validation_query"):
+        query_results = bigquery_client.query((query))
+        df = query_results.to_dataframe()
     except Exception as e:  # pylint: disable=broad-except
       Logger.error(e)
       df = pd.DataFrame()
@@ -126,7 +126,7 @@ resource "google_cloud_run_service" "cloudrun-service" {
           container_port = 8000
         }
         env {
-          name  = "MAX_UPLOADED_DOCS" #thresold value for comparison with the number of uploaded docs in firesotre collection
+          name  = "MAX_UPLOADED_DOCS" #upper bound of the adaptive limit of the uploaded docs waiting for processing
           value = "10"
         }
         env {
@@ -0,0 +1,181 @@
+/**
+ * Copyright 2022 Google LLC
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     https://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ */
+
+# Composite indexes of the document queries. The HITL lists page the
+# active documents newest upload first, ordered by upload_timestamp then
+# the document id (__name__, added by Firestore in the same direction).
+
+locals {
+  document_collection = "${var.database_prefix}document"
+  # HITL lists filtering the active documents on one more field
+  hitl_list_filters = ["current_status", "is_unclassified"]
+  # DB_KEYS the HITL search filters on, active and upload_timestamp are
+  # served by the active_uploads index
+  search_filter_keys = [
+    "auto_approval",
+    "is_autoapproved",
+    "matching_score",
+    "case_id",
+    "uid",
+    "url",
+    "context",
+    "document_class",
+    "document_type",
+    "extraction_score",
+    "is_hitl_classified",
+  ]
+}
+
+# /report_data and /export
+resource "google_firestore_index" "active_uploads" {
+  project    = var.project_id
+  collection = local.document_collection
+
+  fields {
+    field_path = "active"
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path = "upload_timestamp"
+    order      = "DESCENDING"
+  }
+
+  depends_on = [google_app_engine_application.firebase_init]
+}
+
+# /get_queue and /get_unclassified
+resource "google_firestore_index" "active_list_uploads" {
+  for_each   = toset(local.hitl_list_filters)
+  project    = var.project_id
+  collection = local.document_collection
+
+  fields {
+    field_path = "active"
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path = each.value
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path = "upload_timestamp"
+    order      = "DESCENDING"
+  }
+
+  depends_on = [google_app_engine_application.firebase_init]
+}
+
+# /search with a term, each tier looks up one of the search_terms
+resource "google_firestore_index" "active_search_uploads" {
+  project    = var.project_id
+  collection = local.document_collection
+
+  fields {
+    field_path = "active"
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path   = "search_terms"
+    array_config = "CONTAINS"
+  }
+  fields {
+    field_path = "upload_timestamp"
+    order      = "DESCENDING"
+  }
+
+  depends_on = [google_app_engine_application.firebase_init]
+}
+
+# /search with a filter_key
+resource "google_firestore_index" "active_filter_uploads" {
+  for_each   = toset(local.search_filter_keys)
+  project    = var.project_id
+  collection = local.document_collection
+
+  fields {
+    field_path = "active"
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path = each.value
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path = "upload_timestamp"
+    order      = "DESCENDING"
+  }
+
+  depends_on = [google_app_engine_application.firebase_init]
+}
+
+# /search with a filter_key and a term
+resource "google_firestore_index" "active_filter_search_uploads" {
+  for_each   = toset(local.search_filter_keys)
+  project    = var.project_id
+  collection = local.document_collection
+
+  fields {
+    field_path = "active"
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path = each.value
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path   = "search_terms"
+    array_config = "CONTAINS"
+  }
+  fields {
+    field_path = "upload_timestamp"
+    order      = "DESCENDING"
+  }
+
+  depends_on = [google_app_engine_application.firebase_init]
+}
+
+# Timeout sweep of the document status service, the documents in
+# progress last updated before the deadline
+resource "google_firestore_index" "status_last_update" {
+  project    = var.project_id
+  collection = local.document_collection
+
+  fields {
+    field_path = "current_status"
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path = "last_update_timestamp"
+    order      = "ASCENDING"
+  }
+
+  depends_on = [google_app_engine_application.firebase_init]
+}
+
+# Failed pipeline tasks of the upload service are removed once their
+# expire_at passed, the completed ones are deleted by the service
+resource "google_firestore_field" "pipeline_task_expire_at" {
+  project    = var.project_id
+  collection = "${var.database_prefix}pipeline_task"
+  field      = "expire_at"
+
+  ttl_config {}
+  # Not queried, no single field index
+  index_config {}
+
+  depends_on = [google_app_engine_application.firebase_init]
+}
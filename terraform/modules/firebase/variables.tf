@@ -32,3 +32,9 @@ variable "storage_multiregion" {
   type    = string
   default = "us"
 }
+
+variable "database_prefix" {
+  type        = string
+  description = "DATABASE_PREFIX of the services, prepended to the collection names"
+  default     = ""
+}